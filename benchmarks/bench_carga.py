@@ -0,0 +1,100 @@
+# benchmarks/bench_carga.py
+"""
+Compara filas/seg de la carga anterior (to_sql method="multi", chunksize=1000)
+contra la carga con COPY FROM STDIN (cargar_copy) sobre una tabla de prueba.
+
+Uso (usa las mismas variables PG_* del .env):
+    python benchmarks/bench_carga.py --filas 200000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import etl_byd  # noqa: E402
+
+TABLA_BENCH = "bench_sap_byd_ventas"
+
+
+def generar_ventas(filas: int, seed: int = 42) -> pd.DataFrame:
+    """DataFrame sintético con las mismas columnas y tipos que sap_byd_ventas."""
+    rng = np.random.default_rng(seed)
+    ids = rng.integers(0, 100000, size=filas)
+    return pd.DataFrame({
+        "Invoice_Date":       "2026-01-15T00:00:00",
+        "Customer":           pd.Series(ids % 5000).map("C{:05d}".format),
+        "City":               "BOGOTA",
+        "Accounting_Period":  "001",
+        "Invoice":            pd.Series(ids).map("INV{:08d}".format),
+        "FiscalMonthYear":    "01.2026",
+        "Product":            pd.Series(ids % 3000).map("P-{:06d}".format),
+        "Profit_Center":      "PC-100",
+        "Sales_Unit":         "SU-01",
+        "E03_SBU_Name":       rng.choice(["HOGAR", "INDUSTRIAL", "RETAIL"], size=filas),
+        "VENTAS_US":          rng.normal(-500, 200, size=filas),
+        "COSTO_US":           rng.normal(-300, 100, size=filas),
+        "Cantidad_FacUS":     rng.integers(1, 50, size=filas).astype(float),
+        "Customer_Name":      "Cliente de prueba",
+        "State":              "DC",
+        "Country_Region":     "CO",
+        "Ship_To":            "Dirección de entrega",
+        "Person_Responsible": "Vendedor",
+        "periodo_data":       "benchmark",
+    })
+
+
+def _cargar_multi(df: pd.DataFrame, conn) -> None:
+    df.to_sql(
+        name=TABLA_BENCH,
+        con=conn,
+        if_exists="replace",
+        index=False,
+        method="multi",
+        chunksize=1000
+    )
+
+
+def _cargar_copy(df: pd.DataFrame, conn) -> None:
+    etl_byd.cargar_copy(df, conn, TABLA_BENCH, if_exists="replace")
+
+
+def medir(nombre: str, fn, df: pd.DataFrame, repeticiones: int) -> float:
+    engine = etl_byd.get_engine()
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            fn(df, conn)
+        tiempos.append(time.perf_counter() - t0)
+    with engine.begin() as conn:
+        cargadas = conn.execute(text(f"SELECT count(*) FROM {TABLA_BENCH}")).scalar()
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLA_BENCH}"))
+    engine.dispose()
+
+    mejor = min(tiempos)
+    filas_seg = len(df) / mejor if mejor else float("inf")
+    print(f"{nombre:<8} {len(df):>10} filas  {mejor:>8.2f} s  {filas_seg:>12,.0f} filas/seg  (verificadas: {cargadas})")
+    return filas_seg
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=100000)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    df = generar_ventas(args.filas)
+    print(f"\nBenchmark de carga en {TABLA_BENCH} (mejor de {args.repeticiones})")
+    multi = medir("multi", _cargar_multi, df, args.repeticiones)
+    copy = medir("copy", _cargar_copy, df, args.repeticiones)
+    print(f"\nCOPY es {copy / multi:.1f}x más rápido que INSERT multi-fila")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# benchmarks/bench_e2e.py
+"""
+Benchmark de punta a punta sin el tenant: levanta el servidor OData falso
+(servidor_odata.py), apunta el ETL a él con BYD_BASE_URL y ejecuta los flujos
+contra el PostgreSQL de las variables PG_* (usar una base local: se escriben las
+tablas sap_byd_* reales). Reporta filas/seg de punta a punta y por etapa, a partir
+de las mismas métricas que se guardan en etl_run_log.
+
+    python benchmarks/bench_e2e.py --filas 100000 --latencia-ms 150
+    python benchmarks/bench_e2e.py --filas "ventas=300000,*=20000" --flujos ventas,3pl --formato atom
+"""
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import etl_byd  # noqa: E402
+from servidor_odata import iniciar_servidor, parsear_filas  # noqa: E402
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _por_seg(filas: int, segundos: float) -> str:
+    return f"{filas / segundos:>10,.0f}" if segundos else f"{'-':>10}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", default="50000", help="filas por entidad: N o 'ventas=200000,*=20000'")
+    parser.add_argument("--latencia-ms", type=float, default=0.0)
+    parser.add_argument("--ms-por-1000-skip", type=float, default=0.0)
+    parser.add_argument("--flujos", default="", help="flujos a ejecutar separados por coma (por defecto todos)")
+    parser.add_argument("--formato", choices=["json", "atom"], default="json")
+    parser.add_argument("--concurrencia", type=int, default=None)
+    args = parser.parse_args()
+
+    # etl_byd lee el entorno al crear su Config: se arma después de apuntarlo al servidor
+    puerto = _puerto_libre()
+    os.environ.update({
+        "BYD_BASE_URL": f"http://127.0.0.1:{puerto}/sap/byd/odata/",
+        "BYD_FORMATO": args.formato,
+        "BYD_MAX_RPS": os.getenv("BYD_MAX_RPS", "1000"),
+        "ODATA_CACHE": "false",
+        "ODATA_CACHE_DIR": tempfile.mkdtemp(prefix="etl_bench_"),
+        "ETL_RUN_ID": f"bench-{time.strftime('%Y%m%d-%H%M%S')}",
+        "MODO_AUTO": "true",
+    })
+    cfg = etl_byd.configurar(etl_byd.Config())
+
+    t0 = time.perf_counter()
+    servidor = iniciar_servidor(parsear_filas(args.filas), puerto, args.latencia_ms, args.ms_por_1000_skip)
+    print(f"\nServidor OData falso en {servidor.base_url} (datos generados en {time.perf_counter() - t0:.1f} s)")
+
+    nombres = [f.strip() for f in args.flujos.split(",") if f.strip()] or list(etl_byd.FLUJOS)
+    flujos = {n: etl_byd.FLUJOS[n] for n in nombres}
+    cfg.imprimir()
+    t0 = time.perf_counter()
+    resultados = etl_byd.ejecutar_flujos(flujos, args.concurrencia or cfg.etl_max_concurrencia)
+    total = time.perf_counter() - t0
+    servidor.shutdown()
+
+    print(f"\nBenchmark e2e ({args.formato}, latencia {args.latencia_ms:.0f} ms, {servidor.solicitudes} solicitudes)")
+    print(f"{'flujo':<12} {'filas':>9} {'total s':>8} {'filas/s':>10} {'http s':>8} {'MB':>7} "
+          f"{'parseo s':>9} {'transf s':>9} {'carga s':>8} {'carga f/s':>10}")
+    filas_total = 0
+    for r in resultados:
+        m = r["metricas"]
+        filas_total += r["filas"]
+        print(
+            f"{r['flujo']:<12} {r['filas']:>9} {r['segundos']:>8.2f} {_por_seg(r['filas'], r['segundos'])} "
+            f"{m['http_seg']:>8.2f} {m['bytes_recibidos'] / 1e6:>7.1f} {m['parseo_seg']:>9.2f} "
+            f"{m['transformacion_seg']:>9.2f} {m['carga_seg']:>8.2f} {_por_seg(r['filas'], m['carga_seg'])}"
+            + (f"  ❌ {r['error']}" if r["error"] else "")
+        )
+    print(f"\nTotal: {filas_total} filas en {total:.2f} s → {_por_seg(filas_total, total).strip()} filas/seg de punta a punta")
+
+
+if __name__ == "__main__":
+    main()
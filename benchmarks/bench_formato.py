@@ -0,0 +1,82 @@
+# benchmarks/bench_formato.py
+"""
+Compara el formato Atom (XML) contra JSON ($format=json) para las respuestas OData:
+bytes descargados (sin comprimir y con gzip) y tiempo de parseo por cada 10k filas.
+
+Sin argumentos usa un feed sintético con los campos de ventas. Con --url mide contra
+un servicio real (o el servidor falso de benchmarks), usando las credenciales del .env:
+    python benchmarks/bench_formato.py --filas 50000
+    python benchmarks/bench_formato.py --url "https://.../RPZ...QueryResults?$select=...&$top=10000"
+"""
+import argparse
+import gzip
+import io
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import etl_byd  # noqa: E402
+from feeds_sinteticos import feed_atom, feed_json, generar_filas, tipo_edm  # noqa: E402
+
+ENTIDAD_VENTAS = etl_byd.ENTIDAD_VENTAS
+
+
+def _parsear(formato: str, cuerpo: bytes, campos: dict | None, tipos: dict | None) -> int:
+    if formato == "atom":
+        chunks = etl_byd.iterar_atom(io.BytesIO(cuerpo), campos)
+    else:
+        # En JSON los tipos EDM vienen de $metadata (aquí, los del feed sintético)
+        chunks = etl_byd.iterar_json(io.BytesIO(cuerpo), campos, tipos=tipos)
+    df = pd.concat(list(chunks), ignore_index=True)
+    return len(df)
+
+
+def medir(formato: str, cuerpo: bytes, campos: dict | None, repeticiones: int, tipos: dict | None = None) -> None:
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        filas = _parsear(formato, cuerpo, campos, tipos)
+        tiempos.append(time.perf_counter() - t0)
+    mejor = min(tiempos)
+    por_10k = mejor / filas * 10000 if filas else 0.0
+    comprimido = len(gzip.compress(cuerpo, compresslevel=6))
+    print(
+        f"{formato:<5} {filas:>8} filas  {len(cuerpo) / 1e6:>8.2f} MB  {comprimido / 1e6:>7.2f} MB gzip  "
+        f"{por_10k:>7.3f} s/10k filas"
+    )
+
+
+def _descargar(url: str, formato: str) -> bytes:
+    url_fmt = etl_byd._url_json(url) if formato == "json" else url
+    resp = etl_byd.byd_get(url_fmt)
+    return resp.content
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=50000)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--url", help="URL OData a medir (sin $format)")
+    args = parser.parse_args()
+
+    print(f"\n{'fmt':<5} {'filas':>8}        {'bytes':>8}     {'en red':>7}")
+    if args.url:
+        tipos = etl_byd.tipos_edm(args.url)
+        for formato in ("atom", "json"):
+            medir(formato, _descargar(args.url, formato), None, args.repeticiones, tipos)
+        return
+
+    campos = list(etl_byd.CAMPOS_VENTAS)
+    filas = generar_filas(campos, args.filas)
+    medir("atom", feed_atom(ENTIDAD_VENTAS, filas, campos), etl_byd.CAMPOS_VENTAS, args.repeticiones)
+    tipos = {c: tipo_edm(c) for c in campos}
+    medir("json", feed_json(ENTIDAD_VENTAS, filas, campos), etl_byd.CAMPOS_VENTAS, args.repeticiones, tipos)
+
+
+if __name__ == "__main__":
+    main()
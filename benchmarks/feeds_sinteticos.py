@@ -0,0 +1,117 @@
+# benchmarks/feeds_sinteticos.py
+"""
+Generación de respuestas OData v2 sintéticas (Atom y JSON) con los nombres de
+campo reales de los reportes de SAP ByDesign, para medir el ETL sin el tenant.
+"""
+import json
+import random
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+NS_ATOM = "http://www.w3.org/2005/Atom"
+NS_M = "http://schemas.microsoft.com/ado/2007/08/dataservices/metadata"
+NS_D = "http://schemas.microsoft.com/ado/2007/08/dataservices"
+
+_CAMPO_PERIODO = "CFISCALDDATES6F44DC8D81C7C41F"
+_EPOCH = datetime(1970, 1, 1)
+
+
+def tipo_edm(campo: str) -> str:
+    """Tipo EDM con el que SAP expone el campo (K* = cifras clave, *DATE/_DT = fechas)."""
+    if campo.startswith("K") or campo.startswith("FC"):
+        return "Edm.Decimal"
+    if campo != _CAMPO_PERIODO and ("DATE" in campo or campo.endswith("_DT") or campo.startswith("CRELEASERENCE")):
+        return "Edm.DateTime"
+    return "Edm.String"
+
+
+def generar_filas(campos: list[str], n: int, seed: int = 7, inicio: datetime | None = None) -> list[dict]:
+    """Filas con valores plausibles por tipo; el periodo fiscal va en formato MM.YYYY."""
+    rng = random.Random(seed)
+    inicio = inicio or datetime(2026, 1, 1)
+    tipos = {c: tipo_edm(c) for c in campos}
+    filas = []
+    for i in range(n):
+        fecha = inicio + timedelta(days=rng.randrange(0, 60))
+        fila = {}
+        for c in campos:
+            tipo = tipos[c]
+            if c == _CAMPO_PERIODO:
+                fila[c] = fecha.strftime("%m.%Y")
+            elif tipo == "Edm.Decimal":
+                fila[c] = f"{rng.uniform(-5000, 5000):.2f}"
+            elif tipo == "Edm.DateTime":
+                fila[c] = fecha
+            else:
+                fila[c] = f"{c[1:4]}{rng.randrange(0, 2000):05d}"
+        fila["_id"] = i
+        filas.append(fila)
+    return filas
+
+
+def texto_valor(v) -> str:
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%dT%H:%M:%S")
+    return str(v)
+
+
+def feed_atom(entidad: str, filas: list[dict], campos: list[str], count: int | None = None) -> bytes:
+    tipos = {c: tipo_edm(c) for c in campos}
+    partes = [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        f'<feed xmlns="{NS_ATOM}" xmlns:m="{NS_M}" xmlns:d="{NS_D}">',
+        f"<id>{entidad}</id><title type=\"text\">{entidad}</title>",
+    ]
+    if count is not None:
+        partes.append(f"<m:count>{count}</m:count>")
+    for fila in filas:
+        props = []
+        for c in campos:
+            tipo = tipos[c]
+            attr = f' m:type="{tipo}"' if tipo != "Edm.String" else ""
+            props.append(f"<d:{c}{attr}>{escape(texto_valor(fila[c]))}</d:{c}>")
+        partes.append(
+            f"<entry><id>{entidad}('{fila['_id']}')</id><title type=\"text\"/>"
+            f'<content type="application/xml"><m:properties>{"".join(props)}</m:properties></content></entry>'
+        )
+    partes.append("</feed>")
+    return "".join(partes).encode("utf-8")
+
+
+def _valor_json(v):
+    if isinstance(v, datetime):
+        ms = int((v - _EPOCH).total_seconds() * 1000)
+        return f"/Date({ms})/"
+    return v
+
+
+def feed_json(entidad: str, filas: list[dict], campos: list[str], count: int | None = None) -> bytes:
+    resultados = [
+        {"__metadata": {"uri": f"{entidad}('{fila['_id']}')", "type": f"cc_home_analytics.{entidad}"},
+         **{c: _valor_json(fila[c]) for c in campos}}
+        for fila in filas
+    ]
+    d = {"results": resultados}
+    if count is not None:
+        d["__count"] = str(count)
+    return json.dumps({"d": d}, ensure_ascii=False).encode("utf-8")
+
+
+
+def metadata_xml(entidades: dict[str, list[str]], servicio: str = "cc_home_analytics") -> bytes:
+    """Documento $metadata (EDMX) con un EntityType/EntitySet por entidad y el tipo EDM de cada campo."""
+    tipos = []
+    conjuntos = []
+    for entidad, campos in entidades.items():
+        props = "".join(f'<Property Name="{c}" Type="{tipo_edm(c)}" Nullable="true"/>' for c in campos)
+        tipos.append(f'<EntityType Name="{entidad}Type"><Key><PropertyRef Name="ID"/></Key>'
+                     f'<Property Name="ID" Type="Edm.String" Nullable="false"/>{props}</EntityType>')
+        conjuntos.append(f'<EntitySet Name="{entidad}" EntityType="{servicio}.{entidad}Type"/>')
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<edmx:Edmx Version="1.0" xmlns:edmx="http://schemas.microsoft.com/ado/2007/06/edmx">'
+        f'<edmx:DataServices m:DataServiceVersion="2.0" xmlns:m="{NS_M}">'
+        f'<Schema Namespace="{servicio}" xmlns="http://schemas.microsoft.com/ado/2008/09/edm">'
+        f'{"".join(tipos)}<EntityContainer Name="{servicio}_Entities" m:IsDefaultEntityContainer="true">'
+        f'{"".join(conjuntos)}</EntityContainer></Schema></edmx:DataServices></edmx:Edmx>'
+    ).encode("utf-8")
@@ -0,0 +1,328 @@
+# benchmarks/servidor_odata.py
+"""
+Servidor OData v2 falso que reemplaza al tenant de SAP ByDesign en los benchmarks.
+
+Publica las entidades que consume el ETL (ventas, órdenes, costo, 3PL, entrega e
+inventario) con los mismos nombres de campo de sus $select, y responde Atom o JSON
+con $select, $filter (eq/ne/ge/gt/le/and/or/not y paréntesis), $top, $skip,
+$inlinecount y $metadata. Como SAP, responde 400 a `datetime lt`. La latencia se
+inyecta por solicitud y por cada 1000 filas de $skip (paginación profunda).
+
+    python benchmarks/servidor_odata.py --puerto 8765 --filas 100000 --latencia-ms 150
+    BYD_BASE_URL=http://127.0.0.1:8765/sap/byd/odata/ python etl_byd.py
+"""
+import argparse
+import gzip
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+from dateutil.relativedelta import relativedelta
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from feeds_sinteticos import feed_atom, feed_json, generar_filas, metadata_xml, texto_valor  # noqa: E402
+
+RUTA_SERVICIO = "/sap/byd/odata/cc_home_analytics.svc"
+
+# Campos que solo aparecen en los $filter fijos del ETL: valores que los cumplen
+VALORES_FIJOS = {
+    "CPERMEST": "250",
+    "CSETOFBKS": "ZC01",
+    "CBUSINEERENCEBC7B6311A522DAAC": "114",
+    "PAR_SEL_SPA_ID": "250",
+    "PAR_SEL_CATEGORY": "14",
+}
+
+# Claves de negocio del ETL (upsert): únicas por fila, como en SAP
+CAMPOS_UNICOS = ("TITM_UUID",)
+
+_RE_CAMPO_FILTRO = re.compile(r"\b([A-Z][A-Z0-9_]+)\s+(?:eq|ne|ge|gt|le|lt)\s")
+_RE_PERIODO = re.compile(r"^(?:(\d{2})\.(\d{4})|(\d{4})-(\d{2}))$")
+
+
+def entidades_etl() -> dict[str, list[str]]:
+    """{entity_set: campos} a partir de las URLs, $select y $filter definidos en etl_byd."""
+    import etl_byd
+
+    consultas = [
+        (etl_byd.ENTIDAD_VENTAS, etl_byd.SELECT_FIELDS, etl_byd.construir_url()),
+        (etl_byd.ENTIDAD_3PL, etl_byd.SELECT_3PL, etl_byd.filtro_3pl()),
+        (etl_byd.ENTIDAD_ENTREGA, etl_byd.SELECT_ENTREGA, etl_byd.filtro_entrega()),
+    ]
+    for entidad, url in (
+        (etl_byd.ENTIDAD_ORDENES, etl_byd.url_ordenes()),
+        (etl_byd.ENTIDAD_COSTO, etl_byd.CONSULTA_COSTO),
+        (etl_byd.ENTIDAD_INVENTARIO, etl_byd.CONSULTA_INVENTARIO),
+    ):
+        params = dict(parse_qsl(urlsplit(url).query))
+        consultas.append((entidad, params.get("$select", ""), params.get("$filter", "")))
+
+    entidades = {}
+    for entidad, select, filtro in consultas:
+        campos = [c for c in select.split(",") if c]
+        campos += [c for c in _RE_CAMPO_FILTRO.findall(filtro) if c not in campos]
+        entidades[entidad] = campos
+    return entidades
+
+
+def generar_datos(entidades: dict[str, list[str]], filas: dict[str, int], seed: int = 7) -> dict[str, list[dict]]:
+    """Filas sintéticas por entidad, con fechas entre el mes anterior y el siguiente."""
+    inicio = (datetime.now() - relativedelta(months=1)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    datos = {}
+    for entidad, campos in entidades.items():
+        registros = generar_filas(campos, filas.get(entidad, filas.get("*", 10000)), seed=seed, inicio=inicio)
+        for fila in registros:
+            for campo, valor in VALORES_FIJOS.items():
+                if campo in fila:
+                    fila[campo] = valor
+            for campo in CAMPOS_UNICOS:
+                if campo in fila:
+                    fila[campo] = f"{campo[1:4]}{fila['_id']:08d}"
+            if "CDSR_PROC_CATID" in fila:
+                fila["CDSR_PROC_CATID"] = "CA_2" if fila["_id"] % 10 == 0 else "CA_1"
+        datos[entidad] = registros
+    return datos
+
+
+# ----- $filter -----
+_RE_TOKEN = re.compile(r"\s*(\(|\)|datetime'[^']*'|'(?:[^']|'')*'|-?\d+(?:\.\d+)?\b|[A-Za-z_][A-Za-z0-9_]*)")
+
+
+class FiltroInvalido(ValueError):
+    pass
+
+
+def _tokens(filtro: str) -> list[str]:
+    tokens, pos = [], 0
+    filtro = filtro.strip()
+    while pos < len(filtro):
+        m = _RE_TOKEN.match(filtro, pos)
+        if not m:
+            raise FiltroInvalido(f"token inválido en: {filtro[pos:pos + 20]!r}")
+        tokens.append(m.group(1))
+        pos = m.end()
+    return tokens
+
+
+def _clave_orden(valor: str):
+    """SAP compara el periodo fiscal como fecha: MM.YYYY y YYYY-MM se comparan como YYYY-MM."""
+    m = _RE_PERIODO.match(valor)
+    if m:
+        return f"{m.group(2)}-{m.group(1)}" if m.group(1) else valor
+    return valor
+
+
+def _comparar(op: str, valor, literal: str) -> bool:
+    if literal.startswith("datetime'"):
+        izq, der = texto_valor(valor), literal[9:-1]
+    elif literal.startswith("'"):
+        izq, der = _clave_orden(texto_valor(valor)), _clave_orden(literal[1:-1].replace("''", "'"))
+    else:
+        try:
+            izq, der = float(valor), float(literal)
+        except (TypeError, ValueError):
+            return False
+    if op == "eq":
+        return izq == der
+    if op == "ne":
+        return izq != der
+    if op == "ge":
+        return izq >= der
+    if op == "gt":
+        return izq > der
+    if op == "le":
+        return izq <= der
+    return izq < der
+
+
+def compilar_filtro(filtro: str):
+    """Predicado fila -> bool para un $filter OData v2 (subconjunto que usa el ETL)."""
+    tokens = _tokens(filtro)
+    pos = 0
+
+    def siguiente():
+        nonlocal pos
+        if pos >= len(tokens):
+            raise FiltroInvalido("fin inesperado del filtro")
+        pos += 1
+        return tokens[pos - 1]
+
+    def expresion():
+        izq = termino()
+        while pos < len(tokens) and tokens[pos] == "or":
+            siguiente()
+            der = termino()
+            izq = (lambda a, b: lambda f: a(f) or b(f))(izq, der)
+        return izq
+
+    def termino():
+        izq = factor()
+        while pos < len(tokens) and tokens[pos] == "and":
+            siguiente()
+            der = factor()
+            izq = (lambda a, b: lambda f: a(f) and b(f))(izq, der)
+        return izq
+
+    def factor():
+        token = siguiente()
+        if token == "(":
+            pred = expresion()
+            if siguiente() != ")":
+                raise FiltroInvalido("falta ')'")
+            return pred
+        if token == "not":
+            pred = factor()
+            return lambda f: not pred(f)
+        op, literal = siguiente(), siguiente()
+        if op not in ("eq", "ne", "ge", "gt", "le", "lt"):
+            raise FiltroInvalido(f"operador no soportado: {op}")
+        if op == "lt" and literal.startswith("datetime'"):
+            raise FiltroInvalido("Invalid filter: datetime lt")  # igual que SAP ByDesign
+        return lambda f: _comparar(op, f.get(token), literal)
+
+    if not tokens:
+        return lambda f: True
+    pred = expresion()
+    if pos != len(tokens):
+        raise FiltroInvalido(f"sobra texto: {' '.join(tokens[pos:])}")
+    return pred
+
+
+class ServidorOData(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion, datos: dict[str, list[dict]], entidades: dict[str, list[str]],
+                 latencia_ms: float = 0.0, ms_por_1000_skip: float = 0.0):
+        super().__init__(direccion, _Manejador)
+        self.datos = datos
+        self.entidades = entidades
+        self.latencia_ms = latencia_ms
+        self.ms_por_1000_skip = ms_por_1000_skip
+        self.metadata = metadata_xml(entidades)
+        self.solicitudes = 0
+        self._filtrados: dict[tuple[str, str], list[dict]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, puerto = self.server_address[:2]
+        return f"http://{host}:{puerto}/sap/byd/odata/"
+
+    def filtrar(self, entidad: str, filtro: str) -> list[dict]:
+        """Filas que cumplen el filtro; se memorizan por (entidad, filtro) para no re-evaluar en cada página."""
+        clave = (entidad, filtro)
+        with self._lock:
+            if clave in self._filtrados:
+                return self._filtrados[clave]
+        pred = compilar_filtro(filtro)
+        filas = [f for f in self.datos[entidad] if pred(f)]
+        with self._lock:
+            self._filtrados[clave] = filas
+        return filas
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    server: ServidorOData
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.solicitudes += 1
+        partes = urlsplit(self.path)
+        if not partes.path.startswith(RUTA_SERVICIO):
+            return self._responder(404, b"not found", "text/plain")
+        recurso = partes.path[len(RUTA_SERVICIO):].strip("/")
+        if recurso == "$metadata":
+            return self._responder(200, self.server.metadata, "application/xml")
+        if recurso not in self.server.datos:
+            return self._responder(404, f"Resource not found for the segment '{recurso}'".encode(), "text/plain")
+
+        params = dict(parse_qsl(partes.query, keep_blank_values=True))
+        try:
+            filas = self.server.filtrar(recurso, params.get("$filter", ""))
+        except FiltroInvalido as exc:
+            return self._responder(400, str(exc).encode(), "text/plain")
+        skip = int(params.get("$skip", "0") or 0)
+        top = int(params.get("$top", "0") or 0) or len(filas)
+        pagina = filas[skip:skip + top]
+        campos = [c for c in params.get("$select", "").split(",") if c] or self.server.entidades[recurso]
+        count = len(filas) if params.get("$inlinecount") == "allpages" else None
+
+        espera = self.server.latencia_ms + self.server.ms_por_1000_skip * skip / 1000
+        if espera:
+            time.sleep(espera / 1000)
+        if params.get("$format") == "json":
+            return self._responder(200, feed_json(recurso, pagina, campos, count), "application/json")
+        return self._responder(200, feed_atom(recurso, pagina, campos, count), "application/atom+xml")
+
+    def _responder(self, estado: int, cuerpo: bytes, tipo: str) -> None:
+        self.send_response(estado)
+        self.send_header("Content-Type", f"{tipo}; charset=utf-8")
+        if "gzip" in self.headers.get("Accept-Encoding", "") and len(cuerpo) > 1024:
+            cuerpo = gzip.compress(cuerpo, compresslevel=1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def iniciar_servidor(filas: dict[str, int], puerto: int = 0, latencia_ms: float = 0.0,
+                     ms_por_1000_skip: float = 0.0, host: str = "127.0.0.1") -> ServidorOData:
+    """Genera los datos y levanta el servidor en un hilo daemon; retorna el servidor (ver .base_url)."""
+    entidades = entidades_etl()
+    servidor = ServidorOData((host, puerto), generar_datos(entidades, filas), entidades, latencia_ms, ms_por_1000_skip)
+    threading.Thread(target=servidor.serve_forever, name="odata-falso", daemon=True).start()
+    return servidor
+
+
+def parsear_filas(valor: str) -> dict[str, int]:
+    """'100000' o 'ventas=200000,*=20000' -> {entidad_o_alias: filas}."""
+    import etl_byd
+
+    alias = {
+        "ventas": etl_byd.ENTIDAD_VENTAS,
+        "ordenes": etl_byd.ENTIDAD_ORDENES,
+        "costo": etl_byd.ENTIDAD_COSTO,
+        "3pl": etl_byd.ENTIDAD_3PL,
+        "entrega": etl_byd.ENTIDAD_ENTREGA,
+        "inventario": etl_byd.ENTIDAD_INVENTARIO,
+    }
+    if valor.isdigit():
+        return {"*": int(valor)}
+    filas = {}
+    for parte in valor.split(","):
+        nombre, _, n = parte.partition("=")
+        filas[alias.get(nombre.strip(), nombre.strip())] = int(n)
+    return filas
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--filas", default="50000", help="filas por entidad: N o 'ventas=200000,*=20000'")
+    parser.add_argument("--latencia-ms", type=float, default=0.0, help="latencia fija por solicitud")
+    parser.add_argument("--ms-por-1000-skip", type=float, default=0.0, help="latencia extra por cada 1000 filas de $skip")
+    args = parser.parse_args()
+
+    servidor = iniciar_servidor(parsear_filas(args.filas), args.puerto, args.latencia_ms, args.ms_por_1000_skip)
+    print(f"\nServidor OData falso en {servidor.base_url}")
+    for entidad, filas in servidor.datos.items():
+        print(f"  {entidad}: {len(filas)} filas")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
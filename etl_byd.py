@@ -1,63 +1,58 @@
 # etl_byd.py
 from dotenv import load_dotenv
+import argparse
+import contextvars
+import cProfile
+import csv
+import hashlib
+import io
+import json
+import multiprocessing
 import os
-from datetime import datetime
+import pstats
+import queue
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+try:
+    import resource  # solo Unix: pico de memoria (RSS)
+except ImportError:
+    resource = None
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
 from dateutil.relativedelta import relativedelta
+from urllib.parse import parse_qsl, quote, urlsplit
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import ijson
 from lxml import etree
 from sqlalchemy import create_engine, text
-from sqlalchemy.types import String, Float
-
-# Cálculo de fechas independientes
-_hoy_ext = datetime.now()
-_mes_actual_inicio = _hoy_ext.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
-# 3PL: Últimos 6 meses (Mes actual cuenta como 1, restamos 5)
-_inicio_3pl = _mes_actual_inicio - relativedelta(months=5)
-fecha_inicio_3pl = _inicio_3pl.strftime("%Y-%m-%dT00:00:00")
-
-# Órdenes: Últimos 7 meses
-_inicio_ordenes = _mes_actual_inicio - relativedelta(months=6)
-fecha_inicio_ordenes = _inicio_ordenes.strftime("%Y-%m-%dT00:00:00")
-fecha_fiscal_ordenes = _inicio_ordenes.strftime("%Y-%m")
-
-# Entrega de Mercancía: Últimos 2 meses (mes actual + anterior)
-_inicio_entrega = _mes_actual_inicio - relativedelta(months=1)
-fecha_inicio_entrega = _inicio_entrega.strftime("%Y-%m-%dT00:00:00")
+from sqlalchemy.types import BigInteger, String, Float
 
 # ========= CARGA VARIABLES ENTORNO =========
+# Solo carga el .env en os.environ; los parámetros que dependen de la fecha (ventanas,
+# periodos, URLs) y las credenciales se resuelven al primer uso en get_config()
 load_dotenv()
 
-BJD_USER = os.getenv("BJD_USER")
-BJD_PASS = os.getenv("BJD_PASS")
-
-PG_HOST = os.getenv("PG_HOST")
-PG_PORT = int(os.getenv("PG_PORT", "5432"))
-PG_USER = os.getenv("PG_USER")
-PG_PASS = os.getenv("PG_PASS")
-PG_DB   = os.getenv("PG_DB")
-
-# Modo automático: calcula mes actual + mes anterior. Si false, usa FECHA_INICIO y FISCAL_PERIODS_TO_RELOAD
-MODO_AUTO = os.getenv("MODO_AUTO", "true").lower() in ("true", "1", "yes")
-
-# Fecha mínima (desde cuándo traer info de BYD) - solo si MODO_AUTO=false
-FECHA_INICIO = os.getenv("FECHA_INICIO", "2026-01-01T00:00:00")
-
-# Periodos fiscales que se van a limpiar y recargar - solo si MODO_AUTO=false
-# Ejemplo en .env: FISCAL_PERIODS_TO_RELOAD=12.2025,01.2026,02.2026
-FISCAL_PERIODS_TO_RELOAD = os.getenv("FISCAL_PERIODS_TO_RELOAD", "")
-FISCAL_PERIODS_LIST = [
-    p.strip() for p in FISCAL_PERIODS_TO_RELOAD.split(",") if p.strip()
-]
-
-
-def _calcular_ventana_auto() -> tuple[str, str, list[str]]:
+# ========= CONFIGURACIÓN DE LA CORRIDA =========
+def _calcular_ventana_auto(hoy: datetime) -> tuple[str, str, list[str], list[str]]:
     """
     Calcula FECHA_INICIO, FECHA_FIN y periodos fiscales para mes actual + mes anterior.
     El histórico anterior queda intacto.
     """
-    hoy = datetime.now()
     mes_actual = hoy.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     mes_anterior = mes_actual - relativedelta(months=1)
 
@@ -77,27 +72,189 @@ def _calcular_ventana_auto() -> tuple[str, str, list[str]]:
     ]
     return fecha_inicio, fiscal_fin, periodos_mm_yyyy, periodos_yyyy_mm
 
+def _periodos_desde(desde: datetime, hasta: datetime) -> list[str]:
+    """Periodos MM.YYYY desde el mes de `desde` hasta el de `hasta`, inclusive."""
+    mes = desde.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    periodos = []
+    while mes <= hasta:
+        periodos.append(mes.strftime("%m.%Y"))
+        mes += relativedelta(months=1)
+    return periodos
 
-if MODO_AUTO:
-    FECHA_INICIO, FISCAL_FIN, FISCAL_PERIODS_LIST, FISCAL_PERIODS_ALT = _calcular_ventana_auto()
-    FECHA_FIN = ""  # no usamos datetime lt (causa 400 en SAP)
-    print(f"📅 Modo auto: mes actual + anterior → {FISCAL_PERIODS_LIST}")
-else:
-    FECHA_FIN = ""
-    FISCAL_FIN = ""
-    # En modo manual, generar formato alternativo para DELETE (MM.YYYY -> YYYY-MM)
-    FISCAL_PERIODS_ALT = []
-    for p in FISCAL_PERIODS_LIST:
-        parts = p.split(".")
-        if len(parts) == 2:
-            FISCAL_PERIODS_ALT.append(f"{parts[1]}-{parts[0]}")  # YYYY-MM
+class Config:
+    """
+    Parámetros de una corrida: credenciales, raíz OData y ventanas de fechas.
+    `hoy` es la fecha de referencia de las ventanas; `desde` (--since) fija el inicio
+    de todas las ventanas y recarga en ventas todos los periodos desde ese mes.
+    Con `tenant` (ver MULTI-TENANT) el host, las credenciales, los reportes y el
+    schema de destino salen de su configuración en vez del .env.
+    También reúne los ajustes de ejecución (caché, reintentos, paralelismo, modos de
+    carga...): se leen del entorno al crear la corrida y no al importar el módulo,
+    así un valor mal formado falla al arrancar `run` con el nombre de la variable.
+    `run_id` fija el id de la corrida (por defecto ETL_RUN_ID, GITHUB_RUN_ID o la hora).
+    """
+
+    def __init__(self, hoy: datetime | None = None, desde: datetime | None = None, tenant: "Tenant | None" = None,
+                 run_id: str | None = None):
+        self.tenant = tenant
+        self.bjd_user = os.getenv(tenant.usuario_env if tenant else "BJD_USER")
+        self.bjd_pass = os.getenv(tenant.clave_env if tenant else "BJD_PASS")
+        # Raíz de los servicios OData (se cambia para apuntar al servidor falso de benchmarks/)
+        base_url = tenant.base_url if tenant else os.getenv("BYD_BASE_URL", "https://my336154.sapbydesign.com/sap/byd/odata/")
+        self.byd_base_url = base_url.rstrip("/") + "/"
+        # ID del reporte del tenant por ID por defecto (los ENTIDAD_*)
+        self.reportes = {ENTIDADES[f]: r for f, r in tenant.reportes.items()} if tenant else {}
+
+        self.pg_host = os.getenv("PG_HOST")
+        self.pg_port = int(os.getenv("PG_PORT", "5432"))
+        self.pg_user = os.getenv("PG_USER")
+        self.pg_pass = os.getenv("PG_PASS")
+        self.pg_db   = os.getenv("PG_DB")
+        # Schema de las tablas (search_path); vacío = el por defecto del usuario
+        self.pg_schema = tenant.schema if tenant else os.getenv("PG_SCHEMA", "")
+
+        # Modo automático: calcula mes actual + mes anterior. Si false, usa FECHA_INICIO y FISCAL_PERIODS_TO_RELOAD
+        self.modo_auto = os.getenv("MODO_AUTO", "true").lower() in ("true", "1", "yes")
+        self.hoy = hoy or datetime.now()
+        self.desde = desde
+
+        mes_actual = self.hoy.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        # 3PL: Últimos 6 meses (Mes actual cuenta como 1, restamos 5)
+        inicio_3pl = mes_actual - relativedelta(months=5)
+        # Órdenes: Últimos 7 meses
+        inicio_ordenes = mes_actual - relativedelta(months=6)
+        # Entrega de Mercancía: Últimos 2 meses (mes actual + anterior)
+        inicio_entrega = mes_actual - relativedelta(months=1)
+        if desde is not None:
+            inicio_3pl = inicio_ordenes = inicio_entrega = desde
+
+        self.fecha_inicio_3pl = inicio_3pl.strftime("%Y-%m-%dT00:00:00")
+        self.fecha_inicio_ordenes = inicio_ordenes.strftime("%Y-%m-%dT00:00:00")
+        self.fecha_fiscal_ordenes = inicio_ordenes.strftime("%Y-%m")
+        self.fecha_inicio_entrega = inicio_entrega.strftime("%Y-%m-%dT00:00:00")
+
+        if desde is not None:
+            self.fecha_inicio = desde.strftime("%Y-%m-%dT00:00:00")
+            self.fiscal_fin = mes_actual.strftime("%m.%Y")
+            self.periodos = _periodos_desde(desde, mes_actual)
+        elif self.modo_auto:
+            self.fecha_inicio, self.fiscal_fin, self.periodos, _ = _calcular_ventana_auto(self.hoy)
+        else:
+            # Fecha mínima (desde cuándo traer info de BYD)
+            self.fecha_inicio = os.getenv("FECHA_INICIO", "2026-01-01T00:00:00")
+            # Sin filtro de fin: no usamos datetime lt (causa 400 en SAP)
+            self.fiscal_fin = ""
+            # Periodos fiscales que se van a limpiar y recargar
+            # Ejemplo en .env: FISCAL_PERIODS_TO_RELOAD=12.2025,01.2026,02.2026
+            self.periodos = [p.strip() for p in os.getenv("FISCAL_PERIODS_TO_RELOAD", "").split(",") if p.strip()]
+
+        # Formato alternativo para DELETE (MM.YYYY -> YYYY-MM): SAP puede devolver cualquiera
+        self.periodos_alt = []
+        for p in self.periodos:
+            parts = p.split(".")
+            if len(parts) == 2:
+                self.periodos_alt.append(f"{parts[1]}-{parts[0]}")  # YYYY-MM
+
+        # Id de la corrida: checkpoints, etl_run_log, perfiles y archivos Parquet
+        self.run_id = run_id or _run_id_entorno()
+        self.etl_max_concurrencia = int(os.getenv("ETL_MAX_CONCURRENCIA", "3"))
+
+        # HTTP contra ByDesign (ver CLIENTE HTTP); el tenant puede fijar su propio límite
+        self.byd_max_rps = tenant.max_rps if tenant and tenant.max_rps is not None else float(os.getenv("BYD_MAX_RPS", "4"))
+        self.byd_reintentos = int(os.getenv("BYD_REINTENTOS", "4"))
+        self.byd_backoff_seg = float(os.getenv("BYD_BACKOFF_SEG", "2"))
+        # Formato de respuesta OData: "json" ($format=json, más liviano) o "atom" (XML)
+        self.byd_formato = os.getenv("BYD_FORMATO", "json").lower()
+        # Filas por bloque emitido por los parsers; acota la memoria pico por página
+        self.atom_chunk_filas = int(os.getenv("ATOM_CHUNK_FILAS", "5000"))
+        # Páginas en paralelo cuando el servicio informa el total (1 = secuencial)
+        self.odata_paginas_paralelas = int(os.getenv("ODATA_PAGINAS_PARALELAS", "4"))
+
+        # Caché de páginas OData y checkpoints (ver CACHÉ y CHECKPOINTS)
+        self.odata_cache = os.getenv("ODATA_CACHE", "true").lower() in ("true", "1", "yes")
+        self.odata_cache_dir = Path(os.getenv("ODATA_CACHE_DIR", ".etl_cache"))
+        self.odata_cache_max_mb = float(os.getenv("ODATA_CACHE_MAX_MB", "1024"))
+        self.checkpoints_dias = int(os.getenv("CHECKPOINTS_DIAS", "7"))
+
+        # Ventas: ventanas de extracción, formato del periodo y tabla particionada
+        self.ventas_ventana_max_filas = int(os.getenv("VENTAS_VENTANA_MAX_FILAS", "50000"))
+        self.ventas_ventanas_paralelas = int(os.getenv("VENTAS_VENTANAS_PARALELAS", str(self.odata_paginas_paralelas)))
+        self.formato_periodo_dias = float(os.getenv("FORMATO_PERIODO_DIAS", "7"))
+        self.ventas_medir_pushdown = os.getenv("VENTAS_MEDIR_PUSHDOWN", "true").lower() in ("true", "1", "yes")
+        self.ventas_particionada = os.getenv("VENTAS_PARTICIONADA", "true").lower() in ("true", "1", "yes")
+
+        # Carga en PostgreSQL
+        # Filas por bloque enviado con COPY FROM STDIN (acota el buffer CSV en memoria)
+        self.copy_chunksize = int(os.getenv("COPY_CHUNKSIZE", "50000"))
+        self.swap_lock_timeout = os.getenv("SWAP_LOCK_TIMEOUT", "60s")
+        self.carga_por_hash = os.getenv("CARGA_POR_HASH", "true").lower() in ("true", "1", "yes")
+        self.pipeline_carga = os.getenv("PIPELINE_CARGA", "true").lower() in ("true", "1", "yes")
+        self.pipeline_cola_max = int(os.getenv("PIPELINE_COLA_MAX", "4"))
+        self.ordenes_modo_carga = os.getenv("ORDENES_MODO_CARGA", "upsert").lower()
+        self.tablas_resumen = os.getenv("TABLAS_RESUMEN", "true").lower() in ("true", "1", "yes")
+        try:
+            self.indices_extra = json.loads(os.getenv("INDICES_EXTRA") or "{}")
+        except ValueError as exc:
+            raise ValueError(f"INDICES_EXTRA no es un JSON válido: {exc}") from None
+
+        # 3PL en modo delta (ver WATERMARK)
+        self.watermark_delta = os.getenv("WATERMARK_DELTA", "false").lower() in ("true", "1", "yes")
+        self.watermark_solape_dias = float(os.getenv("WATERMARK_SOLAPE_DIAS", "2"))
+        self.watermark_completo_dias = float(os.getenv("WATERMARK_COMPLETO_DIAS", "7"))
+        self.claves_delta = {
+            flujo: [c.strip() for c in os.getenv(f"CLAVES_{flujo.upper()}", spec["claves"]).split(",") if c.strip()]
+            for flujo, spec in DELTAS.items()
+        }
+
+        # Salidas: Parquet (un subdirectorio por tenant), logs JSON y perfiles
+        self.parquet_dir = os.getenv("PARQUET_DIR", "")
+        if self.parquet_dir and tenant is not None:
+            self.parquet_dir = str(Path(self.parquet_dir) / tenant.nombre)
+        self.parquet_compresion = os.getenv("PARQUET_COMPRESION", "zstd")
+        self.parquet_filas_archivo = int(os.getenv("PARQUET_FILAS_ARCHIVO", "500000"))
+        self.parquet_cortes_dias = int(os.getenv("PARQUET_CORTES_DIAS", "30"))
+        self.etl_log_json = os.getenv("ETL_LOG_JSON", "true").lower() in ("true", "1", "yes")
+        self.perfil_dir = Path(os.getenv("PERFIL_DIR", "perfiles"))
+        self.perfil_top = int(os.getenv("PERFIL_TOP", "30"))
+
+    def url(self, entidad: str) -> str:
+        """URL de un entity set del servicio de reportes (cc_home_analytics)."""
+        return f"{self.byd_base_url}cc_home_analytics.svc/{self.reportes.get(entidad, entidad)}"
+
+    def imprimir(self) -> None:
+        if self.tenant is not None:
+            print(f"🏢 Tenant {self.tenant.nombre}: {urlsplit(self.byd_base_url).netloc} → schema {self.pg_schema}")
+        if self.desde is not None:
+            print(f"📅 Desde {self.desde:%Y-%m-%d} (--since) → {self.periodos}")
+        elif self.modo_auto:
+            print(f"📅 Modo auto: mes actual + anterior → {self.periodos}")
+        else:
+            print(f"📅 Modo manual: desde {self.fecha_inicio} → {self.periodos}")
+        print(f"📅 Ventana 3PL: Desde {self.fecha_inicio_3pl}")
+        print(f"📅 Ventana Entrega: Desde {self.fecha_inicio_entrega}")
+
+def _run_id_entorno() -> str:
+    return os.getenv("ETL_RUN_ID") or os.getenv("GITHUB_RUN_ID") or datetime.now().strftime("%Y%m%d-%H%M%S")
+
+_config: Config | None = None
+_lock_config = threading.Lock()
+
+def get_config() -> Config:
+    global _config
+    with _lock_config:
+        if _config is None:
+            _config = Config()
+        return _config
+
+def configurar(config: Config) -> Config:
+    """Reemplaza la configuración de la corrida (CLI, benchmarks)."""
+    global _config
+    with _lock_config:
+        _config = config
+    return config
 
 # ========= CONFIG BYD VENTAS =========
-base_url = (
-    "https://my336154.sapbydesign.com/sap/byd/odata/"
-    "cc_home_analytics.svc/"
-    "RPZE627541F6012E1EBC362E8QueryResults"
-)
+ENTIDAD_VENTAS = "RPZE627541F6012E1EBC362E8QueryResults"
 
 SELECT_FIELDS = (
     "C1CINHUUIDsDOC_INV_DATE,"
@@ -128,158 +285,2603 @@ ns = {
 
 # ========= FUNCIONES GENERALES =========
 def get_engine():
-    conn_str = f"postgresql://{PG_USER}:{PG_PASS}@{PG_HOST}:{PG_PORT}/{PG_DB}"
-    return create_engine(conn_str, pool_pre_ping=True, pool_recycle=300)
+    cfg = get_config()
+    conn_str = f"postgresql://{cfg.pg_user}:{cfg.pg_pass}@{cfg.pg_host}:{cfg.pg_port}/{cfg.pg_db}"
+    # Con schema, las tablas sin calificar (y current_schema()) apuntan a él
+    connect_args = {"options": f"-csearch_path={cfg.pg_schema}"} if cfg.pg_schema else {}
+    return create_engine(conn_str, pool_pre_ping=True, pool_recycle=300, connect_args=connect_args)
+
+def asegurar_schema() -> None:
+    """Crea el schema de la corrida si no existe (search_path apunta a él)."""
+    schema = get_config().pg_schema
+    if not schema:
+        return
+    engine = get_engine()
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {_nombre_calificado(schema)}"))
+    engine.dispose()
 
-# ========= EXTRACCIÓN VENTAS (igual que antes) =========
-def construir_url(skip: int = 0, top: int = 10000) -> str:
-    filtro = (
-        f"(CPOSTDATE ge datetime'{FECHA_INICIO}') and "
-        f"(CDSR_PROC_CATID ne 'CA_2')"
+# ========= CARGA MASIVA (COPY) =========
+def _nombre_calificado(nombre_tabla: str, schema: str | None = None) -> str:
+    nombre = '"{}"'.format(nombre_tabla.replace('"', '""'))
+    if schema:
+        nombre = '"{}".{}'.format(schema.replace('"', '""'), nombre)
+    return nombre
+
+def _copy_filas(conn, nombre_tabla: str, columnas, filas, schema: str | None = None) -> None:
+    """
+    Envía las filas a PostgreSQL con COPY FROM STDIN usando un CSV en memoria.
+    None se escribe como \\N para distinguir NULL de cadena vacía.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for fila in filas:
+        writer.writerow(["\\N" if v is None else v for v in fila])
+    buf.seek(0)
+
+    cols_sql = ", ".join('"{}"'.format(c.replace('"', '""')) for c in columnas)
+    copy_sql = (
+        f"COPY {_nombre_calificado(nombre_tabla, schema)} ({cols_sql}) "
+        "FROM STDIN WITH (FORMAT csv, NULL '\\N')"
     )
-    # SAP ByDesign da 400 con datetime lt; usamos campo fiscal (Date) en su lugar
-    if FISCAL_FIN:
-        filtro += f" and (CFISCALDDATES6F44DC8D81C7C41F le '{FISCAL_FIN}')"
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cur:
+        cur.copy_expert(copy_sql, buf)
 
-    url = (
-        f"{base_url}"
-        f"?$select={SELECT_FIELDS}"
-        f"&$filter={filtro}"
-        f"&$top={top}"
+def _metodo_copy(table, conn, keys, data_iter) -> None:
+    """Callable para `DataFrame.to_sql(method=...)`: inserta cada chunk con COPY."""
+    _copy_filas(conn, table.name, keys, data_iter, schema=table.schema)
+
+def cargar_copy(df: pd.DataFrame, conn, nombre_tabla: str, if_exists: str, dtype: dict | None = None) -> None:
+    """
+    Carga masiva compartida por todos los flujos.
+    `to_sql` sigue creando/reemplazando la tabla con `dtype` (mismo tipado que antes);
+    las filas se envían con COPY en bloques de COPY_CHUNKSIZE en vez de INSERT multi-fila.
+    """
+    df.to_sql(
+        name=nombre_tabla,
+        con=conn,
+        if_exists=if_exists,
+        index=False,
+        dtype=dtype,
+        method=_metodo_copy,
+        chunksize=get_config().copy_chunksize
     )
-    if skip > 0:
-        url += f"&$skip={skip}"
-    return url
 
-def extraer_batch(url: str) -> pd.DataFrame:
-    resp = requests.get(url, auth=(BJD_USER, BJD_PASS), timeout=300)
-    resp.raise_for_status()
-    root = etree.fromstring(resp.content)
+# ========= REEMPLAZO ATÓMICO (STAGING + RENAME) =========
+# Las cargas de reemplazo completo ya no hacen DROP/CREATE de la tabla viva dentro
+# de la transacción de carga: se llena una tabla UNLOGGED de staging y luego se
+# intercambia con RENAME en una transacción corta. Los lectores solo esperan el swap.
+
+_RE_INDEXDEF = re.compile(r"^CREATE (UNIQUE )?INDEX (\S+) ON (?:ONLY )?(\S+) (.*)$", re.S)
+
+def _nombre_staging(nombre: str, sufijo: str = "__stg") -> str:
+    # Los identificadores de PostgreSQL se truncan a 63 bytes
+    return nombre[:63 - len(sufijo)] + sufijo
+
+def _tabla_existe(conn, nombre_tabla: str) -> bool:
+    return conn.dialect.has_table(conn, nombre_tabla)
+
+def _estructura_tabla(conn, nombre_tabla: str) -> dict:
+    """Índices, constraints (PK/UNIQUE/CHECK) y grants de la tabla viva, para replicarlos en staging."""
+    params = {"t": nombre_tabla}
+    constraints = conn.execute(text("""
+        SELECT c.conname, pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        JOIN pg_class t ON t.oid = c.conrelid
+        WHERE t.relname = :t AND t.relnamespace = current_schema()::regnamespace
+          AND c.contype IN ('p', 'u', 'c')
+    """), params).fetchall()
+    indices = conn.execute(text("""
+        SELECT i.indexname, i.indexdef,
+               ARRAY(
+                   SELECT a.attname FROM pg_index x
+                   JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = ANY(x.indkey)
+                   WHERE x.indexrelid = (quote_ident(i.schemaname) || '.' || quote_ident(i.indexname))::regclass
+               ) AS columnas
+        FROM pg_indexes i
+        WHERE i.tablename = :t AND i.schemaname = current_schema()
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_constraint c
+              WHERE c.conindid = (quote_ident(i.schemaname) || '.' || quote_ident(i.indexname))::regclass
+          )
+    """), params).fetchall()
+    grants = conn.execute(text("""
+        SELECT grantee, privilege_type
+        FROM information_schema.role_table_grants
+        WHERE table_name = :t AND table_schema = current_schema() AND grantee <> current_user
+    """), params).fetchall()
+    return {"constraints": constraints, "indices": indices, "grants": grants}
+
+def _replicar_estructura(conn, estructura: dict, staging: str) -> list[tuple[str, str, str]]:
+    """
+    Crea en staging los índices/constraints/grants de la tabla viva con nombres
+    temporales. Retorna los renombres pendientes (tipo, temporal, definitivo) para el swap.
+    """
+    renombres = []
+    destino = _nombre_calificado(staging)
+    for nombre, definicion in estructura["constraints"]:
+        temporal = _nombre_staging(nombre)
+        conn.execute(text(f"ALTER TABLE {destino} ADD CONSTRAINT {_nombre_calificado(temporal)} {definicion}"))
+        renombres.append(("constraint", temporal, nombre))
+    columnas = set(_columnas_tabla(conn, staging)) if estructura["indices"] else set()
+    for nombre, definicion, columnas_indice in estructura["indices"]:
+        m = _RE_INDEXDEF.match(definicion)
+        if not m:
+            print(f"   ⚠️ Índice {nombre} no replicable: {definicion}")
+            continue
+        if not set(columnas_indice) <= columnas:
+            # p. ej. el índice de _row_hash cuando la tabla pasa a cargarse por clave
+            print(f"   Índice {nombre} no se replica: la tabla nueva no tiene {sorted(set(columnas_indice) - columnas)}")
+            continue
+        temporal = _nombre_staging(nombre)
+        conn.execute(text(
+            f"CREATE {m.group(1) or ''}INDEX {_nombre_calificado(temporal)} ON {destino} {m.group(4)}"
+        ))
+        renombres.append(("index", temporal, nombre))
+    for grantee, privilegio in estructura["grants"]:
+        rol = "PUBLIC" if grantee == "PUBLIC" else _nombre_calificado(grantee)
+        conn.execute(text(f"GRANT {privilegio} ON {destino} TO {rol}"))
+    return renombres
+
+def crear_staging(conn, df: pd.DataFrame, nombre_tabla: str, dtype: dict | None = None) -> str:
+    """Crea (vacía) la tabla UNLOGGED de staging con el mismo tipado que usaría to_sql."""
+    staging = _nombre_staging(nombre_tabla)
+    conn.execute(text(f"DROP TABLE IF EXISTS {_nombre_calificado(staging)}"))
+    df.head(0).to_sql(name=staging, con=conn, index=False, dtype=dtype)
+    conn.execute(text(f"ALTER TABLE {_nombre_calificado(staging)} SET UNLOGGED"))
+    return staging
+
+def intercambiar_tabla(engine, nombre_tabla: str, staging: str, sin_indices: set[str] | None = None) -> None:
+    """
+    Deja staging como tabla viva. Primero (sin tocar la tabla viva) la pasa a LOGGED
+    y le replica índices/constraints/grants (salvo los índices de `sin_indices`);
+    luego hace el RENAME en una transacción corta.
+    """
+    viva = _nombre_calificado(nombre_tabla)
+    nueva = _nombre_calificado(staging)
+    vieja = _nombre_staging(nombre_tabla, "__old")
 
-    rows = []
-    for entry in root.findall("atom:entry", ns):
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {nueva} SET LOGGED"))
+        existe = _tabla_existe(conn, nombre_tabla)
+        renombres = []
+        if existe:
+            estructura = _estructura_tabla(conn, nombre_tabla)
+            estructura["indices"] = [i for i in estructura["indices"] if i[0] not in (sin_indices or ())]
+            renombres = _replicar_estructura(conn, estructura, staging)
+
+    t0 = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = '{get_config().swap_lock_timeout}'"))
+        if existe:
+            conn.execute(text(f"ALTER TABLE {viva} RENAME TO {_nombre_calificado(vieja)}"))
+        conn.execute(text(f"ALTER TABLE {nueva} RENAME TO {_nombre_calificado(nombre_tabla)}"))
+        if existe:
+            conn.execute(text(f"DROP TABLE {_nombre_calificado(vieja)}"))
+        for tipo, temporal, definitivo in renombres:
+            if tipo == "constraint":
+                conn.execute(text(
+                    f"ALTER TABLE {viva} RENAME CONSTRAINT {_nombre_calificado(temporal)} TO {_nombre_calificado(definitivo)}"
+                ))
+            else:
+                conn.execute(text(f"ALTER INDEX {_nombre_calificado(temporal)} RENAME TO {_nombre_calificado(definitivo)}"))
+    print(f"   🔁 Swap de {nombre_tabla} en {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+def cargar_replace_atomico(engine, df: pd.DataFrame, nombre_tabla: str, dtype: dict | None = None,
+                           sin_indices: set[str] | None = None) -> None:
+    """Reemplazo completo de `nombre_tabla`: COPY a staging UNLOGGED y swap atómico."""
+    with engine.begin() as conn:
+        staging = crear_staging(conn, df, nombre_tabla, dtype)
+        cargar_copy(df, conn, staging, if_exists="append", dtype=dtype)
+    intercambiar_tabla(engine, nombre_tabla, staging, sin_indices=sin_indices)
+
+# ========= ÍNDICES DECLARADOS =========
+# Índices que usan los joins de los reportes, por tabla. Se aseguran después de
+# cada carga, no se mantienen fila a fila durante el COPY. En los swaps ya vienen
+# replicados desde la tabla viva y construidos sobre staging. Si faltan (tabla
+# nueva, índice inválido) se crean con CREATE INDEX CONCURRENTLY, sin bloquear a
+# lectores ni escritores. En la tabla particionada de ventas PostgreSQL no lo
+# admite y se crea normal. Al final, ANALYZE para que el planner tenga
+# estadísticas frescas. Un índice existente cuyas primeras columnas coinciden
+# (p. ej. el único de la clave del upsert) ya cuenta como declarado.
+# INDICES_EXTRA agrega índices sin tocar el código (JSON tabla -> listas de columnas):
+#   INDICES_EXTRA='{"sap_byd_ordenes": [["Brand"], ["Customer", "FiscalMonthYear"]]}'
+INDICES = {
+    "sap_byd_ventas":                 [("Product",), ("Customer",)],
+    "sap_byd_ordenes":                [("Sales Order",), ("Product",), ("FiscalMonthYear",)],
+    "sap_byd_costo_producto":         [("Material",)],
+    "sap_byd_3pl":                    [("CPRODUCERENCE961D56D7A61936A0",)],
+    "sap_byd_entrega_mercancia":      [("CIBR_SLO_UUID",)],
+    "sap_byd_inventario_disponible":  [("Product",)],
+    "sap_byd_ventas_resumen_mensual": [("FiscalMonthYear",), ("Product",)],
+    "sap_byd_ordenes_abiertas_marca": [("FiscalMonthYear",)],
+}
+
+def indices_declarados(nombre_tabla: str) -> list[tuple[str, ...]]:
+    return INDICES.get(nombre_tabla, []) + [tuple(cols) for cols in get_config().indices_extra.get(nombre_tabla, [])]
+
+def _nombre_indice(nombre_tabla: str, columnas: tuple[str, ...]) -> str:
+    nombre = re.sub(r"\W+", "_", f"ix_{nombre_tabla}_{'_'.join(columnas)}").lower()
+    if len(nombre.encode()) > 63:
+        nombre = nombre[:54] + "_" + hashlib.md5(nombre.encode()).hexdigest()[:8]
+    return nombre
+
+def _indices_existentes(conn, nombre_tabla: str) -> list[tuple[str, bool, list[str]]]:
+    """(nombre, usable, columnas en orden) de cada índice; usable = válido, sin predicado ni expresiones."""
+    return [tuple(f) for f in conn.execute(text("""
+        SELECT c.relname, i.indisvalid AND i.indpred IS NULL AND i.indexprs IS NULL,
+               ARRAY(SELECT a.attname::text
+                     FROM unnest(i.indkey) WITH ORDINALITY AS k(attnum, n)
+                     JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                     ORDER BY k.n)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_class t ON t.oid = i.indrelid
+        WHERE t.relname = :t AND t.relnamespace = current_schema()::regnamespace
+    """), {"t": nombre_tabla}).fetchall()]
+
+def asegurar_indices(engine, nombre_tabla: str, analizar: list[str] | None = None) -> None:
+    """
+    Crea los índices declarados de `nombre_tabla` que falten y hace ANALYZE de la
+    tabla (o solo de `analizar`, p. ej. las particiones recargadas).
+    """
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not _tabla_existe(conn, nombre_tabla):
+            return
+        concurrente = "" if _es_particionada(conn, nombre_tabla) else "CONCURRENTLY "
+        columnas = set(_columnas_tabla(conn, nombre_tabla))
+        existentes = _indices_existentes(conn, nombre_tabla)
+        for cols in indices_declarados(nombre_tabla):
+            faltan = [c for c in cols if c not in columnas]
+            if faltan:
+                print(f"   ⚠️ Índice declarado en {nombre_tabla} sobre columnas inexistentes {faltan}; se omite")
+                continue
+            if any(usable and cols_indice[:len(cols)] == list(cols) for _, usable, cols_indice in existentes):
+                continue
+            nombre = _nombre_indice(nombre_tabla, cols)
+            if any(n == nombre for n, _, _ in existentes):
+                # Quedó inválido (p. ej. un CONCURRENTLY interrumpido): se reconstruye
+                conn.execute(text(f"DROP INDEX {concurrente}IF EXISTS {_nombre_calificado(nombre)}"))
+            t0 = time.perf_counter()
+            conn.execute(text(
+                f"CREATE INDEX {concurrente}{_nombre_calificado(nombre)} ON {_nombre_calificado(nombre_tabla)} "
+                f"({', '.join(_nombre_calificado(c) for c in cols)})"
+            ))
+            print(f"   🗂️ Índice {nombre} creado en {(time.perf_counter() - t0) * 1000:.0f} ms")
+        for tabla in analizar or [nombre_tabla]:
+            conn.execute(text(f"ANALYZE {_nombre_calificado(tabla)}"))
+
+# ========= UPSERT POR CLAVE =========
+def sql_periodo_normalizado(columna: str) -> str:
+    """Expresión SQL que lleva un periodo fiscal MM.YYYY o YYYY-MM a YYYY-MM (comparable como texto)."""
+    col = _nombre_calificado(columna)
+    return (
+        f"CASE WHEN {col} ~ '^[0-9]{{2}}\\.[0-9]{{4}}$' "
+        f"THEN right({col}, 4) || '-' || left({col}, 2) ELSE {col} END"
+    )
+
+def _columnas_tabla(conn, nombre_tabla: str) -> list[str]:
+    return conn.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = :t AND table_schema = current_schema()
+        ORDER BY ordinal_position
+    """), {"t": nombre_tabla}).scalars().all()
+
+def _indices_tabla(conn, nombre_tabla: str) -> list[str]:
+    return conn.execute(text("""
+        SELECT indexname FROM pg_indexes
+        WHERE tablename = :t AND schemaname = current_schema()
+    """), {"t": nombre_tabla}).scalars().all()
+
+def _tiene_indice_unico(conn, nombre_tabla: str, claves: list[str]) -> bool:
+    """True si existe un índice único (o PK) exactamente sobre `claves`, requerido por ON CONFLICT."""
+    filas = conn.execute(text("""
+        SELECT array_agg(a.attname::text ORDER BY a.attname)
+        FROM pg_index i
+        JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = ANY(i.indkey)
+        WHERE t.relname = :t AND t.relnamespace = current_schema()::regnamespace
+          AND i.indisunique AND i.indpred IS NULL
+        GROUP BY i.indexrelid
+    """), {"t": nombre_tabla}).scalars().all()
+    return sorted(claves) in [sorted(f) for f in filas]
+
+def _nombre_indice_unico(nombre_tabla: str) -> str:
+    return _nombre_staging(f"ux_{nombre_tabla}", "_clave")
+
+def _crear_indice_unico(conn, nombre_tabla: str, claves: list[str]) -> None:
+    cols = ", ".join(_nombre_calificado(c) for c in claves)
+    conn.execute(text(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {_nombre_calificado(_nombre_indice_unico(nombre_tabla))} "
+        f"ON {_nombre_calificado(nombre_tabla)} ({cols})"
+    ))
+
+def _historico_repite_claves(conn, nombre_tabla: str, claves: list[str]) -> bool:
+    """True si la tabla viva repite alguna clave (completa): el índice único no se podría crear."""
+    cols = ", ".join(_nombre_calificado(c) for c in claves)
+    completas = " AND ".join(f"{_nombre_calificado(c)} IS NOT NULL" for c in claves)
+    return conn.execute(text(f"""
+        SELECT EXISTS (
+            SELECT 1 FROM {_nombre_calificado(nombre_tabla)} WHERE {completas}
+            GROUP BY {cols} HAVING count(*) > 1
+        )
+    """)).scalar()
+
+def claves_invalidas(df: pd.DataFrame, claves: list[str]) -> pd.Series:
+    """Máscara de las filas con alguna clave vacía o con la clave repetida en el extracto."""
+    vacias = df[claves].astype("string").apply(lambda c: c.str.strip().fillna("").eq("")).any(axis=1)
+    return vacias | df.duplicated(subset=claves, keep=False)
+
+def avisar_claves_invalidas(nombre_tabla: str, claves: list[str], df: pd.DataFrame, malas: pd.Series) -> None:
+    """Informa cuántas filas no cumplen la clave y muestra algunas."""
+    print(f"⚠️ {nombre_tabla}: {int(malas.sum())} filas con la clave {claves} vacía o repetida, p. ej.:")
+    for fila in df.loc[malas, claves].head(5).to_dict("records"):
+        print(f"     {fila}")
+
+def _agregar_columnas(conn, nombre_tabla: str, df: pd.DataFrame, nuevas: list[str], dtype: dict | None) -> None:
+    """
+    Agrega a la tabla viva las columnas nuevas del extracto (NULL en el histórico)
+    con el tipo que les daría `to_sql`: se crea una tabla molde vacía y se copian
+    sus tipos.
+    """
+    molde = _nombre_staging(nombre_tabla, "__cols")
+    tipos_molde = {c: t for c, t in (dtype or {}).items() if c in nuevas}
+    df[nuevas].head(0).to_sql(molde, conn, if_exists="replace", index=False, dtype=tipos_molde or None)
+    tipos = conn.execute(text("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        JOIN pg_class t ON t.oid = a.attrelid
+        WHERE t.relname = :t AND t.relnamespace = current_schema()::regnamespace
+          AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum
+    """), {"t": molde}).fetchall()
+    for col, tipo in tipos:
+        conn.execute(text(
+            f"ALTER TABLE {_nombre_calificado(nombre_tabla)} ADD COLUMN IF NOT EXISTS {_nombre_calificado(col)} {tipo}"
+        ))
+    conn.execute(text(f"DROP TABLE {_nombre_calificado(molde)}"))
+
+def upsert_por_clave(engine, df: pd.DataFrame, nombre_tabla: str, claves: list[str],
+                     dtype: dict | None = None, ventana_sql: str | None = None,
+                     ventana_params: dict | None = None) -> dict:
+    """
+    Carga incremental por clave de negocio:
+    1. COPY de `df` a una tabla temporal con la forma de la tabla viva.
+    2. DELETE de las filas de la ventana refrescada (`ventana_sql`) cuya clave ya no vino.
+    3. INSERT ... ON CONFLICT (claves) DO UPDATE solo si algún valor cambió.
+    Todo en una transacción; fuera de la ventana el histórico no se toca.
+
+    Si la tabla no existe se crea con un reemplazo atómico. Si le faltan columnas
+    del extracto se agregan (ALTER TABLE) y si no tiene índice único sobre las
+    claves se crea, ambos dentro de la misma transacción: el histórico fuera de
+    la ventana nunca se reemplaza con el extracto.
+    Si alguna clave del extracto viene vacía o repetida, la corrida degrada a un
+    reemplazo atómico sin índice único (se informan las filas) en vez de fallar;
+    lo mismo si la tabla sin índice ya repite claves (quedó de un reemplazo así).
+    Retorna el conteo de filas insertadas, actualizadas, eliminadas y sin cambios.
+    """
+    reemplazo = {"insertadas": len(df), "actualizadas": 0, "eliminadas": 0, "sin_cambios": 0}
+    # ON CONFLICT nunca empareja claves NULL (se reinsertarían en cada corrida) y
+    # descartar repetidas perdería filas: esta corrida se carga como reemplazo
+    malas = claves_invalidas(df, claves)
+    if malas.any():
+        avisar_claves_invalidas(nombre_tabla, claves, df, malas)
+        print(f"   {nombre_tabla}: reemplazo completo sin índice único en esta corrida")
+        cargar_replace_atomico(engine, df, nombre_tabla, dtype=dtype, sin_indices={_nombre_indice_unico(nombre_tabla)})
+        return reemplazo
+
+    with engine.connect() as conn:
+        existe = _tabla_existe(conn, nombre_tabla)
+        columnas_vivas = _columnas_tabla(conn, nombre_tabla) if existe else []
+        con_indice = existe and _tiene_indice_unico(conn, nombre_tabla, claves)
+        repite = existe and not con_indice and _historico_repite_claves(conn, nombre_tabla, claves)
+
+    if not existe or repite:
+        motivo = "tabla nueva" if not existe else "la tabla repite claves de un reemplazo anterior"
+        print(f"   {nombre_tabla}: {motivo}; reemplazo completo y se crea el índice único {claves}")
+        cargar_replace_atomico(engine, df, nombre_tabla, dtype=dtype)
+        with engine.begin() as conn:
+            _crear_indice_unico(conn, nombre_tabla, claves)
+        return reemplazo
+    nuevas = [c for c in df.columns if c not in columnas_vivas]
+
+    tabla = _nombre_calificado(nombre_tabla)
+    temporal = _nombre_staging(nombre_tabla, "__tmp")
+    cols = list(df.columns)
+    cols_sql = ", ".join(_nombre_calificado(c) for c in cols)
+    no_claves = [c for c in cols if c not in claves]
+    conflicto = ", ".join(_nombre_calificado(c) for c in claves)
+    join_claves = " AND ".join(f"s.{_nombre_calificado(c)} = t.{_nombre_calificado(c)}" for c in claves)
+
+    if no_claves:
+        set_sql = ", ".join(f"{_nombre_calificado(c)} = EXCLUDED.{_nombre_calificado(c)}" for c in no_claves)
+        cambio = (
+            f"({', '.join(f't.{_nombre_calificado(c)}' for c in no_claves)}) IS DISTINCT FROM "
+            f"({', '.join(f'EXCLUDED.{_nombre_calificado(c)}' for c in no_claves)})"
+        )
+        on_conflict = f"DO UPDATE SET {set_sql} WHERE {cambio}"
+    else:
+        on_conflict = "DO NOTHING"
+
+    with engine.begin() as conn:
+        if nuevas:
+            print(f"   {nombre_tabla}: columnas nuevas {nuevas}; se agregan a la tabla")
+            _agregar_columnas(conn, nombre_tabla, df, nuevas, dtype)
+        if not con_indice:
+            print(f"   {nombre_tabla}: sin índice único; se crea sobre {claves}")
+            _crear_indice_unico(conn, nombre_tabla, claves)
+        conn.execute(text(
+            f"CREATE TEMP TABLE {_nombre_calificado(temporal)} (LIKE {tabla} INCLUDING DEFAULTS) ON COMMIT DROP"
+        ))
+        _copy_filas(conn, temporal, cols, df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+        eliminadas = 0
+        if ventana_sql:
+            eliminadas = conn.execute(text(f"""
+                DELETE FROM {tabla} t
+                WHERE ({ventana_sql})
+                  AND NOT EXISTS (SELECT 1 FROM {_nombre_calificado(temporal)} s WHERE {join_claves})
+            """), ventana_params or {}).rowcount
+
+        insertadas, actualizadas = conn.execute(text(f"""
+            WITH r AS (
+                INSERT INTO {tabla} AS t ({cols_sql})
+                SELECT {cols_sql} FROM {_nombre_calificado(temporal)}
+                ON CONFLICT ({conflicto}) {on_conflict}
+                RETURNING (xmax = 0) AS insertada
+            )
+            SELECT count(*) FILTER (WHERE insertada), count(*) FILTER (WHERE NOT insertada) FROM r
+        """)).one()
+
+    return {
+        "insertadas": insertadas,
+        "actualizadas": actualizadas,
+        "eliminadas": eliminadas,
+        "sin_cambios": len(df) - insertadas - actualizadas,
+    }
+
+# ========= CAMBIOS POR HASH DE FILA =========
+# Tablas de reemplazo: se guarda un hash del contenido de cada fila en una columna
+# oculta y solo se escriben las diferencias (filas nuevas y filas que desaparecieron).
+# Una fila modificada cuenta como una eliminación más una inserción.
+COLUMNA_HASH = "_row_hash"
+
+def hash_filas(df: pd.DataFrame, vistos: Counter | None = None) -> pd.Series:
+    """
+    Hash vectorizado (int64) del contenido de cada fila. Las filas idénticas
+    repetidas se distinguen por su número de ocurrencia, así el hash es único
+    y el diff por conjuntos conserva los duplicados legítimos.
+    Con `vistos` (compartido entre los chunks de un mismo extracto) la ocurrencia
+    se cuenta a través de los chunks: el resultado es el mismo que sobre el concat.
+    """
+    base = pd.util.hash_pandas_object(df.astype(str), index=False)
+    ocurrencia = base.groupby(base).cumcount()
+    if vistos is not None:
+        claves = base.tolist()
+        ocurrencia += [vistos[h] for h in claves]
+        vistos.update(claves)
+    combinado = pd.util.hash_pandas_object(
+        pd.DataFrame({"h": base.to_numpy(), "n": ocurrencia.to_numpy()}), index=False
+    )
+    return pd.Series(combinado.to_numpy().view("int64"), index=df.index, name=COLUMNA_HASH)
+
+def _crear_indice_hash(engine, nombre_tabla: str) -> None:
+    indice = _nombre_staging(f"ix_{nombre_tabla}", f"_{COLUMNA_HASH}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {_nombre_calificado(indice)} "
+            f"ON {_nombre_calificado(nombre_tabla)} ({_nombre_calificado(COLUMNA_HASH)})"
+        ))
+
+def cargar_por_hash(engine, df: pd.DataFrame, nombre_tabla: str, dtype: dict | None = None) -> dict:
+    """
+    Aplica solo el delta entre `df` y la tabla viva comparando `_row_hash`:
+    DELETE de los hashes que ya no vinieron e INSERT (COPY) de los nuevos, en una
+    transacción. Si la tabla no existe o cambió de columnas, reemplazo atómico.
+    """
+    df = df.assign(**{COLUMNA_HASH: hash_filas(df)})
+    dtype = {**(dtype or {}), COLUMNA_HASH: BigInteger}
+
+    with engine.connect() as conn:
+        existe = _tabla_existe(conn, nombre_tabla)
+        columnas_vivas = _columnas_tabla(conn, nombre_tabla) if existe else []
+
+    if not existe or set(columnas_vivas) != set(df.columns):
+        motivo = "tabla nueva" if not existe else "cambiaron las columnas"
+        print(f"   {nombre_tabla}: {motivo}; reemplazo completo con {COLUMNA_HASH}")
+        cargar_replace_atomico(engine, df, nombre_tabla, dtype=dtype)
+        _crear_indice_hash(engine, nombre_tabla)
+        return {"insertadas": len(df), "eliminadas": 0, "sin_cambios": 0}
+
+    tabla = _nombre_calificado(nombre_tabla)
+    with engine.begin() as conn:
+        almacenados = pd.Series(
+            conn.execute(text(f"SELECT {_nombre_calificado(COLUMNA_HASH)} FROM {tabla}")).scalars().all(),
+            dtype="int64",
+        )
+        a_insertar = df[~df[COLUMNA_HASH].isin(almacenados)]
+        a_borrar = almacenados[~almacenados.isin(df[COLUMNA_HASH])]
+
+        if len(a_borrar):
+            temporal = _nombre_staging(nombre_tabla, "__del")
+            conn.execute(text(f"CREATE TEMP TABLE {_nombre_calificado(temporal)} (h bigint) ON COMMIT DROP"))
+            _copy_filas(conn, temporal, ["h"], ((int(h),) for h in a_borrar))
+            conn.execute(text(
+                f"DELETE FROM {tabla} t USING {_nombre_calificado(temporal)} d "
+                f"WHERE t.{_nombre_calificado(COLUMNA_HASH)} = d.h"
+            ))
+        if len(a_insertar):
+            cargar_copy(a_insertar[columnas_vivas], conn, nombre_tabla, if_exists="append", dtype=dtype)
+
+    return {
+        "insertadas": len(a_insertar),
+        "eliminadas": len(a_borrar),
+        "sin_cambios": len(df) - len(a_insertar),
+    }
+
+def cargar_reemplazo(engine, df: pd.DataFrame, nombre_tabla: str, dtype: dict | None = None) -> None:
+    """Carga de reemplazo: delta por hash (CARGA_POR_HASH) o swap atómico completo."""
+    if not get_config().carga_por_hash:
+        cargar_replace_atomico(engine, df, nombre_tabla, dtype=dtype)
+    else:
+        stats = cargar_por_hash(engine, df, nombre_tabla, dtype=dtype)
+        print(
+            f"   {nombre_tabla}: {stats['insertadas']} insertadas, {stats['eliminadas']} eliminadas, "
+            f"{stats['sin_cambios']} sin cambios"
+        )
+    asegurar_indices(engine, nombre_tabla)
+
+# ========= PIPELINE EXTRACCIÓN → CARGA =========
+# Los flujos paginados no juntan el extracto completo antes de abrir la conexión:
+# cada chunk decodificado pasa por una cola acotada a un hilo cargador que lo
+# copia (COPY) a staging mientras se descargan los siguientes. El swap (o el
+# reemplazo de particiones) sigue siendo atómico al final. Con la cola llena los
+# productores esperan y no piden más: en memoria hay a lo sumo PIPELINE_COLA_MAX
+# chunks en cola más un chunk (o, en ventas, una ventana) por worker de descarga.
+# PIPELINE_CARGA=false: se descarga todo y luego se carga (mismo código, en serie).
+
+_FIN_COLA = object()
+_ABORTAR_COLA = object()
+
+class PipelineCarga:
+    """
+    Productor/consumidor entre extracción y carga. `emitir(df)` encola un chunk
+    (espera si la cola está llena); el hilo cargador lo entrega a
+    `destino.cargar(conn, df)` de cada destino, todo en una transacción que cierra
+    `destino.finalizar(conn)`. Al salir del `with` sin errores se llama a
+    `destino.publicar(engine)` (el swap). Si falla la carga, `emitir` propaga el
+    error al productor; si falla la extracción, la transacción se revierte.
+    """
+
+    def __init__(self, engine, destinos: list, nombre: str):
+        self.engine = engine
+        self.destinos = destinos
+        self.nombre = nombre
+        self.cola = queue.Queue(maxsize=max(1, get_config().pipeline_cola_max) if get_config().pipeline_carga else 0)
+        self.error = None
+        self.carga_seg = 0.0
+        # La carga corre fuera de etapa(): su perfil se arma aquí (cargador + publicar)
+        self.perfil = PerfilEtapa("carga") if PERFILAR else None
+        if self.perfil is not None:
+            self.perfil.iniciar(perfilar_hilo=False)
+        self.hilo = threading.Thread(
+            target=contextvars.copy_context().run, args=(perfilado(self._cargar, self.perfil),),
+            name=f"carga-{nombre}", daemon=True,
+        )
+
+    def __enter__(self):
+        if get_config().pipeline_carga:
+            self.hilo.start()
+        return self
+
+    def _cargar(self) -> None:
+        try:
+            with self.engine.begin() as conn:
+                while True:
+                    df = self.cola.get()
+                    if df is _ABORTAR_COLA:
+                        raise RuntimeError(f"extracción de {self.nombre} interrumpida; carga revertida")
+                    t0 = time.perf_counter()
+                    if df is _FIN_COLA:
+                        for destino in self.destinos:
+                            destino.finalizar(conn)
+                        self.carga_seg += time.perf_counter() - t0
+                        return
+                    for destino in self.destinos:
+                        destino.cargar(conn, df)
+                    self.carga_seg += time.perf_counter() - t0
+        except BaseException as exc:
+            self.error = exc
+
+    def _encolar(self, item) -> None:
+        while self.error is None:
+            try:
+                self.cola.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if not self.hilo.is_alive():
+                    break
+        raise self.error
+
+    def emitir(self, df: pd.DataFrame) -> None:
+        if not df.empty:
+            self._encolar(df)
+
+    def _publicar(self) -> None:
+        for destino in self.destinos:
+            destino.publicar(self.engine)
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        try:
+            if not get_config().pipeline_carga:
+                if exc is not None:
+                    return False
+                self.hilo.start()
+            try:
+                self._encolar(_FIN_COLA if exc is None else _ABORTAR_COLA)
+            except BaseException:
+                pass
+            self.hilo.join()
+            if exc is None and self.error is not None:
+                raise self.error
+            if exc is None:
+                t0 = time.perf_counter()
+                perfilado(self._publicar, self.perfil)()
+                self.carga_seg += time.perf_counter() - t0
+        finally:
+            if self.perfil is not None:
+                self.perfil.terminar()
+        registrar(carga_seg=self.carga_seg)
+        log_json("etapa", etapa="carga", segundos=round(self.carga_seg, 3), rss_pico_proceso_mb=rss_pico_proceso_mb())
+        return False
+
+def ejecutar_pipeline(nombre: str, destino, producir) -> int:
+    """
+    Corre `producir(emitir)` (la extracción) con la carga en paralelo hacia
+    `destino` (y su salida Parquet, si está activa). Retorna las filas cargadas.
+    `extraccion_seg` mide la extracción y `carga_seg` el tiempo ocupado del
+    cargador; se solapan.
+    """
+    engine = get_engine()
+    destinos = [destino]
+    parquet = destino_parquet(destino.nombre_tabla)
+    if parquet is not None:
+        destinos.append(parquet)
+    try:
+        with PipelineCarga(engine, destinos, nombre) as pipeline:
+            with etapa("extraccion"):
+                producir(pipeline.emitir)
+    finally:
+        engine.dispose()
+    return destino.filas
+
+class DestinoReemplazo:
+    """
+    Reemplazo completo de una tabla alimentado por chunks (mismo resultado que
+    `cargar_reemplazo`). Los chunks van por COPY a staging UNLOGGED; al final:
+    - CARGA_POR_HASH: diff por `_row_hash` contra la tabla viva en SQL (DELETE de
+      los que no vinieron + INSERT de los nuevos) en la misma transacción;
+    - si no, o si la tabla no existe/cambió de columnas: swap atómico de staging.
+    Los índices de `sin_indices` (p. ej. el único que deja el upsert del delta) no
+    pasan a la tabla nueva; si la tabla viva los tiene, se hace el swap.
+    """
+
+    def __init__(self, nombre_tabla: str, dtype: dict | None = None, sin_indices: set[str] | None = None):
+        self.nombre_tabla = nombre_tabla
+        self.dtype = {**(dtype or {}), **({COLUMNA_HASH: BigInteger} if get_config().carga_por_hash else {})}
+        self.sin_indices = sin_indices or set()
+        self.staging = None
+        self.vistos = Counter()
+        self.filas = 0
+        self.swap = False
+        self.stats = None
+
+    def cargar(self, conn, df: pd.DataFrame) -> None:
+        if get_config().carga_por_hash:
+            df = df.assign(**{COLUMNA_HASH: hash_filas(df, self.vistos)})
+        if self.staging is None:
+            self.staging = crear_staging(conn, df, self.nombre_tabla, self.dtype)
+        cargar_copy(df, conn, self.staging, if_exists="append", dtype=self.dtype)
+        self.filas += len(df)
+
+    def finalizar(self, conn) -> None:
+        if self.staging is None:
+            return
+        existe = _tabla_existe(conn, self.nombre_tabla)
+        columnas_vivas = _columnas_tabla(conn, self.nombre_tabla) if existe else []
+        sobrantes = self.sin_indices & set(_indices_tabla(conn, self.nombre_tabla)) if existe else set()
+        if (not get_config().carga_por_hash or not existe or sobrantes
+                or set(columnas_vivas) != set(_columnas_tabla(conn, self.staging))):
+            if get_config().carga_por_hash:
+                if not existe:
+                    motivo = "tabla nueva"
+                elif sobrantes:
+                    motivo = f"sin el índice {', '.join(sorted(sobrantes))}"
+                else:
+                    motivo = "cambiaron las columnas"
+                print(f"   {self.nombre_tabla}: {motivo}; reemplazo completo con {COLUMNA_HASH}")
+            self.swap = True
+            return
+
+        viva = _nombre_calificado(self.nombre_tabla)
+        staging = _nombre_calificado(self.staging)
+        h = _nombre_calificado(COLUMNA_HASH)
+        cols_sql = ", ".join(_nombre_calificado(c) for c in columnas_vivas)
+        conn.execute(text(f"ANALYZE {staging}"))
+        eliminadas = conn.execute(text(
+            f"DELETE FROM {viva} t WHERE NOT EXISTS (SELECT 1 FROM {staging} s WHERE s.{h} = t.{h})"
+        )).rowcount
+        insertadas = conn.execute(text(
+            f"INSERT INTO {viva} ({cols_sql}) SELECT {cols_sql} FROM {staging} s "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {viva} t WHERE t.{h} = s.{h})"
+        )).rowcount
+        conn.execute(text(f"DROP TABLE {staging}"))
+        self.stats = {"insertadas": insertadas, "eliminadas": eliminadas, "sin_cambios": self.filas - insertadas}
+
+    def publicar(self, engine) -> None:
+        if self.staging is None:
+            return
+        if self.swap:
+            intercambiar_tabla(engine, self.nombre_tabla, self.staging, sin_indices=self.sin_indices)
+            if get_config().carga_por_hash:
+                _crear_indice_hash(engine, self.nombre_tabla)
+        else:
+            print(
+                f"   {self.nombre_tabla}: {self.stats['insertadas']} insertadas, {self.stats['eliminadas']} eliminadas, "
+                f"{self.stats['sin_cambios']} sin cambios"
+            )
+        asegurar_indices(engine, self.nombre_tabla)
+
+# ========= SALIDA PARQUET =========
+# Segunda salida para análisis: cada flujo escribe lo mismo que carga en PostgreSQL
+# como dataset Parquet (zstd) particionado al estilo Hive bajo PARQUET_DIR/<tabla>/.
+# - ventas y órdenes, por FiscalMonthYear (MM.YYYY): se reemplazan las particiones
+#   que la carga a PostgreSQL reemplaza (periodos recargados / ventana del upsert);
+# - el resto, por fecha_corte (día de la corrida): se reemplaza el corte del día y
+#   se conservan PARQUET_CORTES_DIAS días de cortes anteriores.
+# Todo se escribe en un directorio temporal (los lectores ignoran los que empiezan
+# con '.') y se publica con rename por partición. Vacío = desactivado.
+
+PARQUET_POR_PERIODO = ("sap_byd_ventas", "sap_byd_ordenes")
+
+class DestinoParquet:
+    """
+    Dataset Parquet particionado por `columna`. `reemplaza(valor)` indica qué
+    particiones se reescriben completas (las que no vinieron en la corrida se
+    borran); las filas de las demás se agregan como archivos nuevos. Con
+    `reemplaza=None` se reemplaza el dataset entero.
+    """
+
+    def __init__(self, nombre_tabla: str, columna: str, reemplaza=None, valor_fijo: str | None = None):
+        cfg = get_config()
+        self.nombre_tabla = nombre_tabla
+        self.columna = columna
+        self.reemplaza = reemplaza
+        self.valor_fijo = valor_fijo
+        self.dataset = Path(cfg.parquet_dir) / nombre_tabla
+        self.temporal = Path(cfg.parquet_dir) / f".tmp-{nombre_tabla}-{cfg.run_id}"
+        self.pendientes: dict[str, list[pd.DataFrame]] = {}
+        self.archivos = Counter()
+        self.filas = 0
+        shutil.rmtree(self.temporal, ignore_errors=True)
+
+    def _directorio(self, valor: str) -> str:
+        return f"{self.columna}={quote(valor, safe='')}"
+
+    def _escribir(self, valor: str) -> None:
+        df = pd.concat(self.pendientes.pop(valor), ignore_index=True)
+        ruta = self.temporal / self._directorio(valor) / f"part-{get_config().run_id}-{self.archivos[valor]:05d}.parquet"
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(ruta, index=False, compression=get_config().parquet_compresion)
+        self.archivos[valor] += 1
+
+    def cargar(self, conn, df: pd.DataFrame) -> None:
+        if self.valor_fijo is not None:
+            valores = pd.Series(self.valor_fijo, index=df.index)
+        else:
+            valores = normalizar_periodos(df[self.columna]).fillna("__HIVE_DEFAULT_PARTITION__")
+            df = df.drop(columns=[self.columna])
+        for valor, grupo in df.groupby(valores.to_numpy(), sort=False):
+            self.pendientes.setdefault(valor, []).append(grupo)
+            if sum(len(d) for d in self.pendientes[valor]) >= get_config().parquet_filas_archivo:
+                self._escribir(valor)
+        self.filas += len(df)
+
+    def finalizar(self, conn) -> None:
+        for valor in list(self.pendientes):
+            self._escribir(valor)
+
+    def publicar(self, engine) -> None:
+        if not self.filas:
+            shutil.rmtree(self.temporal, ignore_errors=True)
+            return
+        self.dataset.parent.mkdir(parents=True, exist_ok=True)
+        viejo = Path(get_config().parquet_dir) / f".old-{self.nombre_tabla}-{get_config().run_id}"
+        if self.reemplaza is None:
+            if self.dataset.exists():
+                self.dataset.rename(viejo)
+            self.temporal.rename(self.dataset)
+            shutil.rmtree(viejo, ignore_errors=True)
+            print(f"   🧊 Parquet {self.dataset}: {self.filas} filas (dataset reemplazado)")
+            return
+
+        self.dataset.mkdir(exist_ok=True)
+        nuevas = {d.name for d in self.temporal.iterdir()}
+        prefijo = f"{self.columna}="
+        for particion in sorted(self.dataset.glob(prefijo + "*")):
+            valor = particion.name[len(prefijo):]
+            if particion.name not in nuevas and self.reemplaza(valor):
+                shutil.rmtree(particion)
+        for nombre in sorted(nuevas):
+            nueva = self.temporal / nombre
+            destino = self.dataset / nombre
+            if not destino.exists():
+                nueva.rename(destino)
+            elif self.reemplaza(nombre[len(prefijo):]):
+                destino.rename(viejo)
+                nueva.rename(destino)
+                shutil.rmtree(viejo)
+            else:
+                for archivo in nueva.iterdir():
+                    archivo.rename(destino / archivo.name)
+        shutil.rmtree(self.temporal, ignore_errors=True)
+        print(f"   🧊 Parquet {self.dataset}: {self.filas} filas en {len(nuevas)} particiones")
+
+def destino_parquet(nombre_tabla: str) -> DestinoParquet | None:
+    """Salida Parquet de `nombre_tabla` con la misma semántica que su carga a PostgreSQL."""
+    cfg = get_config()
+    if not cfg.parquet_dir:
+        return None
+    if nombre_tabla == "sap_byd_ventas":
+        recarga = set(periodos_recarga_ventas())
+        return DestinoParquet(nombre_tabla, "FiscalMonthYear", lambda p: p in recarga)
+    if nombre_tabla == "sap_byd_ordenes":
+        if cfg.ordenes_modo_carga == "replace":
+            return DestinoParquet(nombre_tabla, "FiscalMonthYear")
+        desde = cfg.fecha_fiscal_ordenes
+        # Periodos MM.YYYY comparados como YYYY-MM, igual que la ventana del upsert
+        return DestinoParquet(
+            nombre_tabla, "FiscalMonthYear",
+            lambda p: bool(_RE_PERIODO_MM_YYYY.match(p)) and f"{p[3:]}-{p[:2]}" >= desde,
+        )
+    hoy = date.today()
+    limite = (hoy - timedelta(days=cfg.parquet_cortes_dias)).isoformat()
+    return DestinoParquet(nombre_tabla, "fecha_corte", lambda c: c == hoy.isoformat() or c < limite, valor_fijo=hoy.isoformat())
+
+def escribir_parquet(nombre_tabla: str, df: pd.DataFrame) -> None:
+    """Salida Parquet de una carga que no pasa por el pipeline (DataFrame completo)."""
+    destino = destino_parquet(nombre_tabla)
+    if destino is None or df.empty:
+        return
+    destino.cargar(None, df)
+    destino.finalizar(None)
+    destino.publicar(None)
+
+# ========= MÉTRICAS DE EJECUCIÓN =========
+# Cada flujo acumula tiempos por etapa: HTTP (hasta los headers + lectura del
+# cuerpo), bytes recibidos, parseo, transformación y carga. Los tiempos de HTTP y
+# parseo se suman entre hilos (páginas en paralelo), así que pueden superar el
+# tiempo de pared del flujo. Cada etapa se emite como una línea JSON y al final
+# de la corrida se guarda una fila por flujo en la tabla etl_run_log.
+TABLA_RUN_LOG = "etl_run_log"
+
+class MetricasFlujo:
+    """Acumuladores thread-safe de un flujo."""
+
+    CAMPOS = ("http_seg", "bytes_recibidos", "solicitudes", "parseo_seg",
+              "extraccion_seg", "transformacion_seg", "carga_seg", "resumen_seg",
+              "filas_evitadas", "bytes_evitados")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.valores = dict.fromkeys(self.CAMPOS, 0)
+
+    def sumar(self, **valores) -> None:
+        with self._lock:
+            for campo, valor in valores.items():
+                self.valores[campo] += valor
+
+    def como_dict(self) -> dict:
+        with self._lock:
+            return dict(self.valores)
+
+# Métricas del flujo en ejecución; se heredan en los hilos de páginas/ventanas
+metricas_actuales: contextvars.ContextVar[MetricasFlujo | None] = contextvars.ContextVar("metricas_actuales", default=None)
+
+def registrar(**valores) -> None:
+    metricas = metricas_actuales.get()
+    if metricas is not None:
+        metricas.sumar(**valores)
+
+def rss_pico_proceso_mb() -> float | None:
+    """
+    Pico de memoria residente (MB) de todo el proceso desde que arrancó; None si la
+    plataforma no lo informa. Es una marca de agua (ru_maxrss): no baja entre etapas
+    y con flujos en paralelo incluye la memoria de los demás, así que no mide una
+    etapa ni un flujo aislado (para eso, --profile y su reporte de tracemalloc).
+    """
+    if resource is None:
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(kb / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+def log_json(evento: str, **campos) -> None:
+    cfg = get_config()
+    if not cfg.etl_log_json:
+        return
+    linea = {"ts": datetime.now().isoformat(timespec="seconds"), "evento": evento, "flujo": flujo_actual.get(), **campos}
+    if cfg.tenant is not None:
+        linea["tenant"] = cfg.tenant.nombre
+    print(json.dumps(linea, ensure_ascii=False, default=str))
+
+@contextmanager
+def etapa(nombre: str):
+    """Mide el tiempo de pared de una etapa del flujo (extraccion, transformacion, carga)."""
+    t0 = time.perf_counter()
+    # Una etapa anidada (transformacion dentro de extraccion) queda en el perfil de la
+    # externa: un hilo admite un solo cProfile activo
+    perfil = PerfilEtapa(nombre) if PERFILAR and perfil_actual.get() is None else None
+    if perfil is not None:
+        token = perfil_actual.set(perfil)
+        perfil.iniciar()
+    try:
+        yield
+    finally:
+        if perfil is not None:
+            perfil.terminar()
+            perfil_actual.reset(token)
+        segundos = time.perf_counter() - t0
+        registrar(**{f"{nombre}_seg": segundos})
+        log_json("etapa", etapa=nombre, segundos=round(segundos, 3), rss_pico_proceso_mb=rss_pico_proceso_mb())
+
+# ========= PERFILES (--profile) =========
+# Con --profile cada etapa (extraccion, carga, resumen) se perfila con cProfile y
+# tracemalloc. cProfile es por hilo: los hilos de páginas, ventanas y el cargador
+# del pipeline suman su propio perfil al de la etapa en curso (perfilado()), y al
+# cerrar la etapa se combinan en un solo .pstats. tracemalloc es de todo el
+# proceso: se guarda el top de asignaciones netas entre el inicio y el fin de la
+# etapa. Los archivos quedan en PERFIL_DIR/<run id>/<flujo>-<etapa>.*
+PERFILAR = False  # --profile
+
+class PerfilEtapa:
+    """cProfile (uno por hilo, combinados al final) y snapshots de tracemalloc de una etapa."""
+
+    def __init__(self, nombre: str):
+        self.nombre = f"{flujo_actual.get() or 'etl'}-{nombre}"
+        self.perfiles: list[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._principal = None
+        self._inicio = None
+        self._t0 = 0.0
+
+    def nuevo(self) -> cProfile.Profile:
+        perfil = cProfile.Profile()
+        with self._lock:
+            self.perfiles.append(perfil)
+        return perfil
+
+    def iniciar(self, perfilar_hilo: bool = True) -> None:
+        """Snapshot inicial; con `perfilar_hilo` también perfila el hilo que llama."""
+        self._t0 = time.perf_counter()
+        self._inicio = tracemalloc.take_snapshot()
+        if perfilar_hilo:
+            self._principal = self.nuevo()
+            self._principal.enable()
+
+    def terminar(self) -> None:
+        if self._principal is not None:
+            self._principal.disable()
+        self.guardar()
+
+    def _base(self) -> Path:
+        directorio = get_config().perfil_dir / get_config().run_id
+        directorio.mkdir(parents=True, exist_ok=True)
+        base, n = self.nombre, 1
+        while (directorio / f"{base}.pstats").exists() and n < 100:  # etapa repetida en el flujo
+            n += 1
+            base = f"{self.nombre}-{n}"
+        return directorio / base
+
+    def guardar(self) -> None:
+        segundos = time.perf_counter() - self._t0
+        base = self._base()
+        with self._lock:
+            perfiles = [p for p in self.perfiles if p.getstats()]
+        if perfiles:
+            stats = pstats.Stats(perfiles[0])
+            for perfil in perfiles[1:]:
+                stats.add(perfil)
+            stats.dump_stats(f"{base}.pstats")
+            print(f"   🔬 Perfil {self.nombre}: {base}.pstats ({len(perfiles)} hilos)")
+        if self._inicio is None:
+            return
+        # Sin las asignaciones del propio cProfile (filtrar el resultado es más barato que el snapshot)
+        diferencias = [
+            d for d in tracemalloc.take_snapshot().compare_to(self._inicio, "lineno")
+            if d.traceback[0].filename not in _ARCHIVOS_PERFILADOR
+        ]
+        actual, pico = tracemalloc.get_traced_memory()
+        lineas = [
+            f"# {self.nombre}: {segundos:.1f} s; tracemalloc actual {actual / 1e6:.1f} MB, pico del proceso {pico / 1e6:.1f} MB",
+            f"# top {get_config().perfil_top} asignaciones netas durante la etapa (archivo:línea)",
+            *(str(d) for d in diferencias[:get_config().perfil_top]),
+        ]
+        Path(f"{base}-memoria.txt").write_text("\n".join(lineas) + "\n", encoding="utf-8")
+
+_ARCHIVOS_PERFILADOR = {cProfile.__file__, pstats.__file__, tracemalloc.__file__}
+
+# Perfil de la etapa en curso; se hereda en los hilos de páginas/ventanas
+perfil_actual: contextvars.ContextVar[PerfilEtapa | None] = contextvars.ContextVar("perfil_actual", default=None)
+
+def perfilado(fn, perfil: PerfilEtapa | None = None):
+    """Envuelve `fn` (trabajo de otro hilo) para que su CPU sume al perfil de la etapa."""
+    def envuelta(*args, **kwargs):
+        actual = perfil or perfil_actual.get()
+        if actual is None:
+            return fn(*args, **kwargs)
+        hilo = actual.nuevo()
+        hilo.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            hilo.disable()
+    return envuelta
+
+def activar_perfiles() -> None:
+    global PERFILAR
+    PERFILAR = True
+    tracemalloc.start()
+    print(f"🔬 --profile: perfiles por etapa en {get_config().perfil_dir / get_config().run_id}")
+
+class LectorMedido:
+    """Envuelve el cuerpo de una respuesta y acumula el tiempo de lectura (red)."""
+
+    def __init__(self, fuente):
+        self.fuente = fuente
+        self.segundos = 0.0
+
+    def read(self, *args) -> bytes:
+        t0 = time.perf_counter()
+        try:
+            return self.fuente.read(*args)
+        finally:
+            self.segundos += time.perf_counter() - t0
+
+def medir_parseo(chunks, lector: LectorMedido, resp: requests.Response):
+    """
+    Re-emite los chunks de un parser acumulando como parseo el tiempo dentro del
+    parser menos el de lectura del cuerpo, que se acumula como HTTP junto a los bytes.
+    """
+    total = 0.0
+    try:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                total += time.perf_counter() - t0
+                break
+            total += time.perf_counter() - t0
+            yield chunk
+    finally:
+        registrar(
+            http_seg=lector.segundos,
+            parseo_seg=max(0.0, total - lector.segundos),
+            bytes_recibidos=resp.raw.tell(),
+        )
+
+def crear_run_log(conn) -> None:
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {TABLA_RUN_LOG} (
+            id                  bigserial PRIMARY KEY,
+            run_id              text NOT NULL,
+            flujo               text NOT NULL,
+            estado              text NOT NULL,
+            inicio              timestamptz NOT NULL,
+            segundos            double precision,
+            filas               bigint,
+            filas_seg           double precision,
+            http_seg            double precision,
+            bytes_recibidos     bigint,
+            solicitudes         integer,
+            parseo_seg          double precision,
+            extraccion_seg      double precision,
+            transformacion_seg  double precision,
+            carga_seg           double precision,
+            resumen_seg         double precision,
+            rss_pico_proceso_mb double precision,
+            filas_evitadas      bigint,
+            bytes_evitados      bigint,
+            error               text
+        )
+    """))
+    conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS ix_{TABLA_RUN_LOG}_flujo_inicio ON {TABLA_RUN_LOG} (flujo, inicio DESC)"
+    ))
+
+def guardar_run_log(resultados: list[dict]) -> None:
+    """Persiste una fila por flujo en etl_run_log; si falla, la corrida sigue igual."""
+    filas = [{"run_id": get_config().run_id, **{k: r.get(k) for k in (
+        "flujo", "estado", "inicio", "segundos", "filas", "filas_seg", "rss_pico_proceso_mb", "error")},
+        **{k: r["metricas"].get(k) for k in MetricasFlujo.CAMPOS}} for r in resultados]
+    if not filas:
+        return
+    columnas = list(filas[0])
+    try:
+        engine = get_engine()
+        with engine.begin() as conn:
+            crear_run_log(conn)
+            conn.execute(text(
+                f"INSERT INTO {TABLA_RUN_LOG} ({', '.join(columnas)}) "
+                f"VALUES ({', '.join(':' + c for c in columnas)})"
+            ), filas)
+        engine.dispose()
+    except Exception as exc:
+        print(f"⚠️ No se pudo guardar {TABLA_RUN_LOG}: {type(exc).__name__}: {exc}")
+
+# ========= CLIENTE HTTP BYD =========
+# Todas las llamadas a SAP ByDesign pasan por byd_get(): una sesión compartida con
+# pool de conexiones (keep-alive), compresión gzip/deflate, reintentos con backoff
+# exponencial y un token bucket por tenant. El limitador garantiza que, sumando
+# flujos y páginas en paralelo, nunca se superan BYD_MAX_RPS solicitudes/seg
+# contra un mismo host (la API no se bloquea por exceso de consultas).
+BYD_TIMEOUT = 300
+BYD_POOL_CONEXIONES = 16
+
+_ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+# En False, un timeout se propaga sin reintentar: quien llama prefiere partir la
+# consulta (ventanas de ventas) antes que repetir la misma consulta pesada
+reintentar_timeouts: contextvars.ContextVar[bool] = contextvars.ContextVar("reintentar_timeouts", default=True)
+
+def es_timeout(exc: BaseException) -> bool:
+    """True si `exc` es un timeout, también cuando llega envuelto al leer el cuerpo de la respuesta."""
+    if isinstance(exc, (requests.Timeout, urllib3.exceptions.TimeoutError)):
+        return True
+    return any(isinstance(a, urllib3.exceptions.TimeoutError) for a in getattr(exc, "args", ()))
+
+class LimitadorTokens:
+    """Token bucket thread-safe: como máximo `tasa` solicitudes/seg, con ráfagas de `capacidad`."""
+
+    def __init__(self, tasa: float, capacidad: float | None = None):
+        self.tasa = tasa
+        self.capacidad = capacidad or max(1.0, tasa)
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self) -> None:
+        if self.tasa <= 0:  # 0 = sin límite
+            return
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.tasa
+            time.sleep(espera)
+
+_sesion: requests.Session | None = None
+_limitadores: dict[str, LimitadorTokens] = {}
+_lock_cliente = threading.Lock()
+
+def get_sesion() -> requests.Session:
+    global _sesion
+    with _lock_cliente:
+        if _sesion is None:
+            sesion = requests.Session()
+            cfg = get_config()
+            sesion.auth = (cfg.bjd_user, cfg.bjd_pass)
+            sesion.headers["Accept-Encoding"] = "gzip, deflate"
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=BYD_POOL_CONEXIONES, max_retries=0)
+            sesion.mount("https://", adapter)
+            sesion.mount("http://", adapter)
+            _sesion = sesion
+        return _sesion
+
+def get_limitador(host: str) -> LimitadorTokens:
+    with _lock_cliente:
+        if host not in _limitadores:
+            _limitadores[host] = LimitadorTokens(get_config().byd_max_rps)
+        return _limitadores[host]
+
+def _espera_reintento(intento: int, resp: requests.Response | None = None) -> float:
+    """
+    Respeta Retry-After si SAP lo envía, acotado a la espera del último reintento;
+    si no, backoff exponencial con jitter.
+    """
+    cfg = get_config()
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), cfg.byd_backoff_seg * (2 ** max(cfg.byd_reintentos - 1, 0)) + 1)
+    return cfg.byd_backoff_seg * (2 ** intento) + random.uniform(0, 1)
+
+def byd_get(url: str, stream: bool = False) -> requests.Response:
+    """
+    GET contra SAP ByDesign con reintentos en 429/5xx, timeouts y errores de conexión.
+    Cada intento (incluidos los reintentos) consume un token del limitador del host.
+    """
+    cfg = get_config()
+    sesion = get_sesion()
+    limitador = get_limitador(urlsplit(url).netloc)
+
+    intento = 0
+    while True:
+        limitador.adquirir()
+        t0 = time.perf_counter()
+        try:
+            resp = sesion.get(url, timeout=BYD_TIMEOUT, stream=stream)
+        except (requests.Timeout, requests.ConnectionError) as exc:
+            if intento == cfg.byd_reintentos or (es_timeout(exc) and not reintentar_timeouts.get()):
+                raise
+            espera = _espera_reintento(intento)
+            motivo = type(exc).__name__
+        else:
+            # Con stream=True esto es hasta los headers; el cuerpo se mide al leerlo
+            registrar(http_seg=time.perf_counter() - t0, solicitudes=1)
+            if not stream:
+                registrar(bytes_recibidos=len(resp.content))
+            if resp.status_code not in _ESTADOS_REINTENTABLES or intento == cfg.byd_reintentos:
+                resp.raise_for_status()
+                return resp
+            espera = _espera_reintento(intento, resp)
+            motivo = f"HTTP {resp.status_code}"
+            resp.close()
+        print(f"  ↻ {motivo}; reintento {intento + 1}/{cfg.byd_reintentos} en {espera:.1f} s")
+        time.sleep(espera)
+        intento += 1
+
+# ========= CACHÉ DE PÁGINAS ODATA (PARQUET) =========
+# Cada página decodificada se guarda como Parquet, con clave en la URL normalizada
+# (entidad + $select + $filter + $skip/$top). Así, una re-ejecución manual o una
+# corrida que falló a mitad de camino lee del disco en vez de volver a pedirle al
+# tenant. La vigencia (TTL) es por flujo y el tamaño total se acota desalojando
+# primero las páginas usadas hace más tiempo (LRU). Se escribe y se lee un row
+# group por chunk del parser: la caché no junta la página en memoria.
+
+# Minutos de vigencia por flujo (ODATA_CACHE_TTL_<FLUJO> para cambiarlos)
+_TTL_CACHE_MIN = {
+    "ventas": 30,
+    "ordenes": 30,
+    "costo": 24 * 60,   # costo estándar: cambia muy poco
+    "3pl": 60,
+    "entrega": 60,
+    "inventario": 30,
+}
+
+# Flujo en ejecución; lo fija el scheduler y se hereda en los hilos de páginas
+flujo_actual: contextvars.ContextVar[str] = contextvars.ContextVar("flujo_actual", default="")
+
+_lock_cache = threading.Lock()
+
+def _ttl_cache_seg(flujo: str) -> float:
+    minutos = os.getenv(f"ODATA_CACHE_TTL_{flujo.upper()}")
+    return float(minutos if minutos is not None else _TTL_CACHE_MIN.get(flujo, 60)) * 60
+
+def clave_cache(url: str, campos: dict | None = None) -> str:
+    """Hash de la URL normalizada: host + entidad + parámetros ordenados (sin $format) + columnas pedidas."""
+    partes = urlsplit(url)
+    params = sorted((k, v) for k, v in parse_qsl(partes.query, keep_blank_values=True) if k != "$format")
+    firma = json.dumps([partes.netloc, partes.path, params, sorted(campos.items()) if campos else None])
+    return hashlib.sha256(firma.encode("utf-8")).hexdigest()[:32]
+
+def _ruta_cache(url: str, campos: dict | None) -> Path:
+    return get_config().odata_cache_dir / (flujo_actual.get() or "general") / f"{clave_cache(url, campos)}.parquet"
+
+def cache_leer(url: str, campos: dict | None = None, ignorar_ttl: bool = False) -> pq.ParquetFile | None:
+    """
+    Página cacheada (se lee por row group) si existe y no venció su TTL; marca el
+    acceso para el LRU. `ignorar_ttl` se usa al reanudar una corrida: la página ya
+    pertenece a esa corrida.
+    """
+    if not get_config().odata_cache:
+        return None
+    ruta = _ruta_cache(url, campos)
+    try:
+        escrita = ruta.stat().st_mtime
+        if not ignorar_ttl and time.time() - escrita > _ttl_cache_seg(flujo_actual.get()):
+            return None
+        archivo = pq.ParquetFile(ruta)
+        os.utime(ruta, (time.time(), escrita))  # atime = último uso; mtime = escritura (TTL)
+    except (FileNotFoundError, OSError, pa.ArrowException):
+        return None
+    print(f"  💾 Página desde caché ({archivo.metadata.num_rows} filas)")
+    return archivo
+
+class EscritorCache:
+    """
+    Escribe una página en la caché a medida que llegan sus chunks (un row group por
+    chunk) en un archivo temporal; `publicar()` lo deja en su lugar al terminar la
+    página y `descartar()` lo borra si la descarga se interrumpe. Si un chunk no
+    encaja en el esquema del primero, la página simplemente no se cachea.
+    """
+
+    def __init__(self, url: str, campos: dict | None):
+        self.ruta = _ruta_cache(url, campos)
+        self.temporal = self.ruta.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        self.escritor = None
+        self.activo = True
+
+    def escribir(self, df: pd.DataFrame) -> None:
+        if not self.activo:
+            return
+        try:
+            tabla = pa.Table.from_pandas(df, preserve_index=False)
+            if self.escritor is None:
+                # Una columna sin valores en el primer chunk no fija el tipo (texto, el caso común)
+                esquema = pa.schema(
+                    [c.with_type(pa.string()) if pa.types.is_null(c.type) else c for c in tabla.schema],
+                    metadata=tabla.schema.metadata,
+                )
+                self.ruta.parent.mkdir(parents=True, exist_ok=True)
+                self.escritor = pq.ParquetWriter(self.temporal, esquema)
+            self.escritor.write_table(tabla.cast(self.escritor.schema))
+        except (pa.ArrowException, ValueError, OSError) as exc:
+            print(f"  Página sin caché ({type(exc).__name__}: {exc})")
+            self.descartar()
+
+    def descartar(self) -> None:
+        self.activo = False
+        if self.escritor is not None:
+            self.escritor.close()
+        self.temporal.unlink(missing_ok=True)
+
+    def publicar(self) -> bool:
+        if not self.activo:
+            return False
+        if self.escritor is None:
+            # Página vacía: también se cachea (el fin de la paginación)
+            self.ruta.parent.mkdir(parents=True, exist_ok=True)
+            pq.write_table(pa.table({}), self.temporal)
+        else:
+            self.escritor.close()
+        os.replace(self.temporal, self.ruta)
+        _desalojar_cache()
+        return True
+
+def _desalojar_cache() -> None:
+    """Borra las páginas menos usadas hasta quedar bajo ODATA_CACHE_MAX_MB."""
+    limite = get_config().odata_cache_max_mb * 1024 * 1024
+    with _lock_cache:
+        archivos = []
+        for ruta in get_config().odata_cache_dir.glob("*/*.parquet"):
+            try:
+                st = ruta.stat()
+            except FileNotFoundError:
+                continue
+            archivos.append((st.st_atime, st.st_size, ruta))
+        total = sum(tam for _, tam, _ in archivos)
+        for _, tam, ruta in sorted(archivos):
+            if total <= limite:
+                break
+            ruta.unlink(missing_ok=True)
+            total -= tam
+
+# ========= CHECKPOINTS (REANUDAR CORRIDAS) =========
+# Registro por corrida (run id) de las páginas descargadas, las ventanas de ventas
+# completas y los flujos ya cargados. Vive en SQLite dentro del directorio de la
+# caché, junto a los Parquet con los datos de esas páginas. Con --resume se omiten
+# los flujos ya cargados y las páginas marcadas se leen de la caché aunque haya
+# vencido su TTL, así una corrida fallida continúa donde quedó.
+REANUDAR = False  # --resume
+
+class Checkpoints:
+    """Marcas (flujo, tipo, clave) de trabajo terminado en una corrida; thread-safe."""
+
+    def __init__(self, ruta: Path, run_id: str):
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        self.run_id = run_id
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS etl_checkpoint (
+                run_id TEXT NOT NULL,
+                flujo  TEXT NOT NULL,
+                tipo   TEXT NOT NULL,
+                clave  TEXT NOT NULL,
+                filas  INTEGER,
+                creado TEXT NOT NULL DEFAULT (datetime('now')),
+                PRIMARY KEY (run_id, flujo, tipo, clave)
+            )
+        """)
+        self._conn.execute(
+            "DELETE FROM etl_checkpoint WHERE creado < datetime('now', ?)", (f"-{get_config().checkpoints_dias} days",)
+        )
+
+    def marcar(self, tipo: str, clave: str = "", filas: int | None = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO etl_checkpoint (run_id, flujo, tipo, clave, filas) VALUES (?, ?, ?, ?, ?)",
+                (self.run_id, flujo_actual.get(), tipo, clave, filas),
+            )
+
+    def hecho(self, tipo: str, clave: str = "") -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM etl_checkpoint WHERE run_id = ? AND flujo = ? AND tipo = ? AND clave = ?",
+                (self.run_id, flujo_actual.get(), tipo, clave),
+            ).fetchone() is not None
+
+    def ultima_corrida(self, sufijo: str = "") -> str | None:
+        """Última corrida registrada; con `sufijo`, la última de ese tenant."""
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT run_id FROM etl_checkpoint WHERE run_id LIKE ? ORDER BY creado DESC LIMIT 1", (f"%{sufijo}",)
+            ).fetchone()
+        return fila[0] if fila else None
+
+    def resumen(self) -> dict[str, int]:
+        """Cantidad de marcas por tipo en la corrida actual."""
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT tipo, count(*) FROM etl_checkpoint WHERE run_id = ? GROUP BY tipo", (self.run_id,)
+            ).fetchall())
+
+_checkpoints: Checkpoints | None = None
+
+def get_checkpoints() -> Checkpoints:
+    global _checkpoints
+    with _lock_cache:
+        if _checkpoints is None:
+            _checkpoints = Checkpoints(get_config().odata_cache_dir / "checkpoints.sqlite", get_config().run_id)
+        return _checkpoints
+
+# ========= LECTURA DE RESPUESTAS ODATA =========
+_TAG_ENTRY = f"{{{ns['atom']}}}entry"
+_ATTR_TIPO = f"{{{ns['m']}}}type"
+_PREFIJO_D = f"{{{ns['d']}}}"
+
+# ----- Decodificación tipada por tipos EDM -----
+# Los valores se acumulan como texto en una lista por columna y cada columna se
+# convierte una sola vez, en bloque, según su tipo EDM (m:type del feed Atom o
+# $metadata del servicio). Fechas/horas se mantienen como el texto ISO de SAP
+# porque así están tipadas las columnas en PostgreSQL.
+_EDM_DECIMALES = {"Edm.Decimal", "Edm.Double", "Edm.Single"}
+_EDM_ENTEROS = {"Edm.Int16", "Edm.Int32", "Edm.Int64", "Edm.Byte", "Edm.SByte"}
+_BOOLEANOS = {"true": True, "false": False, True: True, False: False}
+
+# Texto de baja cardinalidad que se entrega como pandas categorical
+COLUMNAS_CATEGORICAS = {"E03_SBU_Name", "Country_Region", "State"}
+
+def columnas_a_df(columnas: dict[str, list], tipos: dict[str, str] | None) -> pd.DataFrame:
+    """Arma el DataFrame convirtiendo cada lista según su tipo EDM (sin tipo = se deja como llegó)."""
+    datos = {}
+    for col, valores in columnas.items():
+        tipo = (tipos or {}).get(col)
+        if tipo in _EDM_DECIMALES:
+            datos[col] = pd.to_numeric(pd.Series(valores, dtype=object), errors="coerce").astype("float64")
+        elif tipo in _EDM_ENTEROS:
+            datos[col] = pd.to_numeric(pd.Series(valores, dtype=object), errors="coerce").astype("Int64")
+        elif tipo == "Edm.Boolean":
+            datos[col] = pd.Series(valores, dtype=object).map(_BOOLEANOS).astype("boolean")
+        else:
+            datos[col] = pd.Series(valores, dtype=object)
+    return pd.DataFrame(datos)
+
+def categorizar(df: pd.DataFrame) -> pd.DataFrame:
+    """Convierte a category las columnas de COLUMNAS_CATEGORICAS (tras concatenar chunks)."""
+    for col in COLUMNAS_CATEGORICAS.intersection(df.columns):
+        df[col] = df[col].astype("category")
+    return df
+
+_metadata_por_servicio: dict[str, dict | None] = {}
+_lock_metadata = threading.Lock()
+
+def _parsear_metadata(xml: bytes) -> dict[str, dict[str, str]]:
+    """{entity_set: {propiedad: tipo EDM}} a partir del documento $metadata."""
+    root = etree.fromstring(xml)
+    por_tipo = {
+        et.get("Name"): {p.get("Name"): p.get("Type") for p in et.iter("{*}Property")}
+        for et in root.iter("{*}EntityType")
+    }
+    return {
+        es.get("Name"): por_tipo.get(es.get("EntityType", "").rsplit(".", 1)[-1], {})
+        for es in root.iter("{*}EntitySet")
+    }
+
+def _cargar_metadata(url_servicio: str) -> dict | None:
+    cfg = get_config()
+    ruta = cfg.odata_cache_dir / "metadata" / f"{hashlib.sha256(url_servicio.encode()).hexdigest()[:32]}.xml"
+    try:
+        if cfg.odata_cache and ruta.exists() and time.time() - ruta.stat().st_mtime < 24 * 3600:
+            return _parsear_metadata(ruta.read_bytes())
+        xml = byd_get(f"{url_servicio}/$metadata").content
+        metadata = _parsear_metadata(xml)
+    except (requests.RequestException, etree.XMLSyntaxError) as exc:
+        print(f"  $metadata no disponible ({type(exc).__name__}); se infieren los tipos.")
+        return None
+    if cfg.odata_cache:
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        ruta.write_bytes(xml)
+    return metadata
+
+def tipos_edm(url: str) -> dict[str, str] | None:
+    """Tipos EDM de la entidad de `url` según $metadata (descargado una vez por servicio y cacheado)."""
+    partes = urlsplit(url)
+    if ".svc/" not in partes.path:
+        return None
+    raiz, entidad = partes.path.split(".svc/", 1)
+    url_servicio = f"{partes.scheme}://{partes.netloc}{raiz}.svc"
+    with _lock_metadata:
+        if url_servicio not in _metadata_por_servicio:
+            _metadata_por_servicio[url_servicio] = _cargar_metadata(url_servicio)
+        metadata = _metadata_por_servicio[url_servicio]
+    if metadata is None or entidad not in metadata:
+        return None
+    return metadata[entidad]
+
+def _tipos_por_columna(tipos: dict[str, str] | None, campos: dict | None) -> dict[str, str] | None:
+    if tipos is None or campos is None:
+        return tipos
+    return {col: tipos[prop] for prop, (col, _) in campos.items() if prop in tipos}
+
+def iterar_atom(fuente, campos: dict | None = None, chunk_filas: int | None = None):
+    """
+    Recorre un feed Atom con `etree.iterparse` y emite DataFrames tipados de hasta
+    `chunk_filas` filas (por defecto ATOM_CHUNK_FILAS). Cada `atom:entry` se
+    limpia apenas se lee, así que nunca se materializa el árbol completo de la
+    página. El tipo de cada columna
+    se toma del atributo m:type la primera vez que aparece (sin atributo = Edm.String).
+
+    campos: {propiedad_sap: (columna, default)} con columnas fijas (default si
+            la propiedad no viene). Si es None se toman todas las propiedades
+            con su nombre SAP y los elementos vacíos quedan como None (igual que
+            `pd.read_xml`).
+    """
+    chunk_filas = chunk_filas or get_config().atom_chunk_filas
+    columnas: dict[str, list] = {}
+    defaults: dict[str, str | None] = {}
+    por_tag: dict[str, str] = {}
+    if campos is not None:
+        por_tag = {_PREFIJO_D + prop: col for prop, (col, _) in campos.items()}
+        defaults = {col: default for col, default in campos.values()}
+        columnas = {col: [] for col in defaults}
+    tipos: dict[str, str] = {}
+    n = 0
+
+    for _, entry in etree.iterparse(fuente, events=("end",), tag=_TAG_ENTRY, huge_tree=True):
         props = entry.find("atom:content/m:properties", ns)
-        if props is None:
+        if props is not None:
+            for child in props:
+                col = por_tag.get(child.tag)
+                if col is None:
+                    if campos is not None:
+                        continue
+                    col = por_tag[child.tag] = etree.QName(child).localname
+                if col not in tipos:
+                    tipos[col] = child.get(_ATTR_TIPO, "Edm.String")
+                valores = columnas.get(col)
+                if valores is None:
+                    valores = columnas[col] = [None] * n
+                    defaults[col] = None
+                texto = child.text
+                valores.append(texto if texto is not None or campos is None else "")
+            n += 1
+            for col, valores in columnas.items():
+                if len(valores) < n:
+                    valores.append(defaults[col])
+
+        # Liberar la entrada ya leída y las anteriores que sigan colgando del feed
+        entry.clear(keep_tail=False)
+        parent = entry.getparent()
+        while entry.getprevious() is not None:
+            del parent[0]
+
+        if n >= chunk_filas:
+            yield columnas_a_df(columnas, tipos)
+            columnas = {col: [] for col in columnas}
+            n = 0
+
+    if n:
+        yield columnas_a_df(columnas, tipos)
+
+def _texto_json(v, default: str) -> str:
+    if v is None:
+        return default
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    return v if isinstance(v, str) else str(v)
+
+def _normalizar_fechas_json(df: pd.DataFrame) -> pd.DataFrame:
+    """OData v2 JSON serializa Edm.DateTime como /Date(ms)/; se lleva al mismo texto ISO del feed Atom."""
+    for col in df.columns:
+        serie = df[col]
+        if serie.dtype != object:
             continue
-        row = {
-            "Invoice_Date":       props.findtext('d:C1CINHUUIDsDOC_INV_DATE', default='', namespaces=ns),
-            "Customer":           props.findtext('d:CCUSTOMER',                 default='', namespaces=ns),
-            "City":               props.findtext('d:C1CUSTOMERsCITY_NAME',       default='', namespaces=ns),
-            "Accounting_Period":  props.findtext('d:CACCPERIOD',                 default='', namespaces=ns),
-            "Invoice":            props.findtext('d:CCINHUUID',                  default='', namespaces=ns),
-            "FiscalMonthYear":    props.findtext('d:CFISCALDDATES6F44DC8D81C7C41F', default='', namespaces=ns),
-            "Product":            props.findtext('d:CPRODUCT',                   default='', namespaces=ns),
-            "Profit_Center":      props.findtext('d:CPROFITCTR',                 default='', namespaces=ns),
-            "Sales_Unit":         props.findtext('d:CSALESUNIT',                 default='', namespaces=ns),
-            "E03_SBU_Name":       props.findtext('d:CZCE03SBUDES',               default='', namespaces=ns),
-            "VENTAS_US":          props.findtext('d:KCZ38704318CAF9C0490E065D',  default='0', namespaces=ns),
-            "COSTO_US":           props.findtext('d:KCZ206B9BDD38BC08F314528E',  default='0', namespaces=ns),
-            "Cantidad_FacUS":     props.findtext('d:KCZ80E56A9357921903E24583',  default='0', namespaces=ns),
-            "Customer_Name":      props.findtext('d:TCUSTOMER',                  default='', namespaces=ns),
-            "State":              props.findtext('d:T1CUSTOMERsREGION_CODE',     default='', namespaces=ns),
-            "Country_Region":     props.findtext('d:TCOUNTRY_CODE',              default='', namespaces=ns),
-            "Ship_To":            props.findtext('d:T1CINIUUIDsIP_PR_RC_UUID',   default='', namespaces=ns),
-            "Person_Responsible": props.findtext('d:TRESPEMP',                   default='', namespaces=ns),
-        }
-        rows.append(row)
+        es_fecha = serie.str.startswith("/Date(", na=False)
+        if not es_fecha.any():
+            continue
+        ms = serie[es_fecha].str.extract(r"^/Date\((-?\d+)", expand=False).astype("int64")
+        df.loc[es_fecha, col] = pd.to_datetime(ms, unit="ms").dt.strftime("%Y-%m-%dT%H:%M:%S")
+    return df
+
+def iterar_json(fuente, campos: dict | None = None, chunk_filas: int | None = None,
+                tipos: dict[str, str] | None = None):
+    """
+    Recorre `d.results` de una respuesta OData v2 JSON con `ijson` y emite
+    DataFrames columnares de hasta `chunk_filas` filas, con la misma forma que
+    `iterar_atom` (mismos nombres, defaults y tipos). Como en Atom, nunca se
+    decodifica la página completa: solo vive en memoria el chunk en curso.
+    `tipos` viene de $metadata; sin él, las columnas se infieren como antes.
+    """
+    chunk_filas = chunk_filas or get_config().atom_chunk_filas
+    tipos_col = _tipos_por_columna(tipos, campos)
+    columnas: dict[str, list] = {}
+    if campos is not None:
+        columnas = {col: [] for col, _ in campos.values()}
+    n = 0
+
+    def _emitir() -> pd.DataFrame:
+        df = _normalizar_fechas_json(columnas_a_df(columnas, tipos_col))
+        return df if tipos_col is not None or campos is not None else _inferir_tipos(df)
+
+    for fila in ijson.items(fuente, "d.results.item", use_float=True):
+        if campos is None:
+            for prop, v in fila.items():
+                if prop == "__metadata":
+                    continue
+                valores = columnas.get(prop)
+                if valores is None:
+                    valores = columnas[prop] = [None] * n
+                valores.append(v)
+        else:
+            for prop, (col, default) in campos.items():
+                columnas[col].append(_texto_json(fila[prop], "") if prop in fila else default)
+        n += 1
+        if campos is None:
+            for valores in columnas.values():
+                if len(valores) < n:
+                    valores.append(None)
+
+        if n >= chunk_filas:
+            yield _emitir()
+            columnas = {col: [] for col in columnas}
+            n = 0
+
+    if n:
+        yield _emitir()
+
+# Atom queda como respaldo automático para los servicios que rechacen JSON
+# (BYD_FORMATO=json): la entidad se recuerda y sus páginas siguientes van en Atom.
+_entidades_solo_atom: set[str] = set()
+
+def _url_json(url: str) -> str:
+    return f"{url}{'&' if '?' in url else '?'}$format=json"
+
+def _descargar_pagina(url: str, campos: dict | None = None):
+    """
+    Descarga `url` y emite DataFrames por chunks, en JSON o Atom según BYD_FORMATO.
+    Si el servicio responde 4xx o un cuerpo que no es JSON, la entidad queda
+    marcada como solo-Atom para el resto de la ejecución.
+    """
+    entidad = urlsplit(url).path.rsplit("/", 1)[-1]
+    if get_config().byd_formato == "json" and entidad not in _entidades_solo_atom:
+        try:
+            resp = byd_get(_url_json(url), stream=True)
+        except requests.HTTPError as exc:
+            if exc.response is None or exc.response.status_code >= 500:
+                raise
+            print(f"  JSON no disponible para {entidad} (HTTP {exc.response.status_code}); se usa Atom.")
+            _entidades_solo_atom.add(entidad)
+        else:
+            with resp:
+                resp.raw.decode_content = True
+                lector = LectorMedido(resp.raw)
+                chunks = medir_parseo(iterar_json(lector, campos, tipos=tipos_edm(url)), lector, resp)
+                try:
+                    # Un cuerpo que no es JSON falla en los primeros bytes, antes de emitir nada
+                    primero = next(chunks, None)
+                except (ijson.JSONError, ValueError, KeyError, TypeError) as exc:
+                    print(f"  Respuesta JSON inválida para {entidad} ({type(exc).__name__}); se usa Atom.")
+                    _entidades_solo_atom.add(entidad)
+                else:
+                    if primero is not None:
+                        yield primero
+                    yield from chunks
+                    return
+
+    with byd_get(url, stream=True) as resp:
+        resp.raw.decode_content = True  # descomprimir gzip/deflate al vuelo
+        lector = LectorMedido(resp.raw)
+        yield from medir_parseo(iterar_atom(lector, campos), lector, resp)
+
+def leer_pagina(url: str, campos: dict | None = None):
+    """
+    Emite los chunks de la página desde la caché en disco si está vigente; si no,
+    la descarga en streaming y escribe cada chunk en la caché a medida que lo
+    emite. Al terminar la página la publica en la caché y la marca como completa
+    en los checkpoints de la corrida.
+    """
+    cfg = get_config()
+    clave = clave_cache(url, campos)
+    reanudada = REANUDAR and cfg.odata_cache and get_checkpoints().hecho("pagina", clave)
+    archivo = cache_leer(url, campos, ignorar_ttl=reanudada)
+    if archivo is not None:
+        with archivo:
+            for i in range(archivo.num_row_groups):
+                yield archivo.read_row_group(i).to_pandas()
+        return
+
+    escritor = EscritorCache(url, campos) if cfg.odata_cache else None
+    filas = 0
+    try:
+        for chunk in _descargar_pagina(url, campos):
+            filas += len(chunk)
+            if escritor is not None:
+                escritor.escribir(chunk)
+            yield chunk
+    except BaseException:
+        # También si el consumidor abandona la página (GeneratorExit)
+        if escritor is not None:
+            escritor.descartar()
+        raise
+    if escritor is not None and escritor.publicar():
+        get_checkpoints().marcar("pagina", clave, filas)
+
+def _inferir_tipos(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Respaldo cuando no hay tipos EDM: convierte a numérico/booleano las columnas
+    de texto que lo admiten (como `pd.read_xml`).
+    """
+    for col in df.columns:
+        serie = df[col]
+        if serie.dtype != object:
+            continue
+        try:
+            df[col] = pd.to_numeric(serie)
+            continue
+        except (ValueError, TypeError):
+            pass
+        no_nulos = serie.dropna()
+        if not no_nulos.empty and no_nulos.str.lower().isin(("true", "false")).all():
+            df[col] = serie.str.lower().map({"true": True, "false": False})
+    return df
 
-    return pd.DataFrame(rows)
+def iterar_pagina(url: str, campos: dict | None = None):
+    """
+    Chunks de la página (ver leer_pagina) para pasarlos al consumidor sin juntarlos.
+    Si la conexión se corta mientras se lee el cuerpo, se vuelve a pedir la página
+    y se saltean las filas que ya se emitieron.
+    """
+    cfg = get_config()
+    emitidas = 0
+    for intento in range(cfg.byd_reintentos + 1):
+        try:
+            leidas = 0
+            for chunk in leer_pagina(url, campos):
+                desde = max(0, emitidas - leidas)
+                leidas += len(chunk)
+                if desde < len(chunk):
+                    emitidas += len(chunk) - desde
+                    yield chunk.iloc[desde:].reset_index(drop=True) if desde else chunk
+            return
+        except (urllib3.exceptions.HTTPError, requests.ConnectionError) as exc:
+            if intento == cfg.byd_reintentos or (es_timeout(exc) and not reintentar_timeouts.get()):
+                raise
+            espera = _espera_reintento(intento)
+            print(f"  ↻ {type(exc).__name__} leyendo la página; reintento {intento + 1}/{cfg.byd_reintentos} en {espera:.1f} s")
+            time.sleep(espera)
+
+def leer_pagina_df(url: str, campos: dict | None = None) -> pd.DataFrame:
+    """Página completa como un DataFrame (concatena los chunks), para quien la necesita entera."""
+    chunks = list(iterar_pagina(url, campos))
+    if not chunks:
+        return pd.DataFrame()
+    return categorizar(pd.concat(chunks, ignore_index=True))
 
-def extraer_ventas() -> pd.DataFrame:
+# ========= PAGINACIÓN ODATA =========
+# Con ODATA_PAGINAS_PARALELAS > 1 y el total informado ($inlinecount) las páginas
+# se piden en paralelo; 1 = siempre secuencial ($skip página a página).
+
+def contar_registros(url: str) -> int | None:
+    """
+    Total de filas que devuelve `url` según `$inlinecount=allpages` (OData v2).
+    Retorna None si el servicio no informa el conteo o la consulta falla.
+    """
+    url_conteo = f"{url}&$inlinecount=allpages"
+    try:
+        resp = byd_get(url_conteo)
+        root = etree.fromstring(resp.content)
+    except (requests.RequestException, etree.XMLSyntaxError) as exc:
+        print(f"  Conteo no disponible ({type(exc).__name__}); se pagina en secuencia.")
+        return None
+
+    count = root.findtext("m:count", namespaces=ns)
+    if count is None or not count.strip().isdigit():
+        return None
+    return int(count)
+
+def paginar(nombre: str, construir_url_pagina, extraer_pagina, batch_size: int,
+            workers: int | None = None, al_recibir=None) -> list[pd.DataFrame]:
+    """
+    Recorre un resultado OData con $top/$skip y retorna los chunks no vacíos en
+    orden de página.
+
+    construir_url_pagina(skip, top) -> url
+    extraer_pagina(url) -> chunks (DataFrames) de la página, p. ej. iterar_pagina
+    workers: páginas en paralelo (por defecto ODATA_PAGINAS_PARALELAS)
+
+    Con workers > 1 pide primero el total de filas y descarga los offsets en un
+    pool acotado. Solo hay `workers` páginas en vuelo: la siguiente se pide cuando
+    termina la más antigua. Sin conteo disponible se recorre secuencialmente hasta
+    recibir una página incompleta.
+    Con `al_recibir`, cada chunk se le entrega apenas se decodifica, sin juntar la
+    página; con páginas en paralelo se llama desde los hilos de descarga (debe ser
+    thread-safe, como PipelineCarga.emitir) y si espera (cola de carga llena) la
+    descarga también.
+    """
     all_batches = []
+    recibidas = 0
+    ultima = 0
     skip = 0
-    batch_size = 10000
 
-    rango = f"{FECHA_INICIO} hasta FiscalMonthYear<={FISCAL_FIN}" if FISCAL_FIN else f"{FECHA_INICIO} (sin límite fiscal)"
-    print(f"Extrayendo rango: {rango}")
+    def leer(url: str) -> tuple[int, list[pd.DataFrame]]:
+        """(filas de la página, chunks retenidos: solo sin `al_recibir`)."""
+        filas, chunks = 0, []
+        for chunk in extraer_pagina(url):
+            filas += len(chunk)
+            if chunk.empty:
+                continue
+            if al_recibir is None:
+                chunks.append(chunk)
+            else:
+                al_recibir(chunk)
+        return filas, chunks
+
+    workers = get_config().odata_paginas_paralelas if workers is None else workers
+    total = contar_registros(construir_url_pagina(0, 1)) if workers > 1 else None
+    if total is not None:
+        skips = list(range(0, total, batch_size))
+        print(f"  {nombre}: {total} filas en {len(skips)} páginas ({min(workers, len(skips) or 1)} en paralelo)")
+        ctx = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pagina") as pool:
+            def enviar(s: int):
+                return pool.submit(ctx.copy().run, perfilado(leer), construir_url_pagina(s, batch_size))
+
+            en_vuelo = deque((s, enviar(s)) for s in skips[:workers])
+            siguientes = iter(skips[workers:])
+            while en_vuelo:
+                s, futuro = en_vuelo.popleft()
+                filas, chunks = futuro.result()
+                print(f"  Página {s//batch_size + 1} (skip={s}): {filas} filas.")
+                if filas:
+                    recibidas += 1
+                    ultima = filas
+                    all_batches.extend(chunks)
+                del chunks
+                proximo = next(siguientes, None)
+                if proximo is not None:
+                    en_vuelo.append((proximo, enviar(proximo)))
+
+        # Si la última página vino llena, llegaron filas después del conteo: seguir en secuencia
+        if not skips or recibidas < len(skips) or ultima < batch_size:
+            return all_batches
+        skip = skips[-1] + batch_size
 
     while True:
-        print(f"Página {skip//batch_size + 1} (skip={skip})...")
-        url = construir_url(skip=skip, top=batch_size)
-        df_batch = extraer_batch(url)
+        print(f"  Página {skip//batch_size + 1} (skip={skip})...")
+        filas, chunks = leer(construir_url_pagina(skip, batch_size))
 
-        if df_batch.empty:
+        if not filas:
             print("  Sin datos (fin).")
             break
 
-        print(f"  {len(df_batch)} filas en este batch.")
-        all_batches.append(df_batch)
+        print(f"  {filas} filas en este batch.")
+        all_batches.extend(chunks)
+        del chunks
 
-        if len(df_batch) < batch_size:
+        if filas < batch_size:
             print("  Último batch de este rango.")
             break
 
         skip += batch_size
 
-    df_ventas_1 = pd.concat(all_batches, ignore_index=True) if all_batches else pd.DataFrame()
+    return all_batches
 
-    if not df_ventas_1.empty:
-        sample_fiscal = df_ventas_1["FiscalMonthYear"].dropna().unique()[:5].tolist()
-        print(f"   Periodos en respuesta API (muestra): {sample_fiscal}")
+# ========= EXTRACCIÓN VENTAS (igual que antes) =========
+def construir_url(skip: int = 0, top: int = 10000, ventana: "Ventana | None" = None,
+                  filtro_extra: str | None = None) -> str:
+    cfg = get_config()
+    filtro = (
+        f"(CPOSTDATE ge datetime'{cfg.fecha_inicio}') and "
+        f"(CDSR_PROC_CATID ne 'CA_2')"
+    )
+    # SAP ByDesign da 400 con datetime lt; usamos campo fiscal (Date) en su lugar
+    if cfg.fiscal_fin:
+        filtro += f" and (CFISCALDDATES6F44DC8D81C7C41F le '{cfg.fiscal_fin}')"
+    if ventana is not None:
+        filtro += f" and {filtro_ventana(ventana)}"
+    if filtro_extra:
+        filtro += f" and ({filtro_extra})"
 
-    # Filtrar solo periodos objetivo (SAP puede devolver formatos distintos)
-    if not df_ventas_1.empty and (FISCAL_PERIODS_LIST or FISCAL_PERIODS_ALT):
-        periodos_validos = set(FISCAL_PERIODS_LIST + FISCAL_PERIODS_ALT)
+    url = (
+        f"{cfg.url(ENTIDAD_VENTAS)}"
+        f"?$select={SELECT_FIELDS}"
+        f"&$filter={filtro}"
+        f"&$top={top}"
+    )
+    if skip > 0:
+        url += f"&$skip={skip}"
+    return url
+
+CAMPOS_VENTAS = {
+    "C1CINHUUIDsDOC_INV_DATE":       ("Invoice_Date",       ""),
+    "CCUSTOMER":                     ("Customer",           ""),
+    "C1CUSTOMERsCITY_NAME":          ("City",               ""),
+    "CACCPERIOD":                    ("Accounting_Period",  ""),
+    "CCINHUUID":                     ("Invoice",            ""),
+    "CFISCALDDATES6F44DC8D81C7C41F": ("FiscalMonthYear",    ""),
+    "CPRODUCT":                      ("Product",            ""),
+    "CPROFITCTR":                    ("Profit_Center",      ""),
+    "CSALESUNIT":                    ("Sales_Unit",         ""),
+    "CZCE03SBUDES":                  ("E03_SBU_Name",       ""),
+    "KCZ38704318CAF9C0490E065D":     ("VENTAS_US",          "0"),
+    "KCZ206B9BDD38BC08F314528E":     ("COSTO_US",           "0"),
+    "KCZ80E56A9357921903E24583":     ("Cantidad_FacUS",     "0"),
+    "TCUSTOMER":                     ("Customer_Name",      ""),
+    "T1CUSTOMERsREGION_CODE":        ("State",              ""),
+    "TCOUNTRY_CODE":                 ("Country_Region",     ""),
+    "T1CINIUUIDsIP_PR_RC_UUID":      ("Ship_To",            ""),
+    "TRESPEMP":                      ("Person_Responsible", ""),
+}
+
+# ========= FORMATO DEL PERIODO FISCAL =========
+# SAP puede exponer CFISCALDDATES6F44DC8D81C7C41F como MM.YYYY o YYYY-MM según la
+# entidad, y en $metadata es Edm.String en ambos casos. Se detecta con una consulta
+# $top=1 por entidad, cacheada FORMATO_PERIODO_DIAS en ODATA_CACHE_DIR. Conocido el
+# formato, el $filter lleva un único `eq` exacto por periodo en vez de ambos.
+# Cada corrida informa cuántas filas ahorró el filtro (VENTAS_MEDIR_PUSHDOWN=false
+# lo apaga): un $inlinecount del rango base, el mismo filtro de fechas que antes
+# se descargaba entero, menos las filas que trajeron las ventanas.
+CAMPO_PERIODO = "CFISCALDDATES6F44DC8D81C7C41F"
+
+_formato_periodo: dict[str, str | None] = {}
+_lock_formato = threading.Lock()
+
+def _detectar_formato_periodo(url_entidad: str) -> str | None:
+    """'MM.YYYY' o 'YYYY-MM' según el primer valor que devuelve la entidad; None si no se pudo."""
+    try:
+        df = leer_pagina_df(f"{url_entidad}?$select={CAMPO_PERIODO}&$top=1")
+    except (requests.RequestException, urllib3.exceptions.HTTPError, etree.XMLSyntaxError, ValueError) as exc:
+        print(f"  Formato de periodo no detectado ({type(exc).__name__}); se filtra por ambos formatos.")
+        return None
+    valor = str(df[CAMPO_PERIODO].iloc[0]).strip() if CAMPO_PERIODO in df.columns and len(df) else ""
+    if re.match(r"^\d{2}\.\d{4}$", valor):
+        return "MM.YYYY"
+    if re.match(r"^\d{4}-\d{2}$", valor):
+        return "YYYY-MM"
+    return None
+
+def _leer_formatos(ruta: Path) -> dict:
+    """Formatos guardados; un archivo ausente, truncado o ajeno cuenta como caché vacía."""
+    try:
+        guardados = json.loads(ruta.read_text())
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(guardados, dict):
+        return {}
+    return {
+        url: previo for url, previo in guardados.items()
+        if isinstance(previo, dict) and isinstance(previo.get("ts"), (int, float)) and "formato" in previo
+    }
+
+def formato_periodo(entidad: str) -> str | None:
+    """Formato del periodo fiscal de `entidad` (en memoria y en disco); None = desconocido."""
+    cfg = get_config()
+    url_entidad = cfg.url(entidad)
+    with _lock_formato:
+        if url_entidad in _formato_periodo:
+            return _formato_periodo[url_entidad]
+        ruta = cfg.odata_cache_dir / "formato_periodo.json"
+        guardados = _leer_formatos(ruta) if cfg.odata_cache else {}
+        previo = guardados.get(url_entidad)
+        if previo and time.time() - previo["ts"] < cfg.formato_periodo_dias * 86400:
+            formato = previo["formato"]
+        else:
+            formato = _detectar_formato_periodo(url_entidad)
+            if cfg.odata_cache and formato:
+                guardados[url_entidad] = {"formato": formato, "ts": time.time()}
+                ruta.parent.mkdir(parents=True, exist_ok=True)
+                # Los tenants corren en procesos aparte sobre la misma caché: escritura atómica
+                temporal = ruta.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+                temporal.write_text(json.dumps(guardados, indent=1))
+                os.replace(temporal, ruta)
+            print(f"  Periodo fiscal de {entidad}: formato {formato or 'desconocido (ambos)'}")
+        _formato_periodo[url_entidad] = formato
+        return formato
+
+def medir_pushdown(filas_descargadas: int) -> None:
+    """
+    Filas del rango base de ventas que el filtro por periodo dejó en SAP: el
+    $inlinecount del rango base ($top=1, sin condiciones por periodo) menos las
+    `filas_descargadas` por las ventanas. Los bytes se estiman con el promedio por
+    fila de la corrida. Quedan en filas_evitadas/bytes_evitados de etl_run_log.
+    """
+    cfg = get_config()
+    if not cfg.ventas_medir_pushdown or not cfg.periodos:
+        return
+    token = reintentar_timeouts.set(False)
+    try:
+        base = contar_registros(construir_url(0, 1))
+    finally:
+        reintentar_timeouts.reset(token)
+    if base is None:
+        return
+    evitadas = max(0, base - filas_descargadas)
+    metricas = metricas_actuales.get()
+    recibidos = metricas.como_dict()["bytes_recibidos"] if metricas else 0
+    registrar(filas_evitadas=evitadas)
+    if not recibidos or not filas_descargadas:
+        # Páginas leídas de la caché: no hay bytes de red con qué estimar
+        log_json("pushdown", filas_evitadas=evitadas)
+        print(f"   🎯 Filtro de periodo en SAP: {evitadas} filas no descargadas")
+        return
+    bytes_evitados = int(evitadas * recibidos / filas_descargadas)
+    registrar(bytes_evitados=bytes_evitados)
+    log_json("pushdown", filas_evitadas=evitadas, bytes_evitados=bytes_evitados)
+    print(f"   🎯 Filtro de periodo en SAP: {evitadas} filas no descargadas (~{bytes_evitados / 1e6:.1f} MB)")
+
+def valores_periodo(periodo: str, formato: str | None) -> list[str]:
+    """Valores a comparar con `eq` para un periodo MM.YYYY según el formato de la entidad."""
+    mm, yyyy = periodo.split(".")
+    if formato == "MM.YYYY":
+        return [periodo]
+    if formato == "YYYY-MM":
+        return [f"{yyyy}-{mm}"]
+    return [periodo, f"{yyyy}-{mm}"]
+
+# ========= VENTANAS DE EXTRACCIÓN (VENTAS) =========
+# En vez de un único filtro recorrido con $skip profundo (cada página es más lenta
+# del lado de SAP y los rangos amplios llegan al timeout), el rango se parte en
+# ventanas independientes: una por periodo fiscal y, si hace falta, grupos de días
+# de CPOSTDATE (como disyunción de `eq`, porque `datetime lt` da 400). Una ventana
+# se biseca cuando su conteo supera VENTAS_VENTANA_MAX_FILAS o cuando da timeout.
+# Partir por días supone periodo fiscal = mes calendario de CPOSTDATE y fechas a
+# medianoche; una fila fuera de eso no caería en ninguna mitad. Por eso cada corte
+# se verifica con $inlinecount (las mitades deben sumar el total de la ventana): si
+# no cuadra, la ventana se pagina entera con $skip, o falla si fue por timeout.
+
+# (periodo MM.YYYY, días de CPOSTDATE o None = el periodo completo)
+Ventana = tuple[str, tuple[date, ...] | None]
+
+def _mes(fecha: date) -> date:
+    return fecha.replace(day=1)
+
+def ventanas_iniciales() -> list[Ventana]:
+    """
+    Una ventana por periodo fiscal entre el inicio y el periodo fiscal final (o el
+    mes actual). Si hay periodos a recargar, solo esos: el resto se descartaba igual.
+    """
+    cfg = get_config()
+    desde = _mes(datetime.fromisoformat(cfg.fecha_inicio).date())
+    if cfg.fiscal_fin:
+        mm, yyyy = cfg.fiscal_fin.split(".")
+        hasta = date(int(yyyy), int(mm), 1)
+    else:
+        hasta = _mes(date.today())
+    ventanas = []
+    while desde <= hasta:
+        ventanas.append((desde.strftime("%m.%Y"), None))
+        desde += relativedelta(months=1)
+    if cfg.periodos:
+        ventanas = [v for v in ventanas if v[0] in cfg.periodos]
+    return ventanas
+
+def _dias_periodo(periodo: str) -> tuple[date, ...]:
+    """Días del periodo desde el inicio de la ventana (los anteriores ya quedan fuera por el filtro base)."""
+    mm, yyyy = periodo.split(".")
+    inicio = date(int(yyyy), int(mm), 1)
+    fin = inicio + relativedelta(months=1)
+    dia = max(inicio, datetime.fromisoformat(get_config().fecha_inicio).date())
+    dias = []
+    while dia < fin:
+        dias.append(dia)
+        dia += timedelta(days=1)
+    return tuple(dias)
+
+def filtro_ventana(ventana: Ventana) -> str:
+    periodo, dias = ventana
+    valores = valores_periodo(periodo, formato_periodo(ENTIDAD_VENTAS))
+    filtro = "(" + " or ".join(f"{CAMPO_PERIODO} eq '{v}'" for v in valores) + ")"
+    if dias is not None:
+        filtro += " and (" + " or ".join(f"CPOSTDATE eq datetime'{d:%Y-%m-%d}T00:00:00'" for d in dias) + ")"
+    return filtro
+
+def _describir_ventana(ventana: Ventana) -> str:
+    periodo, dias = ventana
+    if dias is None:
+        return periodo
+    if len(dias) == 1:
+        return f"{periodo} [{dias[0]:%d}]"
+    return f"{periodo} [{dias[0]:%d}-{dias[-1]:%d}]"
+
+def bisecar_ventana(ventana: Ventana) -> list[Ventana]:
+    """Parte la ventana en dos mitades de días; [] si ya es un solo día."""
+    periodo, dias = ventana
+    dias = _dias_periodo(periodo) if dias is None else dias
+    if len(dias) <= 1:
+        return []
+    mitad = len(dias) // 2
+    return [(periodo, dias[:mitad]), (periodo, dias[mitad:])]
+
+def _partir_verificada(ventana: Ventana, total: int | None) -> list[tuple[Ventana, int]]:
+    """
+    Biseca la ventana y confirma con $inlinecount que las mitades suman `total`.
+    Retorna [(mitad, conteo), ...], o [] si no se puede partir, falta el conteo o
+    no cuadra (filas que ninguna mitad alcanzaría a pedir).
+    """
+    mitades = bisecar_ventana(ventana)
+    if not mitades or total is None:
+        return []
+    conteos = [contar_registros(construir_url(0, 1, m)) for m in mitades]
+    if None in conteos or sum(conteos) != total:
+        suma = "sin conteo" if None in conteos else f"{sum(conteos)} filas"
+        print(f"  ⚠️ Ventana {_describir_ventana(ventana)}: las mitades suman {suma} de {total}; no se parte")
+        return []
+    return list(zip(mitades, conteos))
+
+def _extraer_ventana(ventana: Ventana, batch_size: int,
+                     total: int | None = None) -> tuple[list[tuple[Ventana, int]], pd.DataFrame | None]:
+    """
+    Descarga una ventana. Retorna (sub-ventanas con su conteo, None) si hubo que
+    partirla, o ([], DataFrame) con sus filas. `total` es el conteo ya verificado
+    al partir la ventana padre. Los timeouts no se reintentan aquí: se biseca.
+    """
+    cfg = get_config()
+    reintentar_timeouts.set(False)
+    nombre = _describir_ventana(ventana)
+    # Ventana ya completa en la corrida que se reanuda: sus páginas están en caché
+    completa = REANUDAR and cfg.odata_cache and get_checkpoints().hecho("ventana", nombre)
+    if total is None and not completa:
+        total = contar_registros(construir_url(0, 1, ventana))
+    if total is not None and total > cfg.ventas_ventana_max_filas:
+        mitades = _partir_verificada(ventana, total)
+        if mitades:
+            print(f"  ✂️ Ventana {nombre}: {total} filas > {cfg.ventas_ventana_max_filas}; se parte en dos")
+            return mitades, None
+    try:
+        batches = paginar(
+            f"Ventas {nombre}", lambda s, t: construir_url(s, t, ventana),
+            lambda url: iterar_pagina(url, CAMPOS_VENTAS), batch_size, workers=1,
+        )
+    except (requests.RequestException, urllib3.exceptions.HTTPError) as exc:
+        if not es_timeout(exc):
+            raise
+        if total is None:
+            total = contar_registros(construir_url(0, 1, ventana))
+        mitades = _partir_verificada(ventana, total)
+        if not mitades:
+            raise
+        print(f"  ✂️ Ventana {nombre}: timeout; se parte en dos")
+        return mitades, None
+    df = pd.concat(batches, ignore_index=True) if batches else pd.DataFrame()
+    print(f"  ✅ Ventana {nombre}: {len(df)} filas")
+    if cfg.odata_cache:
+        get_checkpoints().marcar("ventana", nombre, len(df))
+    return [], df
+
+def extraer_por_ventanas(ventanas: list[Ventana], batch_size: int,
+                         workers: int | None = None, al_recibir=None) -> pd.DataFrame:
+    """
+    Descarga las ventanas en un pool acotado, bisecando las que lo necesiten, y
+    concatena el resultado en orden de ventana. Una fila que llegue en dos ventanas
+    (p. ej. porque SAP la movió durante la paginación) se descarta por su hash; las
+    filas idénticas dentro de una misma ventana se conservan como líneas distintas.
+    Con `al_recibir`, cada ventana (ya sin repetidas) se le entrega al completarse,
+    en orden de llegada, y se retorna un DataFrame vacío. Solo hay `workers`
+    ventanas en vuelo: la siguiente se envía al procesar una terminada, así que
+    si `al_recibir` espera (cola de carga llena) no se siguen acumulando ventanas.
+    """
+    resultados = {}
+    vistos = set()
+    workers = max(1, get_config().ventas_ventanas_paralelas if workers is None else workers)
+    por_enviar = deque((v, None) for v in ventanas)
+    ctx = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ventana") as pool:
+        pendientes = {}
+
+        def completar() -> None:
+            while por_enviar and len(pendientes) < workers:
+                v, total = por_enviar.popleft()
+                pendientes[pool.submit(ctx.copy().run, perfilado(_extraer_ventana), v, batch_size, total)] = v
+
+        completar()
+        while pendientes:
+            listos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                ventana = pendientes.pop(futuro)
+                mitades, df = futuro.result()
+                # Las mitades van antes que las ventanas aún no enviadas
+                por_enviar.extendleft(reversed(mitades))
+                if df is None or df.empty:
+                    completar()
+                    continue
+                if al_recibir is None:
+                    resultados[ventana] = df
+                    completar()
+                    continue
+                hashes = hash_filas(df)
+                repetidas = hashes.isin(vistos).to_numpy()
+                vistos.update(hashes.tolist())
+                if repetidas.any():
+                    print(f"   Dedupe entre ventanas: {int(repetidas.sum())} filas repetidas descartadas")
+                    df = df[~repetidas].reset_index(drop=True)
+                al_recibir(df)
+                del df
+                completar()
+
+    orden = sorted(resultados, key=lambda v: (v[0][3:], v[0][:2], v[1] or ()))
+    if not orden:
+        return pd.DataFrame()
+    df = pd.concat([resultados[v] for v in orden], ignore_index=True)
+    hashes = pd.concat([hash_filas(resultados[v]) for v in orden], ignore_index=True)
+    repetidas = hashes.duplicated()
+    if repetidas.any():
+        print(f"   Dedupe entre ventanas: {int(repetidas.sum())} filas repetidas descartadas")
+        df = df[~repetidas.to_numpy()].reset_index(drop=True)
+    return df
+
+def _imprimir_rango_ventas() -> None:
+    cfg = get_config()
+    rango = f"{cfg.fecha_inicio} hasta FiscalMonthYear<={cfg.fiscal_fin}" if cfg.fiscal_fin else f"{cfg.fecha_inicio} (sin límite fiscal)"
+    print(f"Extrayendo rango: {rango}")
+
+def transformar_ventas(df_ventas_1: pd.DataFrame) -> pd.DataFrame:
+    """Filtro de periodos objetivo, cifras numéricas y cambio de signo (fila a fila)."""
+    cfg = get_config()
+    # Red de seguridad: las ventanas ya piden a SAP solo los periodos objetivo
+    if not df_ventas_1.empty and (cfg.periodos or cfg.periodos_alt):
+        periodos_validos = set(cfg.periodos + cfg.periodos_alt)
         antes = len(df_ventas_1)
         df_ventas_1 = df_ventas_1[df_ventas_1["FiscalMonthYear"].astype(str).str.strip().isin(periodos_validos)]
         if len(df_ventas_1) < antes:
             print(f"   Filtro periodo: {antes} → {len(df_ventas_1)} filas (solo {list(periodos_validos)})")
 
     if df_ventas_1.empty:
-        print("⚠️ No hay datos en este rango. Retornando DataFrame vacío.")
         return df_ventas_1
-    # ==========================
+    df_ventas_1 = df_ventas_1.copy()
 
+    # Ya llegan como float por su tipo EDM; solo se convierten si SAP no informó el tipo
     for col in ["VENTAS_US", "COSTO_US", "Cantidad_FacUS"]:
-        df_ventas_1[col] = pd.to_numeric(df_ventas_1[col], errors="coerce")
+        if not pd.api.types.is_numeric_dtype(df_ventas_1[col]):
+            df_ventas_1[col] = pd.to_numeric(df_ventas_1[col], errors="coerce")
 
     df_ventas_1['periodo_data'] = 'Dic 2025 en adelante'
 
-    print("🔄 Cambiando signo VENTAS_US y COSTO_US a negativos...")
     df_ventas_1['VENTAS_US'] = df_ventas_1['VENTAS_US'] * -1
     df_ventas_1['COSTO_US']   = df_ventas_1['COSTO_US'] * -1
+    return df_ventas_1
+
+def extraer_ventas() -> pd.DataFrame:
+    batch_size = 10000
+    _imprimir_rango_ventas()
+
+    formato_periodo(ENTIDAD_VENTAS)  # una vez, antes de abrir las ventanas en paralelo
+    ventanas = ventanas_iniciales()
+    print(f"  Ventas: {len(ventanas)} ventanas por periodo fiscal ({min(get_config().ventas_ventanas_paralelas, len(ventanas))} en paralelo)")
+    df_ventas_1 = categorizar(extraer_por_ventanas(ventanas, batch_size))
+    medir_pushdown(len(df_ventas_1))
+
+    if not df_ventas_1.empty:
+        sample_fiscal = df_ventas_1["FiscalMonthYear"].dropna().unique()[:5].tolist()
+        print(f"   Periodos en respuesta API (muestra): {sample_fiscal}")
+
+    with etapa("transformacion"):
+        print("🔄 Cambiando signo VENTAS_US y COSTO_US a negativos...")
+        df_ventas_1 = transformar_ventas(df_ventas_1)
+
+    if df_ventas_1.empty:
+        print("⚠️ No hay datos en este rango. Retornando DataFrame vacío.")
+        return df_ventas_1
 
     print(f"\nTotal de registros obtenidos: {len(df_ventas_1)}")
     return df_ventas_1
 
-def cargar_a_postgres(df_ventas_1: pd.DataFrame) -> None:
-    engine = get_engine()
+def producir_ventas(emitir) -> None:
+    """
+    Versión en streaming de extraer_ventas + preparar_carga_ventas: cada ventana
+    se transforma y se entrega a `emitir` apenas termina de descargarse.
+    """
+    _imprimir_rango_ventas()
+    formato_periodo(ENTIDAD_VENTAS)  # una vez, antes de abrir las ventanas en paralelo
+    ventanas = ventanas_iniciales()
+    print(f"  Ventas: {len(ventanas)} ventanas por periodo fiscal ({min(get_config().ventas_ventanas_paralelas, len(ventanas))} en paralelo, carga en streaming)")
+    print("🔄 Cambiando signo VENTAS_US y COSTO_US a negativos...")
+
+    descargadas = 0
+
+    def recibir(df: pd.DataFrame) -> None:
+        nonlocal descargadas
+        descargadas += len(df)
+        t0 = time.perf_counter()
+        df = transformar_ventas(categorizar(df))
+        if not df.empty:
+            df = preparar_carga_ventas(df)
+        registrar(transformacion_seg=time.perf_counter() - t0)
+        emitir(df)
+
+    extraer_por_ventanas(ventanas, 10000, al_recibir=recibir)
+    medir_pushdown(descargadas)
+
+# ========= VENTAS PARTICIONADA POR PERIODO FISCAL =========
+# sap_byd_ventas es una tabla particionada (LIST) por "FiscalMonthYear", normalizado
+# a MM.YYYY: una partición por periodo (sap_byd_ventas_pYYYY_MM) más una DEFAULT.
+# Recargar un periodo = llenar una tabla nueva y reemplazar la partición con
+# DETACH/DROP/ATTACH en una transacción corta; sin DELETE masivo ni tuplas muertas,
+# y el planner poda particiones en las consultas por periodo.
+TABLA_VENTAS = "sap_byd_ventas"
+
+_RE_PERIODO_MM_YYYY = re.compile(r"^(\d{2})\.(\d{4})$")
+
+def normalizar_periodos(serie: pd.Series) -> pd.Series:
+    """Lleva los periodos YYYY-MM a MM.YYYY (el formato de FISCAL_PERIODS_TO_RELOAD)."""
+    return serie.astype(str).str.strip().str.replace(r"^(\d{4})-(\d{2})$", r"\2.\1", regex=True)
+
+def sql_periodo_mm_yyyy(columna: str) -> str:
+    """Expresión SQL equivalente a `normalizar_periodos` (YYYY-MM -> MM.YYYY)."""
+    col = _nombre_calificado(columna)
+    return (
+        f"CASE WHEN {col} ~ '^[0-9]{{4}}-[0-9]{{2}}$' "
+        f"THEN right({col}, 2) || '.' || left({col}, 4) ELSE {col} END"
+    )
 
+def nombre_particion(periodo: str) -> str | None:
+    """sap_byd_ventas_p2026_01 para '01.2026'; None si el valor no es un periodo MM.YYYY."""
+    m = _RE_PERIODO_MM_YYYY.match(periodo)
+    return f"{TABLA_VENTAS}_p{m.group(2)}_{m.group(1)}" if m else None
+
+def periodos_recarga_ventas() -> list[str]:
+    """Periodos a recargar de la corrida, normalizados a MM.YYYY."""
+    cfg = get_config()
+    periodos = sorted(set(normalizar_periodos(pd.Series(cfg.periodos + cfg.periodos_alt, dtype=object))))
+    return [p for p in periodos if nombre_particion(p)]
+
+def _es_particionada(conn, nombre_tabla: str) -> bool:
+    return conn.execute(text("""
+        SELECT c.relkind = 'p' FROM pg_class c
+        WHERE c.relname = :t AND c.relnamespace = current_schema()::regnamespace
+    """), {"t": nombre_tabla}).scalar() or False
+
+def _literal(valor: str) -> str:
+    return "'" + valor.replace("'", "''") + "'"
+
+def _crear_particion(conn, periodo: str) -> None:
+    particion = nombre_particion(periodo)
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {_nombre_calificado(particion)} "
+        f"PARTITION OF {_nombre_calificado(TABLA_VENTAS)} FOR VALUES IN ({_literal(periodo)})"
+    ))
+
+def _crear_ventas_particionada(conn, molde: str) -> None:
+    """Crea el padre particionado con las columnas de `molde` y la partición DEFAULT."""
+    conn.execute(text(
+        f"CREATE TABLE {_nombre_calificado(TABLA_VENTAS)} (LIKE {_nombre_calificado(molde)} INCLUDING DEFAULTS) "
+        f'PARTITION BY LIST ("FiscalMonthYear")'
+    ))
+    conn.execute(text(
+        f"CREATE TABLE {_nombre_calificado(TABLA_VENTAS + '_pdefault')} "
+        f"PARTITION OF {_nombre_calificado(TABLA_VENTAS)} DEFAULT"
+    ))
+
+def asegurar_ventas_particionada(engine, df: pd.DataFrame, dtype: dict) -> None:
+    """
+    Primera carga: crea el padre particionado con el tipado de `dtype`.
+    Tabla plana existente: la migra en una transacción (periodos normalizados a
+    MM.YYYY, una partición por periodo, índices y grants replicados en el padre).
+    """
+    with engine.connect() as conn:
+        existe = _tabla_existe(conn, TABLA_VENTAS)
+        if existe and _es_particionada(conn, TABLA_VENTAS):
+            return
+
+    with engine.begin() as conn:
+        if not existe:
+            print(f"🆕 Primera carga: se creará {TABLA_VENTAS} particionada por FiscalMonthYear")
+            molde = _nombre_staging(TABLA_VENTAS, "__molde")
+            conn.execute(text(f"DROP TABLE IF EXISTS {_nombre_calificado(molde)}"))
+            df.head(0).to_sql(name=molde, con=conn, index=False, dtype=dtype)
+            _crear_ventas_particionada(conn, molde)
+            conn.execute(text(f"DROP TABLE {_nombre_calificado(molde)}"))
+            return
+
+        print(f"🔀 Migrando {TABLA_VENTAS} a tabla particionada por periodo fiscal...")
+        legado = _nombre_staging(TABLA_VENTAS, "__legacy")
+        estructura = _estructura_tabla(conn, TABLA_VENTAS)
+        conn.execute(text(f"ALTER TABLE {_nombre_calificado(TABLA_VENTAS)} RENAME TO {_nombre_calificado(legado)}"))
+        _crear_ventas_particionada(conn, legado)
+
+        periodo = sql_periodo_mm_yyyy("FiscalMonthYear")
+        periodos = conn.execute(text(f"SELECT DISTINCT {periodo} FROM {_nombre_calificado(legado)}")).scalars().all()
+        for p in periodos:
+            if p and nombre_particion(p):
+                _crear_particion(conn, p)
+
+        columnas = _columnas_tabla(conn, legado)
+        cols_sql = ", ".join(_nombre_calificado(c) for c in columnas)
+        select_sql = ", ".join(
+            f"{periodo} AS {_nombre_calificado(c)}" if c == "FiscalMonthYear" else _nombre_calificado(c)
+            for c in columnas
+        )
+        movidas = conn.execute(text(
+            f"INSERT INTO {_nombre_calificado(TABLA_VENTAS)} ({cols_sql}) "
+            f"SELECT {select_sql} FROM {_nombre_calificado(legado)}"
+        )).rowcount
+
+        # En tablas particionadas las claves únicas deben incluir la clave de partición
+        estructura["constraints"] = [
+            (n, d) for n, d in estructura["constraints"] if d.startswith("CHECK") or '"FiscalMonthYear"' in d
+        ]
+        estructura["indices"] = [
+            (n, d, c) for n, d, c in estructura["indices"] if "UNIQUE" not in d or '"FiscalMonthYear"' in d
+        ]
+        renombres = _replicar_estructura(conn, estructura, TABLA_VENTAS)
+        conn.execute(text(f"DROP TABLE {_nombre_calificado(legado)}"))
+        for tipo, temporal, definitivo in renombres:
+            if tipo == "constraint":
+                conn.execute(text(
+                    f"ALTER TABLE {_nombre_calificado(TABLA_VENTAS)} RENAME CONSTRAINT "
+                    f"{_nombre_calificado(temporal)} TO {_nombre_calificado(definitivo)}"
+                ))
+            else:
+                conn.execute(text(f"ALTER INDEX {_nombre_calificado(temporal)} RENAME TO {_nombre_calificado(definitivo)}"))
+        print(f"   {movidas} filas migradas en {len(periodos)} periodos")
+
+def _indices_padre(conn) -> list[str]:
+    """Definiciones de los índices del padre, para crearlos en la tabla nueva antes del ATTACH."""
+    defs = conn.execute(text("""
+        SELECT indexdef FROM pg_indexes
+        WHERE tablename = :t AND schemaname = current_schema()
+    """), {"t": TABLA_VENTAS}).scalars().all()
+    return [m.group(4) for m in map(_RE_INDEXDEF.match, defs) if m]
+
+class DestinoVentasParticionada:
+    """
+    Recarga por periodo alimentada por chunks: las filas de cada periodo a recargar
+    van a una tabla nueva (con CHECK del periodo para que el ATTACH no tenga que
+    validar filas) y el resto a una staging UNLOGGED. Al publicar, en una sola
+    transacción, DETACH + DROP de cada partición vieja, ATTACH de la nueva e
+    inserción del resto. Sin periodos definidos solo se agregan filas (append).
+    """
+
+    nombre_tabla = TABLA_VENTAS
+
+    def __init__(self, dtype: dict):
+        self.periodos_recarga = periodos_recarga_ventas()
+        self.dtype = dtype
+        self.nuevas = {}
+        self.resto = None
+        self.filas = 0
+        if not self.periodos_recarga:
+            print("⚠️ No se definieron periodos en FISCAL_PERIODS_TO_RELOAD; se agregan filas sin reemplazar particiones.")
+
+    def _nueva(self, conn, periodo: str) -> str:
+        if periodo not in self.nuevas:
+            particion = nombre_particion(periodo)
+            nueva = _nombre_staging(particion)
+            conn.execute(text(f"DROP TABLE IF EXISTS {_nombre_calificado(nueva)}"))
+            conn.execute(text(
+                f"CREATE TABLE {_nombre_calificado(nueva)} "
+                f"(LIKE {_nombre_calificado(TABLA_VENTAS)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            ))
+            self.nuevas[periodo] = [particion, nueva, 0]
+        return self.nuevas[periodo][1]
+
+    def cargar(self, conn, df: pd.DataFrame) -> None:
+        df = df.assign(FiscalMonthYear=normalizar_periodos(df["FiscalMonthYear"]))
+        if not self.filas:
+            # Otra conexión: este chunk es lo primero que hace la transacción de carga
+            asegurar_ventas_particionada(conn.engine, df, self.dtype)
+        en_recarga = df["FiscalMonthYear"].isin(self.periodos_recarga)
+        for periodo in df.loc[en_recarga, "FiscalMonthYear"].unique():
+            df_periodo = df[df["FiscalMonthYear"] == periodo]
+            cargar_copy(df_periodo, conn, self._nueva(conn, periodo), if_exists="append", dtype=self.dtype)
+            self.nuevas[periodo][2] += len(df_periodo)
+        resto = df[~en_recarga]
+        if not resto.empty:
+            if self.resto is None:
+                self.resto = _nombre_staging(TABLA_VENTAS, "__resto")
+                conn.execute(text(f"DROP TABLE IF EXISTS {_nombre_calificado(self.resto)}"))
+                conn.execute(text(
+                    f"CREATE UNLOGGED TABLE {_nombre_calificado(self.resto)} "
+                    f"(LIKE {_nombre_calificado(TABLA_VENTAS)} INCLUDING DEFAULTS)"
+                ))
+            cargar_copy(resto, conn, self.resto, if_exists="append", dtype=self.dtype)
+        self.filas += len(df)
+
+    def finalizar(self, conn) -> None:
+        if not self.filas:
+            return
+        indices = _indices_padre(conn)
+        for periodo in self.periodos_recarga:
+            nueva = self._nueva(conn, periodo)
+            particion = self.nuevas[periodo][0]
+            conn.execute(text(
+                f"ALTER TABLE {_nombre_calificado(nueva)} ADD CONSTRAINT {_nombre_calificado(particion + '_periodo')} "
+                f'CHECK ("FiscalMonthYear" IS NOT NULL AND "FiscalMonthYear" = {_literal(periodo)})'
+            ))
+            for definicion in indices:
+                conn.execute(text(f"CREATE INDEX ON {_nombre_calificado(nueva)} {definicion}"))
+
+    def publicar(self, engine) -> None:
+        if not self.filas:
+            return
+        padre = _nombre_calificado(TABLA_VENTAS)
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL lock_timeout = '{get_config().swap_lock_timeout}'"))
+            for periodo, (particion, nueva, filas) in sorted(self.nuevas.items()):
+                if _tabla_existe(conn, particion):
+                    conn.execute(text(f"ALTER TABLE {padre} DETACH PARTITION {_nombre_calificado(particion)}"))
+                    conn.execute(text(f"DROP TABLE {_nombre_calificado(particion)}"))
+                conn.execute(text(f"ALTER TABLE {_nombre_calificado(nueva)} RENAME TO {_nombre_calificado(particion)}"))
+                conn.execute(text(
+                    f"ALTER TABLE {padre} ATTACH PARTITION {_nombre_calificado(particion)} FOR VALUES IN ({_literal(periodo)})"
+                ))
+                print(f"   🔁 Partición {particion}: {filas} filas")
+
+            if self.resto is not None:
+                resto = _nombre_calificado(self.resto)
+                for periodo in conn.execute(text(f'SELECT DISTINCT "FiscalMonthYear" FROM {resto}')).scalars():
+                    if periodo and nombre_particion(periodo):
+                        _crear_particion(conn, periodo)
+                conn.execute(text(f"INSERT INTO {padre} SELECT * FROM {resto}"))
+                conn.execute(text(f"DROP TABLE {resto}"))
+        if self.nuevas:
+            print(f"   Swap de {len(self.nuevas)} particiones en {(time.perf_counter() - t0) * 1000:.0f} ms")
+        # Solo se analizan las particiones recargadas; el resto no cambió (o cambió poco)
+        asegurar_indices(engine, TABLA_VENTAS, analizar=[p for p, _, _ in self.nuevas.values()] or None)
+
+DTYPE_VENTAS = {
+    "Invoice_Date":       String(25),
+    "Customer":           String(10),
+    "City":               String(100),
+    "Accounting_Period":  String(10),
+    "Invoice":            String(15),
+    "FiscalMonthYear":    String(10),
+    "Product":            String(100),
+    "Profit_Center":      String(15),
+    "Sales_Unit":         String(20),
+    "E03_SBU_Name":       String(20),
+    "VENTAS_US":          Float,
+    "COSTO_US":           Float,
+    "Cantidad_FacUS":     Float,
+    "Customer_Name":      String(50),
+    "State":              String(20),
+    "Country_Region":     String(10),
+    "Ship_To":            String(60),
+    "Person_Responsible": String(50),
+    "periodo_data":       String(50)
+}
+
+def preparar_carga_ventas(df_ventas_1: pd.DataFrame) -> pd.DataFrame:
+    """Recorta los textos al largo de las columnas de sap_byd_ventas."""
     df_ventas_1['Ship_To']            = df_ventas_1['Ship_To'].astype(str).str[:60]
     df_ventas_1['Customer_Name']      = df_ventas_1['Customer_Name'].astype(str).str[:50]
     df_ventas_1['Person_Responsible'] = df_ventas_1['Person_Responsible'].astype(str).str[:50]
     df_ventas_1['City']               = df_ventas_1['City'].astype(str).str[:100]
     df_ventas_1['Product']            = df_ventas_1['Product'].astype(str).str[:100]
+    return df_ventas_1
 
-    dtype_map = {
-        "Invoice_Date":       String(25),
-        "Customer":           String(10),
-        "City":               String(100),
-        "Accounting_Period":  String(10),
-        "Invoice":            String(15),
-        "FiscalMonthYear":    String(10),
-        "Product":            String(100),
-        "Profit_Center":      String(15),
-        "Sales_Unit":         String(20),
-        "E03_SBU_Name":       String(20),
-        "VENTAS_US":          Float,
-        "COSTO_US":           Float,
-        "Cantidad_FacUS":     Float,
-        "Customer_Name":      String(50),
-        "State":              String(20),
-        "Country_Region":     String(10),
-        "Ship_To":            String(60),
-        "Person_Responsible": String(50),
-        "periodo_data":       String(50)
-    }
+def cargar_a_postgres(df_ventas_1: pd.DataFrame) -> None:
+    engine = get_engine()
+    df_ventas_1 = preparar_carga_ventas(df_ventas_1)
+    dtype_map = DTYPE_VENTAS
 
     with engine.connect() as conn:
         table_exists = conn.dialect.has_table(conn, "sap_byd_ventas")
 
     with engine.begin() as conn:
-        if table_exists and (FISCAL_PERIODS_LIST or FISCAL_PERIODS_ALT):
+        cfg = get_config()
+        if table_exists and (cfg.periodos or cfg.periodos_alt):
             # SAP puede guardar MM.YYYY o YYYY-MM; borrar ambos formatos
-            periodos_borrar = list(dict.fromkeys(FISCAL_PERIODS_LIST + FISCAL_PERIODS_ALT))
+            periodos_borrar = list(dict.fromkeys(cfg.periodos + cfg.periodos_alt))
             print("🧹 Eliminando registros por FiscalMonthYear en sap_byd_ventas...")
             print(f"   Periodos a borrar (formatos MM.YYYY y YYYY-MM): {periodos_borrar}")
 
@@ -298,26 +2900,17 @@ def cargar_a_postgres(df_ventas_1: pd.DataFrame) -> None:
 
         if_exists_mode = 'append' if table_exists else 'fail'
 
-        df_ventas_1.to_sql(
-            name='sap_byd_ventas',
-            con=conn,
-            if_exists=if_exists_mode,
-            index=False,
-            dtype=dtype_map,
-            method='multi',
-            chunksize=1000
-        )
+        cargar_copy(df_ventas_1, conn, 'sap_byd_ventas', if_exists=if_exists_mode, dtype=dtype_map)
 
+    asegurar_indices(engine, "sap_byd_ventas")
     print(f"✅ Cargados {len(df_ventas_1)} registros de ventas")
     engine.dispose()
     print("🔌 Conexión cerrada (ventas)")
 
 # ========= ODATA ORDENES =========
-ODATA_ORDENES_URL = (
-    "https://my336154.sapbydesign.com/sap/byd/odata/"
-    "cc_home_analytics.svc/"
-    "RPZA64281B20A8D0329C26607QueryResults"
-    "?$select=CBP_INT_ID,TBP_INT_ID,CYPCJYMI4Y_ZBRAND,"
+ENTIDAD_ORDENES = "RPZA64281B20A8D0329C26607QueryResults"
+SELECT_ORDENES = (
+    "CBP_INT_ID,TBP_INT_ID,CYPCJYMI4Y_ZBRAND,"
     "CIPY_BUY_CTYNM_N,CIPY_PRD_REC_ADR_CITY,TDBA_DISTRCHN_CD,"
     "CZCE03SBUDES,CIPY_EMP_RSP_PTY,TIPY_EMP_RSP_PTY,"
     "CFISCALDDATES6F44DC8D81C7C41F,CIPR_PRODUCT,TIPR_PRODUCT,"
@@ -330,21 +2923,21 @@ ODATA_ORDENES_URL = (
     "KCZC4CE47BAD42C81EA5B0D0F,KCZ998098F004AB32E2511CF5,"
     "KCZ95857413FCAF0B77113DCF,C1ITM_UUIDsDOC_S_APPROVAL,"
     "T1ITM_UUIDsDOC_S_APPROVAL"
-    f"&$filter=(CFISCALDDATES6F44DC8D81C7C41F ge '{fecha_fiscal_ordenes}') "
-    f"and (CDOC_CREATED_DT ge datetime'{fecha_inicio_ordenes}')"
-    "&$top=15000"
 )
 
+def url_ordenes() -> str:
+    cfg = get_config()
+    return (
+        f"{cfg.url(ENTIDAD_ORDENES)}"
+        f"?$select={SELECT_ORDENES}"
+        f"&$filter=(CFISCALDDATES6F44DC8D81C7C41F ge '{cfg.fecha_fiscal_ordenes}') "
+        f"and (CDOC_CREATED_DT ge datetime'{cfg.fecha_inicio_ordenes}')"
+        "&$top=15000"
+    )
+
 def extraer_ordenes() -> pd.DataFrame:
     print("Extrayendo OData de órdenes...")
-    resp = requests.get(ODATA_ORDENES_URL, auth=(BJD_USER, BJD_PASS), timeout=300)
-    resp.raise_for_status()
-
-    df = pd.read_xml(
-        resp.content,
-        xpath=".//atom:entry/atom:content/m:properties",
-        namespaces=ns
-    )
+    df = leer_pagina_df(url_ordenes())
 
     rename_map = {
         "CBP_INT_ID": "Customer",
@@ -375,12 +2968,17 @@ def extraer_ordenes() -> pd.DataFrame:
         "C1ITM_UUIDsDOC_S_APPROVAL": "posicion_prod1",
         "T1ITM_UUIDsDOC_S_APPROVAL": "posicion_prod2",
     }
-    df = df.rename(columns=rename_map)
+    with etapa("transformacion"):
+        df = df.rename(columns=rename_map)
 
     # Si en el futuro quieres dejar solo el subset de columnas, se puede hacer aquí.
     print(f"Órdenes: {len(df)} filas extraídas")
     return df
 
+# ORDENES_MODO_CARGA: "upsert" (por Sales Order + Sales Order Item) o "replace"
+# (reemplazo completo)
+CLAVES_ORDENES = ["Sales Order", "Sales Order Item"]
+
 def cargar_ordenes(df: pd.DataFrame) -> None:
     engine = get_engine()
 
@@ -390,43 +2988,50 @@ def cargar_ordenes(df: pd.DataFrame) -> None:
         "Sales Order": String(20)
     }
 
-    with engine.begin() as conn:
-        df.to_sql(
-            name="sap_byd_ordenes",
-            con=conn,
-            if_exists="replace",
-            index=False,
-            dtype=dtype_map_ordenes,
-            method="multi",
-            chunksize=1000
-        )
+    if get_config().ordenes_modo_carga == "replace":
+        cargar_replace_atomico(engine, df, "sap_byd_ordenes", dtype=dtype_map_ordenes)
+        asegurar_indices(engine, "sap_byd_ordenes")
+        engine.dispose()
+        print(f"✅ Órdenes cargadas en sap_byd_ordenes ({len(df)} filas, replace completo)")
+        return
+
+    # Solo se reescriben las filas que cambiaron; se borran las claves de la
+    # ventana refrescada (periodo fiscal >= fecha_fiscal_ordenes) que ya no vinieron.
+    stats = upsert_por_clave(
+        engine, df, "sap_byd_ordenes", CLAVES_ORDENES,
+        dtype=dtype_map_ordenes,
+        ventana_sql=f"{sql_periodo_normalizado('FiscalMonthYear')} >= :desde",
+        ventana_params={"desde": get_config().fecha_fiscal_ordenes},
+    )
+    asegurar_indices(engine, "sap_byd_ordenes")
     engine.dispose()
-    print(f"✅ Órdenes cargadas en sap_byd_ordenes ({len(df)} filas, replace completo)")
+    print(
+        f"✅ Órdenes upsert en sap_byd_ordenes: {stats['insertadas']} insertadas, "
+        f"{stats['actualizadas']} actualizadas, {stats['eliminadas']} eliminadas, "
+        f"{stats['sin_cambios']} sin cambios"
+    )
 
 # ========= ODATA COSTO PRODUCTO =========
-ODATA_COSTO_URL = (
-    "https://my336154.sapbydesign.com/sap/byd/odata/"
-    "cc_home_analytics.svc/"
-    "RPZ2A3214DFBC04E0DEE943B3QueryResults"
+ENTIDAD_COSTO = "RPZ2A3214DFBC04E0DEE943B3QueryResults"
+CONSULTA_COSTO = (
     "?$select=CMATERIAL,TMATERIAL,CPERMEST,TPERMEST,CSETOFBKS,FCVALPCOMP"
     "&$filter=CPERMEST eq '250' and CSETOFBKS eq 'ZC01'"
     "&$top=18000"
 )
 
+# CPERMEST es un código numérico ('250') que se cargaba como bigint cuando los
+# tipos se inferían del texto; ahora llega como Edm.String y se fija el tipo de
+# antes para no romper la tabla ni los reportes que lo comparan como número
+DTYPE_COSTO = {"CPERMEST": BigInteger}
+
 def extraer_costo_producto() -> pd.DataFrame:
     print("Extrayendo OData de costo_producto...")
-    resp = requests.get(ODATA_COSTO_URL, auth=(BJD_USER, BJD_PASS), timeout=300)
-    resp.raise_for_status()
-
-    df = pd.read_xml(
-        resp.content,
-        xpath=".//atom:entry/atom:content/m:properties",
-        namespaces=ns
-    )
+    df = leer_pagina_df(get_config().url(ENTIDAD_COSTO) + CONSULTA_COSTO)
 
     # Reordenar / seleccionar columnas como en M
     cols = ["CMATERIAL", "TMATERIAL", "CPERMEST", "TPERMEST", "FCVALPCOMP"]
-    df = df[cols]
+    with etapa("transformacion"):
+        df = df[cols]
 
     rename_map = {
         "CMATERIAL": "Material"
@@ -439,15 +3044,7 @@ def extraer_costo_producto() -> pd.DataFrame:
 
 def cargar_costo_producto(df: pd.DataFrame) -> None:
     engine = get_engine()
-    with engine.begin() as conn:
-        df.to_sql(
-            name="sap_byd_costo_producto",
-            con=conn,
-            if_exists="replace",   # siempre reemplaza
-            index=False,
-            method="multi",
-            chunksize=1000
-        )
+    cargar_reemplazo(engine, df, "sap_byd_costo_producto", dtype=DTYPE_COSTO)  # siempre reemplaza
     engine.dispose()
     print(f"✅ Costo producto cargado en sap_byd_costo_producto ({len(df)} filas)")
 
@@ -456,62 +3053,40 @@ def cargar_costo_producto(df: pd.DataFrame) -> None:
 
 # ========= ODATA 3PL Y ENTREGA DE MERCANCÍA =========
 
-print(f"📅 Ventana 3PL: Desde {fecha_inicio_3pl}")
-print(f"📅 Ventana Entrega: Desde {fecha_inicio_entrega}")
-
-URL_BASE_3PL = (
-    "https://my336154.sapbydesign.com/sap/byd/odata/"
-    "cc_home_analytics.svc/"
-    "RPZ8FD31E1E09C6489CFC1FE8QueryResults"
-)
+ENTIDAD_3PL = "RPZ8FD31E1E09C6489CFC1FE8QueryResults"
 SELECT_3PL = "CRELEASE_STATUS,TRELEASE_STATUS,CBUSINEERENCEF1ACB9534604A4D9,CRELEASERENCE79EA4F7FDF174CDF,CSTATUSERENCE8E2BEDA58262A7C0,TSTATUSERENCE8E2BEDA58262A7C0,CIDCONTERENCEFD3F50267033877F,CPRODUCERENCE961D56D7A61936A0,KCREQUESERENCEE7C71585BF4BFCEE,CBUSINEERENCEBC7B6311A522DAAC"
-# Usamos fecha_inicio_3pl
-FILTER_3PL = f"(CBUSINEERENCEBC7B6311A522DAAC eq '114') and (CRELEASERENCE79EA4F7FDF174CDF ge datetime'{fecha_inicio_3pl}')"
-
-
-URL_BASE_ENTREGA = (
-    "https://my336154.sapbydesign.com/sap/byd/odata/"
-    "cc_home_analytics.svc/"
-    "RPZ4E72B90D164D5C8BA4A7E9QueryResults"
-)
-SELECT_ENTREGA = "CID_TRANSPORTADORA_01,CID_UBICACION_01,CID_VERIFICACION_01,CID_VEHICULO_01,CID_FECHAPRIMERACITA,CID_CAJAS_01,CID_CITAS_ADICIONAL_01,CID_CITAS_01,CID_CONDUCTOR_01,CID_CSAP_01,CID_CUMPLIMIENTO_01,CID_DIAS_ENTREGA_01,CID_DIAS_SBD_01,CID_ENTREGA_01,CID_ESTADO_01,CID_FE_01,CID_FECHA_ENTREGA_01,CID_FECHATRANSDESTINO,CID_FGUIA_01,CID_GUIA_01,CID_HORA_ENTREGA_01,CID_HUACALES_01,CID_INDICADOR_01,CID_MENTREGA_01,CID_MOTIVOATRASO,CID_NOMBRE_ENTREGA_01,CID_NOMBRE_RECIBE_01,CID_NOVEDAD_01,CIBR_SLO_UUID,CID_PLACAS_01,CID_PROM_SERVICIO_01,CID_RCSAP_01,CDOC_INV_DATE"
-# Usamos fecha_inicio_entrega
-FILTER_ENTREGA = f"(CDOC_INV_DATE ge datetime'{fecha_inicio_entrega}')"
 
+def filtro_3pl(desde: str | None = None) -> str:
+    # Usamos fecha_inicio_3pl (o el watermark, ver WATERMARK)
+    desde = desde or get_config().fecha_inicio_3pl
+    return f"(CBUSINEERENCEBC7B6311A522DAAC eq '114') and (CRELEASERENCE79EA4F7FDF174CDF ge datetime'{desde}')"
 
-def extraer_odata_paginado(nombre_proceso: str, url_base: str, select: str, filter_str: str, batch_size: int = 5000) -> pd.DataFrame:
-    print(f"\nExtrayendo OData paginado: {nombre_proceso}...")
-    all_batches = []
-    skip = 0
+# Igual que CPERMEST en costo: el código del filtro ('114') se cargaba como bigint
+DTYPE_3PL = {"CBUSINEERENCEBC7B6311A522DAAC": BigInteger}
 
-    while True:
-        url = f"{url_base}?$select={select}&$filter={filter_str}&$top={batch_size}&$skip={skip}"
-        print(f"  -> Obteniendo batch (skip={skip})...")
-        
-        resp = requests.get(url, auth=(BJD_USER, BJD_PASS), timeout=300)
-        resp.raise_for_status()
 
-        try:
-            df_batch = pd.read_xml(
-                resp.content,
-                xpath=".//atom:entry/atom:content/m:properties",
-                namespaces=ns
-            )
-        except ValueError:
-            print("  Sin más datos (fin de la lectura XML).")
-            break
+ENTIDAD_ENTREGA = "RPZ4E72B90D164D5C8BA4A7E9QueryResults"
+SELECT_ENTREGA = "CID_TRANSPORTADORA_01,CID_UBICACION_01,CID_VERIFICACION_01,CID_VEHICULO_01,CID_FECHAPRIMERACITA,CID_CAJAS_01,CID_CITAS_ADICIONAL_01,CID_CITAS_01,CID_CONDUCTOR_01,CID_CSAP_01,CID_CUMPLIMIENTO_01,CID_DIAS_ENTREGA_01,CID_DIAS_SBD_01,CID_ENTREGA_01,CID_ESTADO_01,CID_FE_01,CID_FECHA_ENTREGA_01,CID_FECHATRANSDESTINO,CID_FGUIA_01,CID_GUIA_01,CID_HORA_ENTREGA_01,CID_HUACALES_01,CID_INDICADOR_01,CID_MENTREGA_01,CID_MOTIVOATRASO,CID_NOMBRE_ENTREGA_01,CID_NOMBRE_RECIBE_01,CID_NOVEDAD_01,CIBR_SLO_UUID,CID_PLACAS_01,CID_PROM_SERVICIO_01,CID_RCSAP_01,CDOC_INV_DATE"
 
-        if df_batch.empty:
-            break
+def filtro_entrega() -> str:
+    # Usamos fecha_inicio_entrega
+    return f"(CDOC_INV_DATE ge datetime'{get_config().fecha_inicio_entrega}')"
 
-        all_batches.append(df_batch)
-        print(f"     {len(df_batch)} filas en este batch.")
 
-        if len(df_batch) < batch_size:
-            break
-            
-        skip += batch_size
+def extraer_odata_paginado(nombre_proceso: str, url_base: str, select: str, filter_str: str, batch_size: int = 5000,
+                           al_recibir=None) -> pd.DataFrame:
+    """Extracto paginado completo; con `al_recibir` las páginas se le entregan y se retorna vacío."""
+    print(f"\nExtrayendo OData paginado: {nombre_proceso}...")
+    all_batches = paginar(
+        nombre_proceso,
+        lambda skip, top: f"{url_base}?$select={select}&$filter={filter_str}&$top={top}&$skip={skip}",
+        iterar_pagina,
+        batch_size,
+        al_recibir=al_recibir,
+    )
 
+    if al_recibir is not None:
+        return pd.DataFrame()
     if all_batches:
         df_final = pd.concat(all_batches, ignore_index=True)
         print(f"✅ Total extraído para {nombre_proceso}: {len(df_final)} filas")
@@ -520,148 +3095,695 @@ def extraer_odata_paginado(nombre_proceso: str, url_base: str, select: str, filt
         print(f"⚠️ No se encontraron datos para {nombre_proceso}.")
         return pd.DataFrame()
 
-def cargar_replace(df: pd.DataFrame, nombre_tabla: str) -> None:
+# ========= WATERMARK (DELTA 3PL) =========
+# 3PL ya no baja su ventana completa (6 meses) en cada corrida: la tabla
+# etl_watermark guarda por flujo la fecha de liberación máxima cargada y se piden
+# solo los registros desde ese watermark menos WATERMARK_SOLAPE_DIAS. El delta se
+# integra por clave de negocio (upsert) y se podan las filas que salieron de la
+# ventana. Una extracción delta no ve lo que se borró en SAP, así que cada
+# WATERMARK_COMPLETO_DIAS (o sin watermark, con --since o si la tabla no tiene el
+# índice único) se baja la ventana completa y se eliminan las claves que ya no
+# vinieron. Se activa con WATERMARK_DELTA=true; apagado (por defecto) es el
+# reemplazo completo en cada corrida, hasta confirmar la clave con datos reales.
+# Entrega de mercancía sigue con su ventana completa: el reporte no expone una
+# fecha de cambio (CDOC_INV_DATE es la de factura y los estados de la entrega
+# cambian después) ni una clave que no pueda venir vacía.
+TABLA_WATERMARK = "etl_watermark"
+
+# Clave de negocio por flujo: documento de referencia + contenedor + producto en
+# 3PL (CLAVES_3PL la reemplaza; ver Config.claves_delta). Si en el extracto viene
+# vacía o repetida, la corrida baja la ventana completa y la reemplaza (ver
+# upsert_por_clave)
+DELTAS = {
+    "3pl": {
+        "tabla": "sap_byd_3pl",
+        "columna": "CRELEASERENCE79EA4F7FDF174CDF",
+        "claves": "CBUSINEERENCEF1ACB9534604A4D9,CIDCONTERENCEFD3F50267033877F,CPRODUCERENCE961D56D7A61936A0",
+        "dtype": DTYPE_3PL,
+    },
+}
+
+_lock_watermark = threading.Lock()
+
+def _crear_watermark(engine) -> None:
+    # En su propia transacción y con lock: los flujos corren en paralelo y dos
+    # CREATE TABLE IF NOT EXISTS simultáneos chocan en el catálogo
+    with _lock_watermark, engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {TABLA_WATERMARK} (
+                flujo           TEXT PRIMARY KEY,
+                columna         TEXT NOT NULL,
+                valor           TIMESTAMP NOT NULL,
+                ultimo_completo TIMESTAMPTZ,
+                filas           BIGINT,
+                actualizado     TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """))
+
+def leer_watermark(conn, flujo: str) -> tuple[datetime | None, datetime | None]:
+    """(watermark, inicio de la última extracción completa) del flujo."""
+    fila = conn.execute(text(
+        f"SELECT valor, ultimo_completo FROM {TABLA_WATERMARK} WHERE flujo = :f"
+    ), {"f": flujo}).fetchone()
+    return (fila[0], fila[1]) if fila else (None, None)
+
+def guardar_watermark(conn, flujo: str, columna: str, valor: datetime, completo: bool, filas: int) -> None:
+    """Una extracción completa fija el watermark; un delta solo lo adelanta."""
+    conn.execute(text(f"""
+        INSERT INTO {TABLA_WATERMARK} AS w (flujo, columna, valor, ultimo_completo, filas)
+        VALUES (:f, :c, :v, CASE WHEN :completo THEN now() END, :filas)
+        ON CONFLICT (flujo) DO UPDATE SET
+            columna = EXCLUDED.columna,
+            valor = CASE WHEN :completo THEN EXCLUDED.valor ELSE GREATEST(w.valor, EXCLUDED.valor) END,
+            ultimo_completo = COALESCE(EXCLUDED.ultimo_completo, w.ultimo_completo),
+            filas = EXCLUDED.filas,
+            actualizado = now()
+    """), {"f": flujo, "c": columna, "v": valor, "completo": completo, "filas": filas})
+
+def _motivo_completo(conn, flujo: str, spec: dict, select: str) -> tuple[str, datetime | None]:
+    """Por qué hace falta la ventana completa ("" = alcanza con el delta) y el watermark."""
+    cfg = get_config()
+    marca, ultimo_completo = leer_watermark(conn, flujo)
+    if cfg.desde is not None:
+        return "--since", marca
+    if marca is None:
+        return "sin watermark", marca
+    tabla = spec["tabla"]
+    claves = cfg.claves_delta[flujo]
+    if not _tabla_existe(conn, tabla) or not _tiene_indice_unico(conn, tabla, claves):
+        return f"{tabla} sin índice único por {claves}", marca
+    faltantes = set(select.split(",")) - set(_columnas_tabla(conn, tabla))
+    if faltantes:
+        return f"columnas nuevas {sorted(faltantes)}", marca
+    if ultimo_completo is None or datetime.now().astimezone() - ultimo_completo > timedelta(days=cfg.watermark_completo_dias):
+        return f"última extracción completa hace más de {cfg.watermark_completo_dias:g} días", marca
+    return "", marca
+
+def cargar_delta(flujo: str, nombre_proceso: str, url_base: str, select: str, filtro, inicio_ventana: str) -> int:
+    """
+    Extrae desde el watermark (o la ventana completa) con `filtro(desde)`, integra
+    por clave y poda lo anterior a `inicio_ventana`. Retorna las filas extraídas.
+    """
+    cfg = get_config()
+    spec = DELTAS[flujo]
+    tabla, columna = spec["tabla"], spec["columna"]
     engine = get_engine()
+    _crear_watermark(engine)
     with engine.begin() as conn:
-        df.to_sql(
-            name=nombre_tabla,
-            con=conn,
-            if_exists="replace",
-            index=False,
-            method="multi",
-            chunksize=1000
-        )
+        motivo, marca = _motivo_completo(conn, flujo, spec, select)
+    completo = bool(motivo)
+    inicio = datetime.fromisoformat(inicio_ventana)
+    if completo:
+        desde = inicio
+        print(f"   {tabla}: ventana completa desde {inicio:%Y-%m-%d} ({motivo})")
+    else:
+        desde = max(marca - timedelta(days=cfg.watermark_solape_dias), inicio)
+        print(f"   Δ {tabla}: desde {desde:%Y-%m-%d %H:%M} (watermark {marca:%Y-%m-%d %H:%M} − {cfg.watermark_solape_dias:g} días)")
+
+    def extraer(desde: datetime) -> pd.DataFrame:
+        with etapa("extraccion"):
+            return extraer_odata_paginado(nombre_proceso, url_base, select, filtro(desde.strftime("%Y-%m-%dT%H:%M:%S")))
+
+    df = extraer(desde)
+    if not completo and not df.empty and claves_invalidas(df, cfg.claves_delta[flujo]).any():
+        # El reemplazo de upsert_por_clave con solo el delta perdería el resto de la ventana
+        print(f"   {tabla}: el delta trae claves vacías o repetidas; se baja la ventana completa")
+        completo, desde = True, inicio
+        df = extraer(desde)
+
+    with etapa("carga"):
+        stats = {"insertadas": 0, "actualizadas": 0, "eliminadas": 0, "sin_cambios": 0}
+        if not df.empty:
+            # Completa: las claves que no vinieron se borran (mismo resultado que el reemplazo)
+            stats = upsert_por_clave(
+                engine, df, tabla, cfg.claves_delta[flujo], dtype=spec["dtype"],
+                ventana_sql="TRUE" if completo else None,
+            )
+        podadas = 0
+        with engine.begin() as conn:
+            if _tabla_existe(conn, tabla):
+                podadas = conn.execute(text(
+                    f"DELETE FROM {_nombre_calificado(tabla)} WHERE {_nombre_calificado(columna)} < :inicio"
+                ), {"inicio": inicio_ventana}).rowcount
+            nueva = pd.to_datetime(df[columna], errors="coerce").max() if columna in df.columns else pd.NaT
+            if not pd.isna(nueva):
+                guardar_watermark(conn, flujo, columna, nueva.to_pydatetime(), completo, len(df))
+        if not df.empty or podadas:
+            asegurar_indices(engine, tabla)
+        if cfg.parquet_dir:
+            # El corte del día es la tabla completa, no solo el delta
+            with engine.connect() as conn:
+                escribir_parquet(tabla, pd.read_sql_query(text(f"SELECT * FROM {_nombre_calificado(tabla)}"), conn))
     engine.dispose()
-    print(f"✅ {nombre_tabla} cargada ({len(df)} filas, replace completo)")
+
+    print(
+        f"   {tabla}: {stats['insertadas']} insertadas, {stats['actualizadas']} actualizadas, "
+        f"{stats['eliminadas'] + podadas} eliminadas ({podadas} fuera de la ventana), {stats['sin_cambios']} sin cambios"
+    )
+    return len(df)
 
 # ========= ODATA INVENTARIO DISPONIBLE =========
 
-ODATA_INVENTARIO_URL = (
-    "https://my336154.sapbydesign.com/sap/byd/odata/"
-    "cc_home_analytics.svc/"
-    "RPZ090ACC34E23590E4C2D25DQueryResults"
+ENTIDAD_INVENTARIO = "RPZ090ACC34E23590E4C2D25DQueryResults"
+CONSULTA_INVENTARIO = (
     "?$select=CPRODUCT_ID,KCZDF91AEE1AD2B1DE80EEC9B"
     "&$filter=PAR_SEL_SPA_ID eq '250' and PAR_SEL_CATEGORY eq '14' and KCZDF91AEE1AD2B1DE80EEC9B ne 0"
     "&$top=50000"
 )
 
+CAMPOS_INVENTARIO = {
+    "CPRODUCT_ID":               ("Product",               ""),
+    "KCZDF91AEE1AD2B1DE80EEC9B": ("Inventario_Disponible", "0"),
+}
 
-def extraer_inventario_disponible() -> pd.DataFrame:
+def extraer_inventario_disponible(al_recibir=None) -> pd.DataFrame:
+    """Inventario con stock; con `al_recibir` cada chunk filtrado se le entrega y se retorna vacío."""
     print("Extrayendo OData de inventario disponible...")
     all_batches = []
+    entregar = all_batches.append if al_recibir is None else al_recibir
     skip = 0
     batch_size = 50000
 
     while True:
-        url = ODATA_INVENTARIO_URL + "&$skip={}".format(skip)
+        url = get_config().url(ENTIDAD_INVENTARIO) + CONSULTA_INVENTARIO + "&$skip={}".format(skip)
         print("  -> Batch (skip={})...".format(skip))
 
-        resp = requests.get(url, auth=(BJD_USER, BJD_PASS), timeout=300)
-        resp.raise_for_status()
-
-        root = etree.fromstring(resp.content)
-        entries = root.findall("atom:entry", ns)
+        leidas = 0
+        for chunk in iterar_pagina(url, CAMPOS_INVENTARIO):
+            leidas += len(chunk)
+            # Convertir a numérico y filtro defensivo por si SAP igual devuelve algún 0
+            chunk["Inventario_Disponible"] = pd.to_numeric(chunk["Inventario_Disponible"], errors="coerce").fillna(0)
+            entregar(chunk[chunk["Inventario_Disponible"] != 0])
 
-        if not entries:
+        if not leidas:
             print("  Sin más datos.")
             break
 
-        rows = []
-        for entry in entries:
-            props = entry.find("atom:content/m:properties", ns)
-            if props is None:
-                continue
-            rows.append({
-                "Product":              props.findtext("d:CPRODUCT_ID",                   default="", namespaces=ns),
-                "Inventario_Disponible": props.findtext("d:KCZDF91AEE1AD2B1DE80EEC9B",   default="0", namespaces=ns),
-            })
-
-        df_batch = pd.DataFrame(rows)
-        print("     {} filas.".format(len(df_batch)))
-        all_batches.append(df_batch)
+        print("     {} filas.".format(leidas))
 
-        if len(entries) < batch_size:
+        if leidas < batch_size:
             break
 
         skip += batch_size
 
+    if al_recibir is not None:
+        return pd.DataFrame()
     if not all_batches:
         print("Sin datos de inventario.")
         return pd.DataFrame()
 
     df = pd.concat(all_batches, ignore_index=True)
 
-    # Convertir a numérico y filtro defensivo por si SAP igual devuelve algún 0
-    df["Inventario_Disponible"] = pd.to_numeric(df["Inventario_Disponible"], errors="coerce").fillna(0)
-    df = df[df["Inventario_Disponible"] != 0].reset_index(drop=True)
-
     print("Total inventario disponible: {} productos".format(len(df)))
     return df
 
 
-def cargar_inventario_disponible(df: pd.DataFrame) -> None:
-    engine = get_engine()
+DTYPE_INVENTARIO = {
+    "Product":               String(40),
+    "Inventario_Disponible": Float,
+}
 
-    dtype_map = {
-        "Product":               String(40),
-        "Inventario_Disponible": Float,
-    }
+# ========= TABLAS RESUMEN =========
+# Agregados que leen los dashboards en vez de recorrer toda la tabla de hechos.
+# Se mantienen como etapa posterior a la carga y solo se recalculan los periodos
+# que se recargaron en la corrida: DELETE + INSERT ... SELECT ... GROUP BY de esos
+# periodos en una transacción. Si la tabla resumen no existe, se arma completa.
+RESUMEN_VENTAS = "sap_byd_ventas_resumen_mensual"
+RESUMEN_ORDENES = "sap_byd_ordenes_abiertas_marca"
 
+def _refrescar_resumen(engine, tabla: str, select_sql: str, filtro_origen: str, filtro_resumen: str,
+                       params: dict) -> int:
+    """
+    Recalcula en `tabla` las filas que cubre `filtro_resumen` con el agregado
+    `select_sql` (que recibe `filtro_origen` en su WHERE). Retorna filas escritas.
+    """
+    resumen = _nombre_calificado(tabla)
     with engine.begin() as conn:
-        df.to_sql(
-            name="sap_byd_inventario_disponible",
-            con=conn,
-            if_exists="replace",   # replace completo cada vez
-            index=False,
-            dtype=dtype_map,
-            method="multi",
-            chunksize=1000
-        )
-    engine.dispose()
-    print("Inventario cargado en sap_byd_inventario_disponible ({} filas)".format(len(df)))
+        if not _tabla_existe(conn, tabla):
+            print(f"🆕 Se crea {tabla} con toda la historia")
+            conn.execute(text(f"CREATE TABLE {resumen} AS {select_sql.replace('{filtro}', 'TRUE')}"))
+            escritas = conn.execute(text(f"SELECT count(*) FROM {resumen}")).scalar()
+        else:
+            borradas = conn.execute(text(f"DELETE FROM {resumen} WHERE {filtro_resumen}"), params).rowcount
+            escritas = conn.execute(
+                text(f"INSERT INTO {resumen} {select_sql.replace('{filtro}', filtro_origen)}"), params
+            ).rowcount
+            print(f"   📊 {tabla}: {borradas} filas recalculadas → {escritas}")
+    asegurar_indices(engine, tabla)
+    return escritas
+
+def actualizar_resumen_ventas(engine) -> int:
+    """Ventas/costo/cantidad por periodo fiscal, SBU, cliente y producto."""
+    cfg = get_config()
+    periodo = sql_periodo_mm_yyyy("FiscalMonthYear")
+    select_sql = (
+        f'SELECT {periodo} AS "FiscalMonthYear", "E03_SBU_Name", "Customer", "Product", '
+        f'sum("VENTAS_US") AS "VENTAS_US", sum("COSTO_US") AS "COSTO_US", '
+        f'sum("Cantidad_FacUS") AS "Cantidad_FacUS", count(*) AS "Lineas", now() AS actualizado '
+        f'FROM {_nombre_calificado(TABLA_VENTAS)} WHERE {{filtro}} GROUP BY 1, 2, 3, 4'
+    )
+    if not cfg.periodos:
+        # Sin periodos definidos la carga fue un append: se recalcula todo
+        return _refrescar_resumen(engine, RESUMEN_VENTAS, select_sql, "TRUE", "TRUE", {})
+
+    # En la tabla de hechos pueden estar los dos formatos (sin particionar); el resumen va en MM.YYYY
+    periodos_origen = list(dict.fromkeys(cfg.periodos + cfg.periodos_alt))
+    periodos_resumen = sorted(set(normalizar_periodos(pd.Series(periodos_origen, dtype=object))))
+    params = {f"p{i}": p for i, p in enumerate(periodos_origen)}
+    params.update({f"r{i}": p for i, p in enumerate(periodos_resumen)})
+    return _refrescar_resumen(
+        engine, RESUMEN_VENTAS, select_sql,
+        '"FiscalMonthYear" IN ({})'.format(", ".join(f":p{i}" for i in range(len(periodos_origen)))),
+        '"FiscalMonthYear" IN ({})'.format(", ".join(f":r{i}" for i in range(len(periodos_resumen)))),
+        params,
+    )
 
-# ========= MAIN =========
-if __name__ == "__main__":
-    # 1) Ventas (como estaba)
-    df_ventas = extraer_ventas()
-    if not df_ventas.empty:
-        cargar_a_postgres(df_ventas)
-    else:
-        print("⚠️ No se encontraron datos de ventas para cargar.")
+def actualizar_resumen_ordenes(engine) -> int:
+    """Valor de órdenes abiertas, backorder y solicitado por periodo fiscal y marca."""
+    select_sql = (
+        f'SELECT {sql_periodo_mm_yyyy("FiscalMonthYear")} AS "FiscalMonthYear", "Brand", '
+        f'sum("Valor OrdAbiertas (Con Inv)") AS "Valor OrdAbiertas (Con Inv)", '
+        f'sum("Valor BO") AS "Valor BO", sum("Valor Solicitado") AS "Valor Solicitado", '
+        f'count(DISTINCT "Sales Order") AS "Ordenes", count(*) AS "Lineas", now() AS actualizado '
+        f'FROM {_nombre_calificado("sap_byd_ordenes")} WHERE {{filtro}} GROUP BY 1, 2'
+    )
+    if get_config().ordenes_modo_carga == "replace":
+        return _refrescar_resumen(engine, RESUMEN_ORDENES, select_sql, "TRUE", "TRUE", {})
+    # Mismo rango que refresca el upsert (periodo fiscal >= fecha_fiscal_ordenes)
+    filtro = f"{sql_periodo_normalizado('FiscalMonthYear')} >= :desde"
+    return _refrescar_resumen(
+        engine, RESUMEN_ORDENES, select_sql, filtro, filtro, {"desde": get_config().fecha_fiscal_ordenes}
+    )
 
-    # 2) Órdenes
-    df_ordenes = extraer_ordenes()
-    if not df_ordenes.empty:
-        cargar_ordenes(df_ordenes)
-    else:
+def actualizar_resumen(fn) -> None:
+    """Etapa posterior a la carga de un flujo (se omite con TABLAS_RESUMEN=false)."""
+    if not get_config().tablas_resumen:
+        return
+    engine = get_engine()
+    try:
+        with etapa("resumen"):
+            fn(engine)
+    finally:
+        engine.dispose()
+
+# ========= FLUJOS =========
+# Cada flujo extrae y carga de forma independiente; retorna las filas cargadas.
+# Los flujos paginados cargan en streaming (ver PIPELINE EXTRACCIÓN → CARGA);
+# órdenes y costo son una sola página y siguen extrayendo y luego cargando, igual
+# que 3PL en modo delta (ver WATERMARK).
+def flujo_ventas() -> int:
+    if get_config().ventas_particionada:
+        filas = ejecutar_pipeline("ventas", DestinoVentasParticionada(DTYPE_VENTAS), producir_ventas)
+        if not filas:
+            print("⚠️ No se encontraron datos de ventas para cargar.")
+            return 0
+        print(f"✅ Cargados {filas} registros de ventas")
+        actualizar_resumen(actualizar_resumen_ventas)
+        return filas
+
+    with etapa("extraccion"):
+        df_ventas = extraer_ventas()
+    if df_ventas.empty:
+        print("⚠️ No se encontraron datos de ventas para cargar.")
+        return 0
+    with etapa("carga"):
+        cargar_a_postgres(df_ventas)
+        escribir_parquet(TABLA_VENTAS, preparar_carga_ventas(df_ventas))
+    actualizar_resumen(actualizar_resumen_ventas)
+    return len(df_ventas)
+
+def flujo_ordenes() -> int:
+    with etapa("extraccion"):
+        df_ordenes = extraer_ordenes()
+    if df_ordenes.empty:
         print("⚠️ OData de órdenes sin datos.")
-
-    # 3) Costo producto
-    df_costo = extraer_costo_producto()
-    if not df_costo.empty:
-        cargar_costo_producto(df_costo)
-    else:
+        return 0
+    with etapa("carga"):
+        cargar_ordenes(df_ordenes)
+        escribir_parquet("sap_byd_ordenes", df_ordenes)
+    actualizar_resumen(actualizar_resumen_ordenes)
+    return len(df_ordenes)
+
+def flujo_costo_producto() -> int:
+    with etapa("extraccion"):
+        df_costo = extraer_costo_producto()
+    if df_costo.empty:
         print("⚠️ OData de costo producto sin datos.")
-
-    # ================= NUEVO: 3PL y Entrega de Mercancía =================
-    
-    # 4) 3PL (últimos 6 meses, replace completo)
-    df_3pl = extraer_odata_paginado("3PL", URL_BASE_3PL, SELECT_3PL, FILTER_3PL)
-    if not df_3pl.empty:
-        cargar_replace(df_3pl, "sap_byd_3pl")
-    else:
+        return 0
+    with etapa("carga"):
+        cargar_costo_producto(df_costo)
+        escribir_parquet("sap_byd_costo_producto", df_costo)
+    return len(df_costo)
+
+def flujo_3pl() -> int:
+    # 3PL (últimos 6 meses): delta desde el watermark o replace completo
+    cfg = get_config()
+    if cfg.watermark_delta:
+        filas = cargar_delta(
+            "3pl", "3PL", cfg.url(ENTIDAD_3PL), SELECT_3PL, filtro_3pl, cfg.fecha_inicio_3pl
+        )
+        print(f"✅ sap_byd_3pl al día ({filas} filas extraídas)")
+        return filas
+    # El índice único que dejó un delta anterior no aplica: el reemplazo admite claves repetidas
+    destino = DestinoReemplazo("sap_byd_3pl", dtype=DTYPE_3PL, sin_indices={_nombre_indice_unico("sap_byd_3pl")})
+    filas = ejecutar_pipeline(
+        "3pl", destino,
+        lambda emitir: extraer_odata_paginado("3PL", cfg.url(ENTIDAD_3PL), SELECT_3PL, filtro_3pl(), al_recibir=emitir),
+    )
+    if not filas:
         print("⚠️ OData de 3PL sin datos.")
-
-    # 5) Entrega de Mercancía (últimos 2 meses, replace completo)
-    df_entrega = extraer_odata_paginado("Entrega de Mercancía", URL_BASE_ENTREGA, SELECT_ENTREGA, FILTER_ENTREGA)
-    if not df_entrega.empty:
-        cargar_replace(df_entrega, "sap_byd_entrega_mercancia")
-    else:
+        return 0
+    print(f"✅ sap_byd_3pl cargada ({filas} filas)")
+    return filas
+
+def flujo_entrega() -> int:
+    # Entrega de Mercancía (últimos 2 meses, replace completo; sin delta, ver WATERMARK)
+    filas = ejecutar_pipeline(
+        "entrega", DestinoReemplazo("sap_byd_entrega_mercancia"),
+        lambda emitir: extraer_odata_paginado(
+            "Entrega de Mercancía", get_config().url(ENTIDAD_ENTREGA), SELECT_ENTREGA, filtro_entrega(), al_recibir=emitir
+        ),
+    )
+    if not filas:
         print("⚠️ OData de Entrega de Mercancía sin datos.")
+        return 0
+    print(f"✅ sap_byd_entrega_mercancia cargada ({filas} filas)")
+    return filas
+
+def flujo_inventario() -> int:
+    filas = ejecutar_pipeline(
+        "inventario", DestinoReemplazo("sap_byd_inventario_disponible", dtype=DTYPE_INVENTARIO),
+        lambda emitir: extraer_inventario_disponible(al_recibir=emitir),
+    )
+    if not filas:
+        print("Sin datos de inventario disponible.")
+        return 0
+    print("Inventario cargado en sap_byd_inventario_disponible ({} filas)".format(filas))
+    return filas
+
+FLUJOS = {
+    "ventas":     flujo_ventas,
+    "ordenes":    flujo_ordenes,
+    "costo":      flujo_costo_producto,
+    "3pl":        flujo_3pl,
+    "entrega":    flujo_entrega,
+    "inventario": flujo_inventario,
+}
 
-    # 6) Inventario Disponible
-    df_inventario = extraer_inventario_disponible()
-    if not df_inventario.empty:
-        cargar_inventario_disponible(df_inventario)
+def _ejecutar_flujo(nombre: str, fn, motivo_omitir: str = "") -> dict:
+    flujo_actual.set(nombre)
+    metricas = MetricasFlujo()
+    metricas_actuales.set(metricas)
+    inicio_ts = datetime.now().astimezone()
+    inicio = time.perf_counter()
+    if not motivo_omitir and REANUDAR and get_checkpoints().hecho("flujo"):
+        motivo_omitir = f"ya cargado en la corrida {get_config().run_id}"
+    if motivo_omitir:
+        print(f"⏭️ {nombre}: {motivo_omitir}")
+        filas, estado, error = 0, "omitido", ""
     else:
-        print("Sin datos de inventario disponible.")
\ No newline at end of file
+        try:
+            filas = fn()
+            estado, error = "ok", ""
+            get_checkpoints().marcar("flujo", filas=filas)
+        except Exception as exc:  # un flujo fallido no aborta los demás
+            traceback.print_exc()
+            filas, estado, error = 0, "error", f"{type(exc).__name__}: {exc}"
+    segundos = time.perf_counter() - inicio
+    resultado = {
+        "flujo": nombre,
+        "estado": estado,
+        "inicio": inicio_ts,
+        "filas": filas,
+        "segundos": segundos,
+        "filas_seg": filas / segundos if segundos else 0.0,
+        "rss_pico_proceso_mb": rss_pico_proceso_mb(),
+        "error": error,
+        "metricas": metricas.como_dict(),
+    }
+    log_json("flujo", estado=estado, filas=filas, segundos=round(segundos, 3),
+             filas_seg=round(resultado["filas_seg"], 1), rss_pico_proceso_mb=resultado["rss_pico_proceso_mb"],
+             **{k: round(v, 3) if isinstance(v, float) else v for k, v in resultado["metricas"].items()})
+    return resultado
+
+def ejecutar_flujos(flujos: dict, max_concurrencia: int | None = None,
+                    omitir: dict[str, str] | None = None) -> list[dict]:
+    """
+    Ejecuta los flujos en un pool de hilos acotado (cada flujo pasa casi todo
+    el tiempo esperando a SAP). Los errores se aíslan por flujo y al final se
+    imprime un resumen. Retorna los resultados en el orden de `flujos`.
+    `omitir` = {flujo: motivo} para los que no se ejecutan (p. ej. aún vigentes).
+    """
+    omitir = omitir or {}
+    max_concurrencia = max(1, max_concurrencia or get_config().etl_max_concurrencia)
+    print(f"🚀 Ejecutando {len(flujos) - len(omitir)} flujos (concurrencia máx. {max_concurrencia})")
+
+    with ThreadPoolExecutor(max_workers=max_concurrencia, thread_name_prefix="flujo") as pool:
+        futuros = [pool.submit(_ejecutar_flujo, nombre, fn, omitir.get(nombre, "")) for nombre, fn in flujos.items()]
+        resultados = [f.result() for f in futuros]
+
+    print("\n========= RESUMEN =========")
+    for r in resultados:
+        icono = {"ok": "✅", "omitido": "⏭️"}.get(r["estado"], "❌")
+        linea = f"{icono} {r['flujo']:<12} {r['filas']:>9} filas  {r['segundos']:>8.1f} s"
+        if r["error"]:
+            linea += f"  {r['error']}"
+        print(linea)
+
+    guardar_run_log(resultados)
+    return resultados
+
+# ========= FRESCURA POR FLUJO =========
+# Minutos durante los que la última carga exitosa de un flujo (según etl_run_log)
+# se considera vigente: dentro de ese intervalo el flujo se omite. 0 = se carga
+# en cada corrida. Con las corridas de 2 AM, 1 PM y 5 PM, costo se carga una vez
+# al día e inventario dos. FRESCURA_MIN_<FLUJO> para cambiarlos; --force los ignora.
+_FRESCURA_MIN = {
+    "ventas": 0,
+    "ordenes": 0,
+    "costo": 20 * 60,
+    "3pl": 0,
+    "entrega": 0,
+    "inventario": 8 * 60,
+}
+
+def _frescura_seg(flujo: str) -> float:
+    minutos = os.getenv(f"FRESCURA_MIN_{flujo.upper()}")
+    return float(minutos if minutos is not None else _FRESCURA_MIN.get(flujo, 0)) * 60
+
+def ultimas_cargas() -> dict[str, datetime]:
+    """Inicio de la última carga exitosa de cada flujo; {} si etl_run_log no existe o no hay conexión."""
+    try:
+        engine = get_engine()
+        with engine.connect() as conn:
+            if not _tabla_existe(conn, TABLA_RUN_LOG):
+                return {}
+            filas = conn.execute(text(
+                f"SELECT flujo, max(inicio) FROM {TABLA_RUN_LOG} WHERE estado = 'ok' GROUP BY flujo"
+            )).fetchall()
+        engine.dispose()
+    except Exception as exc:
+        print(f"⚠️ No se pudo leer {TABLA_RUN_LOG} ({type(exc).__name__}); se cargan todos los flujos")
+        return {}
+    return dict(filas)
+
+def flujos_vigentes(nombres: list[str]) -> dict[str, str]:
+    """{flujo: motivo} de los flujos cuya última carga sigue dentro de su intervalo de frescura."""
+    ultimas = ultimas_cargas()
+    ahora = datetime.now().astimezone()
+    vigentes = {}
+    for nombre in nombres:
+        frescura = _frescura_seg(nombre)
+        ultima = ultimas.get(nombre)
+        if frescura and ultima is not None and (ahora - ultima).total_seconds() < frescura:
+            vigentes[nombre] = f"vigente (última carga {ultima:%Y-%m-%d %H:%M}, frescura {frescura / 60:.0f} min)"
+    return vigentes
+
+# ========= MULTI-TENANT =========
+# Varias compañías (tenants de ByDesign) con el mismo pipeline. ETL_TENANTS (o
+# --tenants) apunta a un JSON con un objeto por tenant:
+#   {"tenants": [{"nombre": "acme", "host": "my123456.sapbydesign.com",
+#                 "credenciales": {"usuario": "BJD_USER_ACME", "clave": "BJD_PASS_ACME"},
+#                 "schema": "acme", "max_rps": 4,
+#                 "reportes": {"ventas": "RPZ...QueryResults", ...}}]}
+# Las credenciales son nombres de variables de entorno (los secretos no van en el
+# JSON). Los reportes que no se indican usan los ENTIDAD_* de este archivo. Cada
+# tenant corre en su propio proceso, con su limitador (max_rps) y su schema en
+# PostgreSQL; ETL_TENANTS_PROCESOS acota los procesos simultáneos. Ambas se leen
+# al ejecutar `run`, no al importar.
+
+ENTIDADES = {
+    "ventas": ENTIDAD_VENTAS,
+    "ordenes": ENTIDAD_ORDENES,
+    "costo": ENTIDAD_COSTO,
+    "3pl": ENTIDAD_3PL,
+    "entrega": ENTIDAD_ENTREGA,
+    "inventario": ENTIDAD_INVENTARIO,
+}
+
+_RE_SCHEMA = re.compile(r"^[a-z_][a-z0-9_]{0,62}$")
+
+class Tenant:
+    """Un tenant de ByDesign del archivo de ETL_TENANTS."""
+
+    def __init__(self, datos: dict):
+        self.nombre = datos["nombre"]
+        if not _RE_SCHEMA.match(self.nombre):
+            raise ValueError(f"nombre de tenant inválido {self.nombre!r} (minúsculas, dígitos y _)")
+        # base_url reemplaza a host (p. ej. el servidor falso de benchmarks/)
+        self.base_url = datos.get("base_url") or f"https://{datos['host']}/sap/byd/odata/"
+        credenciales = datos.get("credenciales", {})
+        self.usuario_env = credenciales.get("usuario", "BJD_USER")
+        self.clave_env = credenciales.get("clave", "BJD_PASS")
+        self.schema = datos.get("schema", self.nombre)
+        if not _RE_SCHEMA.match(self.schema):
+            raise ValueError(f"schema inválido {self.schema!r} para el tenant {self.nombre}")
+        # None = BYD_MAX_RPS (se resuelve en Config, dentro del proceso del tenant)
+        self.max_rps = float(datos["max_rps"]) if datos.get("max_rps") is not None else None
+        self.reportes = datos.get("reportes", {})
+        desconocidos = set(self.reportes) - set(ENTIDADES)
+        if desconocidos:
+            raise ValueError(f"reportes desconocidos en el tenant {self.nombre}: {', '.join(sorted(desconocidos))}")
+
+def cargar_tenants(ruta: str) -> list[Tenant]:
+    with open(ruta, encoding="utf-8") as f:
+        tenants = [Tenant(t) for t in json.load(f)["tenants"]]
+    nombres = Counter(t.nombre for t in tenants)
+    repetidos = [n for n, c in nombres.items() if c > 1]
+    if repetidos:
+        raise ValueError(f"tenants repetidos en {ruta}: {', '.join(repetidos)}")
+    return tenants
+
+def _proceso_tenant(tenant: Tenant, args, run_id: str) -> int:
+    """Corrida completa de un tenant en un proceso hijo."""
+    # Checkpoints separados por tenant; el subdirectorio Parquet lo arma Config
+    return comando_run(args, tenant, run_id=f"{run_id}-{tenant.nombre}")
+
+def ejecutar_tenants(tenants: list[Tenant], args) -> int:
+    """
+    Reparte los tenants en un pool de procesos (uno por tenant a la vez): cada uno
+    ejecuta sus flujos con su propia concurrencia, sesión HTTP y limitador.
+    """
+    procesos = max(1, min(args.procesos or int(os.getenv("ETL_TENANTS_PROCESOS", "4")), len(tenants)))
+    # Un mismo run id base para todos los hijos (cada uno le agrega su nombre)
+    run_id = _run_id_entorno()
+    print(f"🏢 {len(tenants)} tenants en {procesos} procesos")
+    # spawn: el hijo no hereda hilos ni conexiones abiertas del padre
+    contexto = multiprocessing.get_context("spawn")
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool:
+        futuros = {t.nombre: pool.submit(_proceso_tenant, t, args, run_id) for t in tenants}
+        codigos = {}
+        for nombre, futuro in futuros.items():
+            try:
+                codigos[nombre] = futuro.result()
+            except Exception as exc:
+                print(f"❌ Tenant {nombre}: {type(exc).__name__}: {exc}")
+                codigos[nombre] = 1
+
+    print("\n========= TENANTS =========")
+    for nombre, codigo in codigos.items():
+        print(f"{'✅' if codigo == 0 else '❌'} {nombre}")
+    print(f"⏱️ {time.perf_counter() - inicio:.1f} s")
+    return 1 if any(codigos.values()) else 0
+
+# ========= CLI =========
+def _fecha_arg(valor: str) -> datetime:
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"fecha inválida {valor!r} (formato YYYY-MM-DD)")
+
+def _flujos_arg(valor: str) -> list[str]:
+    nombres = [n.strip().lower() for n in valor.split(",") if n.strip()]
+    desconocidos = [n for n in nombres if n not in FLUJOS]
+    if desconocidos:
+        raise argparse.ArgumentTypeError(f"flujos desconocidos: {', '.join(desconocidos)} (válidos: {', '.join(FLUJOS)})")
+    return nombres
+
+def construir_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="ETL SAP ByDesign → PostgreSQL")
+    sub = parser.add_subparsers(dest="comando", metavar="{run,list}")
+
+    run = sub.add_parser("run", help="ejecutar los flujos (comando por defecto)")
+    run.add_argument("--only", type=_flujos_arg, metavar="FLUJOS",
+                     help=f"solo estos flujos, separados por coma ({', '.join(FLUJOS)})")
+    run.add_argument("--since", type=_fecha_arg, metavar="YYYY-MM-DD",
+                     help="inicio de las ventanas de extracción; en ventas recarga todos los periodos desde ese mes")
+    run.add_argument("--force", action="store_true", help="cargar aunque la última carga siga vigente")
+    run.add_argument("--no-cache", action="store_true", help="no leer ni escribir la caché de páginas OData")
+    run.add_argument(
+        "--resume", nargs="?", const="", metavar="RUN_ID",
+        help="reanudar una corrida: omite flujos ya cargados y lee de caché las páginas completas "
+             "(sin RUN_ID: ETL_RUN_ID/GITHUB_RUN_ID o la última corrida registrada)",
+    )
+    run.add_argument("--concurrencia", type=int, help="flujos simultáneos (por defecto ETL_MAX_CONCURRENCIA)")
+    run.add_argument("--profile", action="store_true",
+                     help="perfilar cada etapa con cProfile y tracemalloc (archivos en PERFIL_DIR; flujos en secuencia)")
+    run.add_argument("--tenants", metavar="ARCHIVO",
+                     help="JSON de tenants: cada uno corre en su propio proceso y schema (por defecto ETL_TENANTS)")
+    run.add_argument("--procesos", type=int, help="tenants simultáneos (por defecto ETL_TENANTS_PROCESOS)")
+
+    sub.add_parser("list", help="flujos disponibles, última carga y si siguen vigentes")
+    return parser
+
+def comando_list(args) -> int:
+    ultimas = ultimas_cargas()
+    vigentes = flujos_vigentes(list(FLUJOS))
+    print(f"{'flujo':<12} {'frescura':>9}  {'última carga':<17} estado")
+    for nombre in FLUJOS:
+        frescura = _frescura_seg(nombre) / 60
+        ultima = ultimas.get(nombre)
+        print(
+            f"{nombre:<12} {frescura:>5.0f} min  {f'{ultima:%Y-%m-%d %H:%M}' if ultima else '-':<17} "
+            f"{'vigente' if nombre in vigentes else 'se carga'}"
+        )
+    return 0
+
+def comando_run(args, tenant: Tenant | None = None, run_id: str | None = None) -> int:
+    global REANUDAR
+    ruta_tenants = args.tenants or os.getenv("ETL_TENANTS", "")
+    if tenant is None and ruta_tenants:
+        return ejecutar_tenants(cargar_tenants(ruta_tenants), args)
+
+    cfg = configurar(Config(desde=args.since, tenant=tenant, run_id=run_id))
+    cfg.imprimir()
+    if args.no_cache:
+        cfg.odata_cache = False
+
+    if args.resume is not None:
+        REANUDAR = True
+        sufijo = f"-{tenant.nombre}" if tenant else ""
+        if args.resume:
+            cfg.run_id = args.resume + sufijo
+        elif not (os.getenv("ETL_RUN_ID") or os.getenv("GITHUB_RUN_ID")):
+            cfg.run_id = get_checkpoints().ultima_corrida(sufijo) or cfg.run_id
+        get_checkpoints().run_id = cfg.run_id
+        if not cfg.odata_cache:
+            print("⚠️ --resume sin caché: solo se omiten los flujos ya cargados")
+        marcas = get_checkpoints().resumen()
+        print(f"♻️ Reanudando corrida {cfg.run_id}: {marcas.get('flujo', 0)} flujos y {marcas.get('pagina', 0)} páginas completas")
+
+    concurrencia = args.concurrencia or cfg.etl_max_concurrencia
+    if args.profile:
+        activar_perfiles()
+        # tracemalloc mide todo el proceso: un flujo a la vez para atribuir la memoria
+        concurrencia = 1
+
+    asegurar_schema()
+    flujos = {n: FLUJOS[n] for n in (args.only or FLUJOS)}
+    omitir = {} if args.force else flujos_vigentes(list(flujos))
+    resultados = ejecutar_flujos(flujos, concurrencia, omitir)
+    return 1 if any(r["estado"] == "error" for r in resultados) else 0
+
+def main(argv: list[str] | None = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    # `python etl_byd.py [--flags]` sigue funcionando: sin subcomando se asume run
+    if not argv or (argv[0] not in ("run", "list") and argv[0] not in ("-h", "--help")):
+        argv = ["run", *argv]
+    args = construir_parser().parse_args(argv)
+    return comando_list(args) if args.comando == "list" else comando_run(args)
+
+# ========= MAIN =========
+if __name__ == "__main__":
+    sys.exit(main())